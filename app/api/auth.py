@@ -1,13 +1,34 @@
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
 
-from app.models.user import User, UserCreate
-from app.auth.password import hash_password, verify_password
+from app.models.user import User, UserCreate, UserUpdate
+from app.auth.password import (
+    hash_password_async,
+    verify_password_async,
+    password_pool,
+    PasswordPoolSaturated
+)
 from app.auth.jwt import create_access_token, decode_access_token, TokenData
+from app.auth.user_cache import user_cache
+from app.core.pagination import paginate, model_projection, AfterQuery, LimitQuery
+from app.core.serialization import page_response
+from app.models.page import Page
 from app.db.database import user_collection
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def password_pool_busy(exc: PasswordPoolSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, please retry shortly",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -16,7 +37,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     try:
         token_data = decode_access_token(token)
     except Exception as e:
-        print("JWT decode error:", e)
+        logger.info("Rejected token: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials (decode error)",
@@ -30,17 +51,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = await user_collection.find_one({"_id": ObjectId(token_data.user_id)})
+    user = user_cache.get(token_data.user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return User(**user)
+        user_doc = await user_collection.find_one({"_id": ObjectId(token_data.user_id)})
+        if user_doc is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user = User(**user_doc)
+        user_cache.set(token_data.user_id, user)
+
+    if user.disabled:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
+    return user
 
 def require_hr_or_admin(current_user: User = Depends(get_current_user)):
-    print(f"User role from token: {current_user.role}")
+    logger.debug("User role from token: %s", current_user.role)
     if current_user.role not in ["HR Manager", "Admin"]:  # fixed role string "HR Manager"
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -48,6 +76,14 @@ def require_hr_or_admin(current_user: User = Depends(get_current_user)):
         )
     return current_user
 
+def require_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "Admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Operation not permitted for this user role: {current_user.role}",
+        )
+    return current_user
+
 @router.post("/register", response_model=User)
 async def register_user(user_data: UserCreate):
     existing_user = await user_collection.find_one({"username": user_data.username})
@@ -57,7 +93,10 @@ async def register_user(user_data: UserCreate):
             detail="User with this username already exists",
         )
 
-    hashed = hash_password(user_data.password)
+    try:
+        hashed = await hash_password_async(user_data.password)
+    except PasswordPoolSaturated as exc:
+        raise password_pool_busy(exc)
     user_object = {
         "username": user_data.username,
         "email": user_data.email,
@@ -74,7 +113,14 @@ async def register_user(user_data: UserCreate):
 @router.post("/login")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await user_collection.find_one({"username": form_data.username})
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    try:
+        password_ok = user is not None and await verify_password_async(
+            form_data.password, user["hashed_password"]
+        )
+    except PasswordPoolSaturated as exc:
+        raise password_pool_busy(exc)
+
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -121,11 +167,77 @@ async def get_employee_details(
     
     return User(**employee)
 
-@router.get("/employees", response_model=list[User])
-async def get_all_employees(current_user: User = Depends(require_hr_or_admin)):
+@router.get("/employees", response_model=Page[User])
+async def get_all_employees(
+    after: str | None = AfterQuery,
+    limit: int = LimitQuery,
+    current_user: User = Depends(require_hr_or_admin)
+):
     """
-    Get a list of all employees.
+    Get a page of employees, ordered by ID.
     Requires HR Manager or Admin role.
     """
-    employees = await user_collection.find({}).to_list(None)
-    return [User(**emp) for emp in employees]
+    page = await paginate(
+        user_collection,
+        {},
+        sort_field="_id",
+        projection=model_projection(User),
+        after=after,
+        limit=limit
+    )
+    return page_response(User, page)
+
+@router.patch("/employees/{employee_id}", response_model=User)
+async def update_employee(
+    employee_id: str,
+    update: UserUpdate,
+    current_user: User = Depends(require_admin)
+):
+    """
+    Change an employee's role or disable/enable their account.
+    Requires Admin role. The cached identity is dropped so the change
+    applies to the employee's next request.
+    """
+    changes = update.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No changes supplied",
+        )
+
+    try:
+        employee = await user_collection.find_one_and_update(
+            {"_id": ObjectId(employee_id)},
+            {"$set": changes},
+            return_document=ReturnDocument.AFTER
+        )
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid employee ID format",
+        )
+
+    if employee is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Employee not found",
+        )
+
+    user_cache.invalidate(str(ObjectId(employee_id)))
+    return User(**employee)
+
+@router.get("/user-cache/stats")
+async def get_user_cache_stats(current_user: User = Depends(require_admin)):
+    """
+    Hit/miss counters and occupancy of the authenticated-user cache.
+    Requires Admin role.
+    """
+    return user_cache.stats()
+
+@router.get("/password-pool/stats")
+async def get_password_pool_stats(current_user: User = Depends(require_admin)):
+    """
+    Queue depth, rejections and timings of the bcrypt worker pool.
+    Requires Admin role.
+    """
+    return password_pool.stats()
@@ -1,28 +1,48 @@
 # app/api/documents.py
-import os
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import FileResponse
+import zipfile
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File, Form, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 from bson import ObjectId
+from pymongo import DESCENDING
 
 from app.models.document import Document
-from app.models.document import DocumentVersion
+from app.models.document import DocumentVersion, BulkUploadItem, BulkUploadResult, SearchHit
 from app.models.user import User
+from app.models.page import Page
 
-from app.db.database import document_collection, version_collection
-from app.api.auth import get_current_user, require_hr_or_admin
+from app.db.database import document_collection, find_one_routed, version_collection
+from app.api.auth import get_current_user, require_hr_or_admin, require_admin
 
 from app.core.document import (
     handle_document_upload,
     check_out_document,
-    check_in_document
+    wait_and_check_out,
+    check_in_document,
+    media_type_for
 )
+from app.core.bulk import ArchiveTooLarge, handle_bulk_upload, multipart_sources, zip_sources
+from app.core.export import stream_employee_archive
+from app.core.search import search_documents
+from app.core.jobs import job_queue
 from app.core.validator import validate_object_id
+from app.config import settings
+from app.core.http_cache import REVALIDATE_CACHE_CONTROL, version_etag, validator_headers, is_not_modified
+from app.core.ranges import range_response
+from app.core.blobs import open_blob
+from app.core.metrics import metered_range_reader
+from app.core.pagination import paginate, model_projection, AfterQuery, LimitQuery
+from app.core.serialization import page_response
+from app.core.admission import AdmittedUploadRoute, upload_admission
+from app.core.diff import MEDIA_TYPES, DiffTooLarge, NotText, diff_cache, diff_key, prepare_diff, stream_diff
 
 router = APIRouter()
+# Routes that receive file contents, admitted before their body is read
+upload_router = APIRouter(route_class=AdmittedUploadRoute)
 
 
-@router.post("/documents/upload")
+@upload_router.post("/documents/upload")
 async def upload_document(
     employee_id: str,
     document_type: str,
@@ -41,10 +61,121 @@ async def upload_document(
     return result
 
 
-@router.get("/documents/my-documents", response_model=List[Document])
-async def get_my_documents(current_user: User = Depends(get_current_user)):
-    docs = await document_collection.find({"employee_id": current_user.id}).to_list(100)
-    return docs
+@upload_router.post("/documents/bulk-upload", response_model=List[BulkUploadResult])
+async def bulk_upload_documents(
+    manifest: str = Form(..., description="JSON list of {filename, employee_id, document_type}"),
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(default=None, description="Zip archive holding the files"),
+    current_user: User = Depends(require_hr_or_admin)
+):
+    """
+    Upload many documents at once, either as multipart `files` or as one zip
+    `archive`, following the same versioning rules as a single upload.
+    Returns one result per manifest entry; failed entries do not fail the batch.
+    """
+    try:
+        items = TypeAdapter(List[BulkUploadItem]).validate_json(manifest)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid manifest: {e.errors(include_url=False)}",
+        )
+
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Manifest is empty")
+    if len(items) > settings.bulk_upload_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {settings.bulk_upload_max_items} items",
+        )
+
+    if archive is not None:
+        try:
+            sources = await zip_sources(archive)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Archive is not a valid zip file")
+        except ArchiveTooLarge as exc:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc))
+    else:
+        sources = multipart_sources(files)
+
+    return await handle_bulk_upload(items, sources, uploader_id=str(current_user.id))
+
+
+@router.get("/documents/my-documents", response_model=Page[Document])
+async def get_my_documents(
+    after: Optional[str] = AfterQuery,
+    limit: int = LimitQuery,
+    current_user: User = Depends(get_current_user)
+):
+    page = await paginate(
+        document_collection.reads("listing"),
+        {"employee_id": current_user.id},
+        sort_field="_id",
+        projection=model_projection(Document),
+        after=after,
+        limit=limit
+    )
+    return page_response(Document, page)
+
+@router.get("/documents/jobs/stats")
+async def get_job_stats(current_user: User = Depends(require_admin)):
+    """
+    Depth and lag of the background processing queue (search indexing,
+    storage encoding). Requires Admin role.
+    """
+    return await job_queue.stats()
+
+@router.get("/documents/uploads/admission")
+async def get_upload_admission(current_user: User = Depends(require_admin)):
+    """
+    In-flight uploads and bytes against their limits, rejection counters,
+    and the users currently holding upload quota, for this process.
+    Requires Admin role.
+    """
+    return upload_admission.utilization()
+
+@router.get("/documents/search", response_model=List[SearchHit])
+async def search_document_contents(
+    q: str = Query(..., min_length=1, max_length=512, description="Free-text query"),
+    employee_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full-text search over the latest version of each document, best match
+    first. Employees only ever search their own documents; HR Managers and
+    Admins search everyone's, or one employee's with `employee_id`.
+    """
+    is_privileged = current_user.role in ["HR Manager", "Admin"]
+    if not is_privileged:
+        scope = current_user.id
+    elif employee_id is not None:
+        try:
+            scope = validate_object_id(employee_id)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    else:
+        scope = None
+
+    hits = await search_documents(q, employee_id=scope, limit=limit)
+    docs = {
+        doc["_id"]: doc
+        async for doc in document_collection.find(
+            {"_id": {"$in": [hit["document_id"] for hit in hits]}},
+            model_projection(Document)
+        )
+    }
+    return [
+        SearchHit(
+            document=Document(**docs[hit["document_id"]]),
+            version_number=hit["version_number"],
+            score=hit["score"],
+            matched_terms=hit["matched_terms"]
+        )
+        for hit in hits
+        if hit["document_id"] in docs
+    ]
 
 @router.get("/documents/{doc_id}", response_model=Document)
 async def get_document(doc_id: str, current_user: User = Depends(get_current_user)):
@@ -78,68 +209,239 @@ async def get_document(doc_id: str, current_user: User = Depends(get_current_use
     
     return Document(**doc)
 
-@router.get("/documents/user/{employee_id}", response_model=List[Document])
-async def get_user_documents(employee_id: str, current_user: User = Depends(require_hr_or_admin)):
-    docs = await document_collection.find({"employee_id": ObjectId(employee_id)}).to_list(100)
-    return docs
+@router.get("/documents/user/{employee_id}", response_model=Page[Document])
+async def get_user_documents(
+    employee_id: str,
+    after: Optional[str] = AfterQuery,
+    limit: int = LimitQuery,
+    current_user: User = Depends(require_hr_or_admin)
+):
+    page = await paginate(
+        document_collection.reads("listing"),
+        {"employee_id": ObjectId(employee_id)},
+        sort_field="_id",
+        projection=model_projection(Document),
+        after=after,
+        limit=limit
+    )
+    return page_response(Document, page)
+
+@router.get("/documents/user/{employee_id}/export")
+async def export_user_documents(
+    employee_id: str,
+    include_history: bool = False,
+    current_user: User = Depends(require_hr_or_admin)
+):
+    """
+    Download a zip of every current document of an employee, or of every
+    version with `include_history=true`. The archive is streamed as it is
+    built, for audits and offboarding.
+    """
+    try:
+        validate_object_id(employee_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    suffix = "history" if include_history else "documents"
+    return StreamingResponse(
+        stream_employee_archive(employee_id, include_history),
+        media_type="application/zip",
+        headers={"content-disposition": f'attachment; filename="employee-{employee_id}-{suffix}.zip"'}
+    )
 
-@router.get("/documents/{doc_id}/versions", response_model=List[DocumentVersion]) # Keep response_model
-async def list_document_versions(doc_id: str, current_user: User = Depends(get_current_user)):
+@router.get("/documents/{doc_id}/versions", response_model=Page[DocumentVersion]) # Keep response_model
+async def list_document_versions(
+    doc_id: str,
+    after: Optional[str] = AfterQuery,
+    limit: int = LimitQuery,
+    current_user: User = Depends(get_current_user)
+):
     """
-    Returns all versions for a given document.
+    Returns the versions of a given document, newest first, one page at a time.
     """
     # Fetch raw data from MongoDB
-    versions_cursor = version_collection.find({"document_id": ObjectId(doc_id)}).sort("version_number", -1)
-    versions_list = await versions_cursor.to_list(100)
+    query = {"document_id": ObjectId(doc_id)}
+    options = dict(
+        sort_field="version_number",
+        descending=True,
+        projection=model_projection(DocumentVersion),
+        after=after,
+        limit=limit
+    )
+    versions = version_collection.reads("listing")
+    page = await paginate(versions, query, **options)
+    if not page["items"] and after is None and versions is not version_collection:
+        # A document this new may not have reached the secondaries yet
+        page = await paginate(version_collection, query, **options)
 
-    if not versions_list:
+    if not page["items"] and after is None:
         raise HTTPException(status_code=404, detail="No versions found for this document.")
 
-    # Explicitly parse the list of dicts into a list of DocumentVersion models
-    # This ensures Pydantic's json_encoders are properly applied
-    response_data = [DocumentVersion(**v) for v in versions_list]
-    
-    return response_data
+    return page_response(DocumentVersion, page)
 
-@router.get("/documents/download/{doc_id}/version/{version_num}")
-async def download_document_version(
-    doc_id: str, 
-    version_num: int, 
-    current_user: User = Depends(get_current_user)
-):
-    doc = await document_collection.find_one({"_id": ObjectId(doc_id)})
+# Everything a download needs from the master, so one read serves the
+# authorization check and, through `latest`, the newest version's content
+_DOWNLOAD_PROJECTION = {"employee_id": 1, "original_filename": 1, "latest_version": 1, "latest": 1}
+
+
+async def _downloadable_document(doc_id: str, current_user: User) -> dict:
+    doc = await find_one_routed(document_collection, "download", {"_id": ObjectId(doc_id)}, _DOWNLOAD_PROJECTION)
     if not doc:
         raise HTTPException(404, "Document not found")
     is_owner = doc["employee_id"] == current_user.id
     is_privileged = current_user.role in ["HR Manager", "Admin"]
     if not is_owner and not is_privileged:
         raise HTTPException(403, "Not authorized")
+    return doc
+
+
+async def _serve_version(request: Request, doc: dict, version: dict, headers: dict) -> Response:
+    if is_not_modified(request.headers, headers["etag"], version["created_at"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    version = await version_collection.find_one({
-        "document_id": ObjectId(doc_id),
-        "version_number": version_num
-    })
-    if not version or not os.path.exists(version["file_path"]):
+    media_type = version.get("media_type") or media_type_for(doc["original_filename"])
+
+    # Resolves raw files directly and decodes compressed/delta blobs
+    opened = await open_blob(version)
+    if opened is None:
         raise HTTPException(404, "Version/file missing")
-    
-    file_ext = os.path.splitext(doc["original_filename"])[1].lower()
-    media_type_map = {
-        ".doc": "application/msword",
-        ".txt": "text/plain"
-    }
-    
-    media_type = media_type_map.get(file_ext, "application/octet-stream")
-    
-    return FileResponse(
-        path=version["file_path"],
+    size, read_range = opened
+
+    return range_response(
+        request,
+        size=size,
+        read_range=metered_range_reader(read_range),
+        media_type=media_type,
         filename=doc["original_filename"],
-        media_type=media_type
+        headers=headers
+    )
+
+
+@router.get("/documents/download/{doc_id}/version/{version_num}")
+async def download_document_version(
+    doc_id: str, 
+    version_num: int, 
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Downloads a specific version of a document.
+    Versions are immutable, so responses carry a strong ETag and long-lived
+    cache headers, conditional requests are answered with 304, and single or
+    multi-part Range requests are served as partial content.
+    """
+    doc = await _downloadable_document(doc_id, current_user)
+
+    latest = doc.get("latest")
+    if latest and latest["version_number"] == version_num:
+        version = latest
+    else:
+        version = await find_one_routed(version_collection, "download", {
+            "document_id": ObjectId(doc_id),
+            "version_number": version_num
+        })
+        if not version:
+            raise HTTPException(404, "Version/file missing")
+
+    headers = validator_headers(version_etag(version), version["created_at"])
+    return await _serve_version(request, doc, version, headers)
+
+@router.get("/documents/{doc_id}/latest")
+async def download_latest_version(
+    doc_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Downloads the newest version of a document, served from the pointer kept
+    on the master record. Responses must be revalidated (the ETag changes
+    with every new version); Content-Location names the immutable URL of the
+    version that was served.
+    """
+    doc = await _downloadable_document(doc_id, current_user)
+
+    version = doc.get("latest")
+    if not version or version["version_number"] != doc.get("latest_version"):
+        # Masters written before the pointer existed, or an upload between
+        # its version-number allocation and pointer update
+        version = await find_one_routed(
+            version_collection,
+            "download",
+            {"document_id": ObjectId(doc_id)},
+            sort=[("version_number", DESCENDING)]
+        )
+        if not version:
+            raise HTTPException(404, "Version/file missing")
+
+    headers = validator_headers(version_etag(version), version["created_at"], REVALIDATE_CACHE_CONTROL)
+    headers["content-location"] = f"/documents/download/{doc_id}/version/{version['version_number']}"
+    return await _serve_version(request, doc, version, headers)
+
+@router.get("/documents/{doc_id}/diff")
+async def diff_document_versions(
+    doc_id: str,
+    request: Request,
+    from_version: int = Query(..., alias="from", ge=1, description="Version to compare from"),
+    to_version: int = Query(..., alias="to", ge=1, description="Version to compare to"),
+    output: str = Query("unified", alias="format", pattern="^(unified|lines)$"),
+    context: int = Query(3, ge=0, le=100, description="Unchanged lines around each change (unified only)"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Line diff between two versions of a text document (UTF-8 or UTF-16),
+    streamed as a unified diff or as one JSON object per changed line.
+    Both versions are immutable, so diffs are cached and carry a strong
+    ETag.
+    """
+    doc = await _downloadable_document(doc_id, current_user)
+    if output == "lines":
+        context = 0
+
+    versions = {
+        version["version_number"]: version
+        async for version in version_collection.find({
+            "document_id": ObjectId(doc_id),
+            "version_number": {"$in": [from_version, to_version]}
+        })
+    }
+    if from_version not in versions or to_version not in versions:
+        raise HTTPException(404, "Version/file missing")
+    old, new = versions[from_version], versions[to_version]
+
+    # Built from both versions' validators, without their quotes
+    etag = f'"{version_etag(old)[1:-1]}:{version_etag(new)[1:-1]}:{output}:{context}"'
+    modified_at = max(old["created_at"], new["created_at"])
+    headers = validator_headers(etag, modified_at)
+    if is_not_modified(request.headers, etag, modified_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = diff_key(old, new, output, context)
+    cached = diff_cache.get(key)
+    if cached is not None:
+        return Response(cached, media_type=MEDIA_TYPES[output], headers=headers)
+
+    old_opened, new_opened = await open_blob(old), await open_blob(new)
+    if old_opened is None or new_opened is None:
+        raise HTTPException(404, "Version/file missing")
+    try:
+        prepared = await prepare_diff(old_opened, from_version, new_opened, to_version, context)
+    except NotText as exc:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, str(exc))
+    except DiffTooLarge as exc:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, str(exc))
+
+    filename = doc["original_filename"]
+    return StreamingResponse(
+        stream_diff(prepared, output, f"{filename}\tversion {from_version}", f"{filename}\tversion {to_version}", key),
+        media_type=MEDIA_TYPES[output],
+        headers=headers
     )
 
 @router.post("/documents/{doc_id}/checkout")
 async def checkout_document(doc_id: str, current_user: User = Depends(get_current_user)):
     """
     Locks a document for exclusive editing, if not already checked out.
+    The lock is a lease; checking out again before it expires renews it.
     """
     data, status = await check_out_document(doc_id, user_id=str(current_user.id))
     if status == 409:
@@ -148,7 +450,30 @@ async def checkout_document(doc_id: str, current_user: User = Depends(get_curren
         raise HTTPException(404, detail=data["error"])
     return data
 
-@router.post("/documents/{doc_id}/checkin")
+@router.post("/documents/{doc_id}/checkout/wait")
+async def wait_checkout_document(
+    doc_id: str,
+    timeout: float = Query(default=None, gt=0, description="Seconds to wait; capped at CHECKOUT_WAIT_MAX_SECONDS"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Long-poll checkout: if the document is locked, waits in line until it is
+    checked in or its lease expires, then checks it out. Clients waiting on
+    the same document are served in arrival order. Responds 409 if the
+    document is still locked when the timeout runs out.
+    """
+    try:
+        validate_object_id(doc_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    wait_seconds = min(timeout or settings.checkout_wait_max_seconds, settings.checkout_wait_max_seconds)
+    data, code = await wait_and_check_out(doc_id, str(current_user.id), wait_seconds)
+    if code != 200:
+        raise HTTPException(code, detail=data["error"])
+    return data
+
+@upload_router.post("/documents/{doc_id}/checkin")
 async def checkin_document(
     doc_id: str,
     file: UploadFile = File(...),
@@ -1,6 +1,15 @@
 # app/auth/password.py
 
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
+
+from app.config import settings
+
 MAX_PASSWORD_LENGTH = 72
 
 def hash_password(password: str) -> str:
@@ -23,3 +32,99 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     
     # Use bcrypt's checkpw function to securely compare the two
     return bcrypt.checkpw(truncated_password, hashed_password_bytes)
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when the password pool already has its maximum of pending jobs."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+class PasswordHasherPool:
+    """
+    Runs bcrypt work on a dedicated thread pool so it never blocks the event
+    loop. bcrypt releases the GIL while hashing, so threads scale across cores.
+
+    At most `max_pending` jobs (running plus queued) are admitted; beyond that
+    callers get PasswordPoolSaturated instead of an unbounded wait.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Guards the counters updated from worker threads
+        self._lock = threading.Lock()
+
+        self.pending = 0
+        self.running = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds_total = 0.0
+        self.service_seconds_total = 0.0
+
+    def _run_timed(self, submitted_at: float, fn, *args):
+        started = time.perf_counter()
+        with self._lock:
+            self.queue_wait_seconds_total += started - submitted_at
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.service_seconds_total += time.perf_counter() - started
+
+    def _retry_after(self) -> int:
+        average = self.service_seconds_total / self.completed if self.completed else 0.25
+        return max(1, math.ceil(self.pending / self.workers * average))
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolSaturated(retry_after=self._retry_after())
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor, self._run_timed, time.perf_counter(), fn, *args
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "running": self.running,
+            "queued": max(self.pending - self.running, 0),
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds_total": self.queue_wait_seconds_total,
+            "service_seconds_total": self.service_seconds_total,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordHasherPool(
+    workers=settings.password_pool_workers,
+    max_pending=settings.password_pool_max_pending
+)
+
+async def hash_password_async(password: str) -> str:
+    """hash_password, run on the password pool."""
+    return await password_pool.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password, run on the password pool."""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
@@ -0,0 +1,74 @@
+# app/auth/user_cache.py
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.models.user import User
+
+
+class UserCache:
+    """
+    A bounded in-process LRU cache of authenticated users with a TTL.
+
+    `get_current_user` consults it before querying the users collection.
+    Entries must be invalidated whenever a user's role or disabled flag
+    changes; the TTL caps how long other worker processes, which cannot see
+    that invalidation, keep serving the old value.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def set(self, user_id: str, user: User) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Shared by every request handled in this process
+user_cache = UserCache(
+    max_size=settings.user_cache_max_size,
+    ttl_seconds=settings.user_cache_ttl_seconds
+)
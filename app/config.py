@@ -14,12 +14,135 @@ class Settings(BaseSettings):
     # MongoDB Settings
     mongodb_uri: str
     database_name: str
+    # Connections per worker process. Requests wait up to the wait-queue
+    # timeout for a free connection (0 waits indefinitely); the minimum is
+    # opened at startup.
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_wait_queue_timeout_seconds: float = 0.0
+    # Wire compression, e.g. "zstd,zlib" (zstd and snappy need their
+    # python packages); empty disables it
+    mongo_compressors: str = ""
+    # Read preference per kind of read: primary, primaryPreferred,
+    # secondary, secondaryPreferred or nearest. Secondaries more than
+    # max staleness behind the primary are not used (minimum 90).
+    mongo_listing_read_preference: str = "primary"
+    mongo_download_read_preference: str = "primary"
+    mongo_max_staleness_seconds: int = 90
 
     # JWT Authentication Settings
     jwt_secret_key: str
     jwt_algorithm: str
     access_token_expire_minutes: int
 
+    # Authenticated User Cache Settings
+    # Entries expire after the TTL even without an explicit invalidation,
+    # which bounds staleness across multiple worker processes.
+    user_cache_max_size: int = 10_000
+    user_cache_ttl_seconds: float = 60.0
+
+    # Password Hashing Pool Settings
+    # bcrypt runs on this many threads; requests beyond max_pending jobs
+    # are rejected with 503 instead of queueing without bound.
+    password_pool_workers: int = 4
+    password_pool_max_pending: int = 64
+
+    # Bulk Ingestion Settings
+    bulk_upload_max_items: int = 500
+    bulk_upload_concurrency: int = 8
+    # A zip archive is refused before anything is stored if it has more
+    # members, or declares a larger member or total uncompressed size, than
+    # these. The declared sizes come from the archive itself, so the byte
+    # limits are enforced again while members are read.
+    bulk_archive_max_members: int = 1000
+    bulk_archive_max_member_bytes: int = 256 * 1024 * 1024
+    bulk_archive_max_total_bytes: int = 2 * 1024 * 1024 * 1024
+
+    # Upload Admission Settings
+    # Per worker process: uploads, check-ins and bulk uploads beyond
+    # upload_max_in_flight requests or upload_max_in_flight_bytes declared
+    # bytes in progress get 503. Each user's token buckets refill at
+    # upload_user_requests_per_second and upload_user_bytes_per_second up
+    # to the burst sizes; an empty bucket gets 429. 0 disables a limit.
+    upload_max_in_flight: int = 16
+    upload_max_in_flight_bytes: int = 512 * 1024 * 1024
+    upload_user_requests_per_second: float = 5.0
+    upload_user_request_burst: int = 20
+    upload_user_bytes_per_second: int = 20 * 1024 * 1024
+    upload_user_byte_burst: int = 200 * 1024 * 1024
+
+    # Storage Settings
+    # "local" keeps files under STORAGE_ROOT, fanned out into
+    # STORAGE_FANOUT_LEVELS levels of 2-character directories. "gridfs" keeps
+    # them in the GridFS bucket GRIDFS_BUCKET, and uses STORAGE_ROOT only for
+    # staging uploads and for a read-through cache of up to
+    # STORAGE_CACHE_MAX_BYTES, holding objects up to
+    # STORAGE_CACHE_MAX_OBJECT_BYTES each.
+    storage_backend: str = "local"
+    storage_root: str = "uploads"
+    storage_fanout_levels: int = 2
+    gridfs_bucket: str = "blob_files"
+    gridfs_chunk_size_bytes: int = 255 * 1024
+    storage_cache_max_bytes: int = 1024 * 1024 * 1024
+    storage_cache_max_object_bytes: int = 64 * 1024 * 1024
+
+    # Version Storage Encoding Settings
+    # "raw" stores files as uploaded, "zlib" compresses every blob, and
+    # "delta" stores new versions as compressed deltas against the previous
+    # version, with a full compressed snapshot at least every
+    # delta_max_chain_length versions.
+    blob_encoding: str = "raw"
+    delta_max_chain_length: int = 8
+    delta_max_bytes: int = 8 * 1024 * 1024
+    # Deltas are matched line by line; a version or base with more lines
+    # than this is stored as a zlib snapshot instead, which bounds the time
+    # an encode job spends on files of many short lines.
+    delta_max_lines: int = 100_000
+    decoded_blob_cache_max_bytes: int = 64 * 1024 * 1024
+    # How long the raw file of a re-encoded blob is kept for in-flight readers
+    raw_blob_grace_seconds: float = 300.0
+
+    # Packfile Settings
+    # Blobs older than pack_cold_after_days whose versions are all old and
+    # none the latest are moved into packfiles of up to pack_max_bytes.
+    # A pack_interval_seconds of 0 disables the periodic compaction job.
+    pack_cold_after_days: float = 30
+    pack_max_bytes: int = 256 * 1024 * 1024
+    pack_max_blob_bytes: int = 16 * 1024 * 1024
+    pack_interval_seconds: float = 24 * 3600
+    pack_batch_size: int = 500
+
+    # Full-Text Search Settings
+    # Versions larger than this are not indexed. A query reads at most
+    # search_max_postings postings, split evenly across its terms and taking
+    # the highest term frequencies of each.
+    search_max_index_bytes: int = 8 * 1024 * 1024
+    search_max_postings: int = 50_000
+
+    # Background Job Settings
+    job_workers: int = 2
+    job_poll_interval_seconds: float = 1.0
+    job_lease_seconds: float = 300.0
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_retention_seconds: int = 7 * 24 * 3600
+    # "thread" or "process"
+    job_cpu_pool: str = "thread"
+    job_cpu_workers: int = 2
+
+    # Version Diff Settings
+    # Versions are compared up to their first difference in constant memory;
+    # past it, at most diff_max_chars characters of each are diffed (413
+    # beyond that). Rendered diffs are cached in a diff_cache_max_bytes LRU.
+    diff_max_chars: int = 16 * 1024 * 1024
+    diff_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # Checkout Settings
+    # A checkout not renewed or checked in within this time lapses.
+    checkout_lease_seconds: int = 1800
+    checkout_wait_max_seconds: float = 60.0
+    checkout_wait_poll_seconds: float = 5.0
+
     # This model_config dictionary tells Pydantic how to behave.
     model_config = SettingsConfigDict(
         # Specifies the name of the file to load environment variables from.
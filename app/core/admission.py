@@ -0,0 +1,295 @@
+# app/core/admission.py
+"""
+Admission control for uploads, so one client's bulk import cannot take all
+of the disk bandwidth and Mongo connections away from everyone else.
+
+Each worker process admits an upload only while fewer than
+UPLOAD_MAX_IN_FLIGHT uploads and UPLOAD_MAX_IN_FLIGHT_BYTES declared bytes
+are in progress; beyond that it answers 503. Each user also has two token
+buckets, one of requests and one of bytes, refilling at
+UPLOAD_USER_REQUESTS_PER_SECOND and UPLOAD_USER_BYTES_PER_SECOND up to their
+burst sizes; a user whose bucket is empty gets 429. Both come with a
+Retry-After header. A limit of 0 is disabled.
+
+Uploads are admitted before their body is read, on the Content-Length of
+the request, so a rejected upload costs no disk I/O at all.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+
+from app.auth.jwt import decode_access_token
+from app.config import settings
+
+# Idle users with full buckets are forgotten once more than this many are tracked
+MAX_TRACKED_USERS = 1024
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is not admitted; carries the response to send."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    `capacity` tokens, refilled at `rate` per second. Taking more than the
+    bucket holds is allowed once it is full and leaves it in debt, so a
+    request larger than the burst size is slowed down rather than refused
+    forever.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_seconds(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, 0 if it can be taken now."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class _UserQuota:
+    requests: Optional[TokenBucket]
+    bytes: Optional[TokenBucket]
+    in_flight: int = 0
+
+
+@dataclass
+class Ticket:
+    user: str
+    size: int
+    admitted_at: float
+
+
+class UploadAdmission:
+    """
+    The in-flight counters and per-user buckets of this process. Everything
+    runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_in_flight_bytes: int,
+        user_requests_per_second: float,
+        user_request_burst: int,
+        user_bytes_per_second: int,
+        user_byte_burst: int,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.user_requests_per_second = user_requests_per_second
+        self.user_request_burst = user_request_burst
+        self.user_bytes_per_second = user_bytes_per_second
+        self.user_byte_burst = user_byte_burst
+        self._clock = clock
+        self._users: dict[str, _UserQuota] = {}
+
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.peak_in_flight = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected_busy = 0
+        self.rejected_quota = 0
+        self.service_seconds_total = 0.0
+
+    @property
+    def limits_bytes(self) -> bool:
+        return self.max_in_flight_bytes > 0 or self.user_bytes_per_second > 0
+
+    def _quota(self, user: str, now: float) -> _UserQuota:
+        quota = self._users.get(user)
+        if quota is None:
+            if len(self._users) >= MAX_TRACKED_USERS:
+                self._forget_idle(now)
+            quota = _UserQuota(
+                requests=TokenBucket(self.user_requests_per_second, self.user_request_burst, now)
+                if self.user_requests_per_second > 0 else None,
+                bytes=TokenBucket(self.user_bytes_per_second, self.user_byte_burst, now)
+                if self.user_bytes_per_second > 0 else None,
+            )
+            self._users[user] = quota
+        return quota
+
+    def _forget_idle(self, now: float) -> None:
+        for user, quota in list(self._users.items()):
+            if quota.in_flight == 0 and all(
+                bucket is None or bucket.is_full(now) for bucket in (quota.requests, quota.bytes)
+            ):
+                del self._users[user]
+
+    def _busy_retry_after(self) -> int:
+        average = self.service_seconds_total / self.completed if self.completed else 1.0
+        return max(1, math.ceil(average))
+
+    def admit(self, user: str, size: int) -> Ticket:
+        """Admits an upload of `size` bytes by `user`, or raises UploadRejected."""
+        now = self._clock()
+        # An upload over the byte cap on its own is admitted when nothing else runs
+        over_bytes = (
+            self.max_in_flight_bytes > 0
+            and self.in_flight > 0
+            and self.in_flight_bytes + size > self.max_in_flight_bytes
+        )
+        if (self.max_in_flight > 0 and self.in_flight >= self.max_in_flight) or over_bytes:
+            self.rejected_busy += 1
+            raise UploadRejected(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "The server is busy with other uploads, please retry shortly",
+                self._busy_retry_after(),
+            )
+
+        quota = self._quota(user, now)
+        wait = max(
+            quota.requests.wait_seconds(1, now) if quota.requests else 0.0,
+            quota.bytes.wait_seconds(size, now) if quota.bytes else 0.0,
+        )
+        if wait > 0:
+            self.rejected_quota += 1
+            raise UploadRejected(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Upload rate limit exceeded, please retry later",
+                max(1, math.ceil(wait)),
+            )
+
+        if quota.requests:
+            quota.requests.take(1)
+        if quota.bytes:
+            quota.bytes.take(size)
+        quota.in_flight += 1
+        self.in_flight += 1
+        self.in_flight_bytes += size
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.admitted += 1
+        return Ticket(user, size, now)
+
+    def release(self, ticket: Ticket) -> None:
+        self.in_flight -= 1
+        self.in_flight_bytes -= ticket.size
+        self.completed += 1
+        self.service_seconds_total += self._clock() - ticket.admitted_at
+        quota = self._users.get(ticket.user)
+        if quota is not None:
+            quota.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "in_flight_bytes": self.in_flight_bytes,
+            "peak_in_flight": self.peak_in_flight,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected_busy": self.rejected_busy,
+            "rejected_quota": self.rejected_quota,
+            "service_seconds_total": self.service_seconds_total,
+        }
+
+    def utilization(self) -> dict:
+        """Current load against each limit, and the users currently holding quota."""
+        now = self._clock()
+        users = {}
+        for user, quota in self._users.items():
+            if quota.in_flight == 0 and all(
+                bucket is None or bucket.is_full(now) for bucket in (quota.requests, quota.bytes)
+            ):
+                continue
+            users[user] = {
+                "in_flight": quota.in_flight,
+                "request_tokens": round(quota.requests.tokens, 2) if quota.requests else None,
+                "byte_tokens": int(quota.bytes.tokens) if quota.bytes else None,
+            }
+        return {
+            "limits": {
+                "max_in_flight": self.max_in_flight,
+                "max_in_flight_bytes": self.max_in_flight_bytes,
+                "user_requests_per_second": self.user_requests_per_second,
+                "user_request_burst": self.user_request_burst,
+                "user_bytes_per_second": self.user_bytes_per_second,
+                "user_byte_burst": self.user_byte_burst,
+            },
+            "in_flight_utilization": self.in_flight / self.max_in_flight if self.max_in_flight else None,
+            "in_flight_bytes_utilization": (
+                self.in_flight_bytes / self.max_in_flight_bytes if self.max_in_flight_bytes else None
+            ),
+            **self.stats(),
+            "users": users,
+        }
+
+
+upload_admission = UploadAdmission(
+    max_in_flight=settings.upload_max_in_flight,
+    max_in_flight_bytes=settings.upload_max_in_flight_bytes,
+    user_requests_per_second=settings.upload_user_requests_per_second,
+    user_request_burst=settings.upload_user_request_burst,
+    user_bytes_per_second=settings.upload_user_bytes_per_second,
+    user_byte_burst=settings.upload_user_byte_burst
+)
+
+
+def _requester(request: Request) -> str:
+    """
+    The user id in the bearer token, without a database lookup; the route's
+    own dependencies still authenticate the request afterwards.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        user_id = decode_access_token(token).user_id
+        if user_id:
+            return user_id
+    return f"anonymous:{request.client.host if request.client else ''}"
+
+
+class AdmittedUploadRoute(APIRoute):
+    """A route whose requests pass upload admission before their body is read."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def admitted_handler(request: Request) -> Response:
+            length = request.headers.get("content-length")
+            if length is None and upload_admission.limits_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_411_LENGTH_REQUIRED,
+                    detail="Uploads must declare a Content-Length",
+                )
+            try:
+                ticket = upload_admission.admit(_requester(request), int(length or 0))
+            except UploadRejected as exc:
+                raise HTTPException(
+                    status_code=exc.status_code,
+                    detail=exc.detail,
+                    headers={"Retry-After": str(exc.retry_after)},
+                )
+            try:
+                return await handler(request)
+            finally:
+                upload_admission.release(ticket)
+
+        return admitted_handler
@@ -0,0 +1,564 @@
+# app/core/blobs.py
+
+import hashlib
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from contextlib import aclosing
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+
+from app.config import settings
+from app.core import compression
+from app.core.jobs import job, job_queue
+from app.core.packs import pack_files
+from app.core.ranges import RangeReader
+from app.core.storage import StoredFile, storage, stream_upload_to_disk
+from app.db.database import blob_collection
+
+# Blobs are stored once per distinct content, named by their SHA-256 digest;
+# encoded forms add a suffix to the name.
+ENCODED_SUFFIXES = {"raw": "", "zlib": ".z", "delta": ".delta"}
+
+# Job that deletes a file a blob no longer uses: its previous file once it
+# was re-encoded or migrated to another storage layout, or its only file
+# once it was released
+REMOVE_RAW_FILE = "remove_raw_file"
+
+logger = logging.getLogger(__name__)
+
+
+def blob_name(sha256: str, encoding: str = "raw") -> str:
+    return sha256 + ENCODED_SUFFIXES[encoding]
+
+
+async def _promote_file(path: str, sha256: str, existing: Optional[dict], keep_source: bool = False) -> str:
+    # Identical digests mean identical bytes, so replacing an existing raw
+    # blob is harmless. Doing it for new blobs guarantees the file is present
+    # even if a concurrent release removed an earlier copy. Blobs that were
+    # re-encoded or packed, or raw ones still present at a pre-migration
+    # location, are left alone.
+    final_pointer = storage.pointer(blob_name(sha256))
+    if existing is None or (
+        existing.get("encoding", "raw") == "raw"
+        and not existing.get("pack")
+        and not await storage.exists(existing["path"])
+    ):
+        place = storage.adopt if keep_source else storage.put
+        final_pointer = await place(path, blob_name(sha256))
+        if existing is not None and existing["path"] != final_pointer:
+            await blob_collection.update_one(
+                {"_id": sha256, "path": existing["path"]}, {"$set": {"path": final_pointer}}
+            )
+    elif not keep_source:
+        await run_in_threadpool(_remove_quietly, path)
+    # Versions point at the raw layout location even while an older copy
+    # of the blob is served from elsewhere; open_blob resolves by digest
+    return final_pointer
+
+
+async def _reference_file(path: str, size: int, sha256: str, keep_source: bool = False) -> StoredFile:
+    final_path = storage.pointer(blob_name(sha256))
+    try:
+        previous = await blob_collection.find_one_and_update(
+            {"_id": sha256},
+            {
+                "$inc": {"ref_count": 1},
+                "$setOnInsert": {
+                    "path": final_path,
+                    "size": size,
+                    "created_at": datetime.utcnow()
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except BaseException:
+        if not keep_source:
+            await run_in_threadpool(os.remove, path)
+        raise
+
+    final_path = await _promote_file(path, sha256, previous, keep_source)
+    return StoredFile(path=final_path, size=size, sha256=sha256)
+
+
+async def store_blob(file: UploadFile) -> StoredFile:
+    """
+    Streams an upload into the content-addressed store and takes one
+    reference on the resulting blob.
+
+    If a blob with the same digest already exists the staged copy is
+    discarded, so duplicate bytes are only ever kept once on disk.
+    """
+    staged_path = storage.staging_path()
+    staged = await stream_upload_to_disk(file, staged_path)
+    return await _reference_file(staged_path, staged.size, staged.sha256)
+
+
+def _hash_file(path: str) -> tuple[int, str]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(compression.CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+async def adopt_file(path: str) -> StoredFile:
+    """
+    Like store_blob for a file that is already on local disk, e.g. one
+    written before the blob store existed. The file itself is left in place.
+    """
+    size, sha256 = await run_in_threadpool(_hash_file, path)
+    return await _reference_file(path, size, sha256, keep_source=True)
+
+
+async def retain_blob(sha256: str, count: int = 1) -> None:
+    """
+    Takes additional references on an existing blob, e.g. when one staged
+    file backs several versions.
+    """
+    if count > 0:
+        await blob_collection.update_one({"_id": sha256}, {"$inc": {"ref_count": count}})
+
+
+async def release_blob(sha256: str) -> bool:
+    """
+    Drops one reference to a blob, deleting it once nothing refers to it.
+
+    Returns True if the blob was deleted. Its file is removed by a
+    REMOVE_RAW_FILE job after RAW_BLOB_GRACE_SECONDS, which leaves it alone
+    if the same content has been stored at that path again by then.
+    """
+    blob = await blob_collection.find_one_and_update(
+        {"_id": sha256},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["ref_count"] > 0:
+        return False
+
+    # Only delete if no new reference was taken in the meantime
+    result = await blob_collection.delete_one({"_id": sha256, "ref_count": {"$lte": 0}})
+    if result.deleted_count == 0:
+        return False
+
+    # Not removed here: an upload of the same content may re-create the
+    # record and the file between the delete above and this point
+    try:
+        await _schedule_removal(sha256, blob["path"])
+    except Exception:
+        logger.exception("Could not schedule removal of %s; reconcile will report it", blob["path"])
+
+    # A delta holds a reference on the blob it was encoded against
+    if blob.get("base"):
+        await release_blob(blob["base"])
+    return True
+
+
+class DecodedBlobCache:
+    """
+    A byte-bounded LRU of decoded blob contents, so hot versions stored as
+    deltas are not reconstructed on every download.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha256: str) -> Optional[bytes]:
+        data = self._entries.get(sha256)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(sha256)
+        self.hits += 1
+        return data
+
+    def set(self, sha256: str, data: bytes) -> None:
+        if len(data) > self.max_bytes or sha256 in self._entries:
+            return
+        self._entries[sha256] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+decoded_blob_cache = DecodedBlobCache(settings.decoded_blob_cache_max_bytes)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _get_blob(sha256: str) -> dict:
+    blob = await blob_collection.find_one({"_id": sha256})
+    if blob is None:
+        raise FileNotFoundError(f"Blob {sha256} does not exist")
+    return blob
+
+
+async def _read_pointer(pointer: str, start: int, end: int) -> bytes:
+    return b"".join([chunk async for chunk in storage.range_reader(pointer)(start, end)])
+
+
+async def _read_stored(blob: dict) -> bytes:
+    """
+    The stored (still encoded) bytes of a blob, from its pack or loose file,
+    read from the store itself when it has no local copy.
+    """
+    pack = blob.get("pack")
+    if pack:
+        path = await storage.cached_path(pack["path"])
+        if path is None:
+            return await _read_pointer(pack["path"], pack["offset"], pack["offset"] + pack["length"])
+        return await run_in_threadpool(pack_files.read, path, pack["offset"], pack["length"])
+    path = await storage.cached_path(blob["path"])
+    if path is None:
+        return await _read_pointer(blob["path"], 0, await storage.size(blob["path"]))
+    return await run_in_threadpool(_read_file, path)
+
+
+async def read_blob_bytes(blob: dict, depth: int = 0) -> bytes:
+    """
+    Returns the decoded contents of a blob, following delta chains down to
+    their snapshot. Results are kept in the decoded blob cache.
+    """
+    if depth > settings.delta_max_chain_length + 1:
+        raise ValueError(f"Delta chain of blob {blob['_id']} is too long or cyclic")
+    cached = decoded_blob_cache.get(blob["_id"])
+    if cached is not None:
+        return cached
+
+    encoding = blob.get("encoding", "raw")
+    if encoding == "raw":
+        data = await _read_stored(blob)
+    elif encoding == "zlib":
+        data = await run_in_threadpool(zlib.decompress, await _read_stored(blob))
+    elif encoding == "delta":
+        base = await read_blob_bytes(await _get_blob(blob["base"]), depth + 1)
+        delta = await _read_stored(blob)
+        data = await run_in_threadpool(compression.apply_delta, base, delta)
+    else:
+        raise ValueError(f"Unknown blob encoding: {encoding}")
+
+    decoded_blob_cache.set(blob["_id"], data)
+    return data
+
+
+def _bytes_range_reader(data: bytes) -> RangeReader:
+    async def read_range(start: int, end: int):
+        view = memoryview(data)
+        for offset in range(start, end, compression.CHUNK_SIZE):
+            yield bytes(view[offset:min(offset + compression.CHUNK_SIZE, end)])
+    return read_range
+
+
+async def _iterate_in_threadpool(chunks):
+    while True:
+        chunk = await run_in_threadpool(next, chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+async def _decompressed_range(compressed: AsyncIterator[bytes], start: int, end: int) -> AsyncIterator[bytes]:
+    """
+    Bytes [start, end) of deflated data arriving in chunks. Each chunk is
+    decompressed in the threadpool, and reading stops once `end` is reached.
+    """
+    decompressor = zlib.decompressobj()
+    position = 0
+    async with aclosing(compressed):
+        async for chunk in compressed:
+            data = await run_in_threadpool(decompressor.decompress, chunk)
+            chunk_start, position = position, position + len(data)
+            if data and position > start:
+                yield data[max(start - chunk_start, 0):end - chunk_start]
+            if position >= end:
+                return
+    data = decompressor.flush()
+    if data and position + len(data) > start:
+        yield data[max(start - position, 0):end - position]
+
+
+def _zlib_range_reader(pointer: str) -> RangeReader:
+    # Decompresses as the stored bytes stream in, from the local cache or
+    # straight from the store; nothing is copied to disk first
+    async def read_range(start: int, end: int):
+        compressed = storage.range_reader(pointer)(0, await storage.size(pointer))
+        async for chunk in _decompressed_range(compressed, start, end):
+            yield chunk
+    return read_range
+
+
+def _packed_range_reader(pack: dict) -> RangeReader:
+    # Slices the memory-mapped pack if it is on local disk, and otherwise
+    # reads just the blob's range from the store
+    async def read_range(start: int, end: int):
+        path = await storage.cached_path(pack["path"])
+        if path is None:
+            async for chunk in storage.range_reader(pack["path"])(pack["offset"] + start, pack["offset"] + end):
+                yield chunk
+            return
+        slices = pack_files.iter_slices(path, pack["offset"], start, end)
+        async for chunk in _iterate_in_threadpool(slices):
+            yield chunk
+    return read_range
+
+
+def _packed_zlib_range_reader(pack: dict) -> RangeReader:
+    async def read_range(start: int, end: int):
+        path = await storage.cached_path(pack["path"])
+        if path is None:
+            compressed = storage.range_reader(pack["path"])(pack["offset"], pack["offset"] + pack["length"])
+            async for chunk in _decompressed_range(compressed, start, end):
+                yield chunk
+            return
+        compressed = pack_files.iter_slices(path, pack["offset"], 0, pack["length"])
+        chunks = compression.iter_decompressed_chunks(compressed, start, end)
+        async for chunk in _iterate_in_threadpool(chunks):
+            yield chunk
+    return read_range
+
+
+async def open_blob(version: dict) -> Optional[tuple[int, RangeReader]]:
+    """
+    Resolves a stored version to its decoded size and a range reader,
+    or None if its content is missing.
+
+    A raw file at `file_path` is served directly without touching the blobs
+    collection; encoded and packed blobs are looked up by digest and decoded
+    on the fly.
+    """
+    path = version["file_path"]
+    if await storage.exists(path):
+        size = version.get("size")
+        if size is None:
+            size = await storage.size(path)
+        return size, storage.range_reader(path)
+
+    if not version.get("sha256"):
+        return None
+    blob = await blob_collection.find_one({"_id": version["sha256"]})
+    if blob is None:
+        return None
+
+    encoding = blob.get("encoding", "raw")
+    pack = blob.get("pack")
+    if pack:
+        if not await storage.exists(pack["path"]):
+            return None
+        if encoding == "raw":
+            return blob["size"], _packed_range_reader(pack)
+        if encoding == "zlib":
+            cached = decoded_blob_cache.get(blob["_id"])
+            if cached is not None:
+                return blob["size"], _bytes_range_reader(cached)
+            return blob["size"], _packed_zlib_range_reader(pack)
+        return blob["size"], _bytes_range_reader(await read_blob_bytes(blob))
+
+    if not await storage.exists(blob["path"]):
+        return None
+    if encoding == "raw":
+        return blob["size"], storage.range_reader(blob["path"])
+    if encoding == "zlib":
+        cached = decoded_blob_cache.get(blob["_id"])
+        if cached is not None:
+            return blob["size"], _bytes_range_reader(cached)
+        return blob["size"], _zlib_range_reader(blob["path"])
+    # Deltas are capped at delta_max_bytes, so rebuilding them in memory is bounded
+    return blob["size"], _bytes_range_reader(await read_blob_bytes(blob))
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _encode_delta(raw_path: str, base: bytes, delta_path: str, max_lines: int) -> Optional[int]:
+    """
+    Writes a delta of the raw file against `base`, unless either has more
+    than `max_lines` lines or a plain compressed snapshot would be smaller.
+    Returns the delta size, or None.
+    """
+    target = _read_file(raw_path)
+    if max(target.count(b"\n"), base.count(b"\n")) > max_lines:
+        return None
+    delta = compression.make_delta(base, target)
+    if len(delta) >= len(compression.zlib.compress(target, compression.COMPRESSION_LEVEL)):
+        return None
+    with open(delta_path, "wb") as f:
+        f.write(delta)
+    return len(delta)
+
+
+async def _chain_contains(base_sha256: str, sha256: str) -> bool:
+    """
+    Whether the delta chain starting at `base_sha256` passes through
+    `sha256`. A chain longer than any encode_blob builds counts as a yes.
+    """
+    current = base_sha256
+    for _ in range(settings.delta_max_chain_length + 2):
+        if current == sha256:
+            return True
+        blob = await blob_collection.find_one({"_id": current}, {"base": 1})
+        if blob is None or not blob.get("base"):
+            return False
+        current = blob["base"]
+    return True
+
+
+async def encode_blob(sha256: str, base_sha256: Optional[str] = None) -> Optional[str]:
+    """
+    Re-encodes a freshly stored raw blob according to BLOB_ENCODING.
+
+    In "delta" mode the blob is stored as a delta against `base_sha256`
+    (normally the previous version of the same document) when the base's
+    chain is shorter than DELTA_MAX_CHAIN_LENGTH and the delta beats a
+    compressed snapshot; otherwise it becomes a compressed snapshot.
+    Returns the encoding applied, or None if the blob was left alone.
+    """
+    mode = settings.blob_encoding
+    if mode not in ("zlib", "delta"):
+        return None
+
+    blob = await blob_collection.find_one({"_id": sha256})
+    if blob is None or blob.get("encoding", "raw") != "raw" or blob.get("pack"):
+        return None
+    raw_path = blob["path"]
+
+    base_blob = None
+    if (
+        mode == "delta"
+        and base_sha256
+        and base_sha256 != sha256
+        and blob["size"] <= settings.delta_max_bytes
+    ):
+        base_blob = await blob_collection.find_one({"_id": base_sha256})
+        if (
+            base_blob is None
+            or base_blob["size"] > settings.delta_max_bytes
+            or base_blob.get("chain_length", 0) + 1 > settings.delta_max_chain_length
+            # The base may itself be a delta against this blob
+            or await _chain_contains(base_sha256, sha256)
+        ):
+            base_blob = None
+
+    # A GridFS blob too large for the local cache is copied to a staging
+    # file for the encoders, and that copy removed afterwards
+    async with storage.local_file(raw_path) as raw_file:
+        staged_path = storage.staging_path()
+        update = None
+        if base_blob is not None:
+            base_bytes = await read_blob_bytes(base_blob)
+            stored_size = await job_queue.run_cpu_bound(
+                _encode_delta, raw_file, base_bytes, staged_path, settings.delta_max_lines
+            )
+            if stored_size is not None:
+                encoded_path = await storage.put(staged_path, blob_name(sha256, "delta"))
+                # Keep the base alive for as long as this delta exists
+                await retain_blob(base_sha256)
+                update = {
+                    "path": encoded_path,
+                    "encoding": "delta",
+                    "base": base_sha256,
+                    "chain_length": base_blob.get("chain_length", 0) + 1,
+                    "stored_size": stored_size
+                }
+
+        if update is None:
+            stored_size = await job_queue.run_cpu_bound(compression.compress_file, raw_file, staged_path)
+            encoded_path = await storage.put(staged_path, blob_name(sha256, "zlib"))
+            update = {"path": encoded_path, "encoding": "zlib", "chain_length": 0, "stored_size": stored_size}
+
+    result = await blob_collection.update_one({"_id": sha256, "path": raw_path, "pack": None}, {"$set": update})
+    if result.modified_count == 0:
+        # Encoded or packed concurrently, or released in the meantime
+        await storage.remove(encoded_path)
+        if update.get("base"):
+            await release_blob(update["base"])
+        return None
+
+    if update.get("base") and await _chain_contains(base_sha256, sha256):
+        # The base was re-encoded as a delta against this blob at the same
+        # time; this side goes back to raw, which breaks the cycle
+        reverted = await blob_collection.update_one(
+            {"_id": sha256, "path": encoded_path},
+            {"$set": {"path": raw_path, "encoding": "raw", "chain_length": 0}, "$unset": {"base": "", "stored_size": ""}}
+        )
+        if reverted.modified_count:
+            await storage.remove(encoded_path)
+            await release_blob(base_sha256)
+            return None
+
+    # A download or indexing job that resolved the raw path just before the
+    # update may still be about to open it, so it is removed after a grace
+    # period
+    try:
+        await _schedule_removal(sha256, raw_path)
+    except Exception:
+        await storage.remove(raw_path)
+    return update["encoding"]
+
+
+async def _schedule_removal(sha256: str, path: str) -> None:
+    """
+    Removes a file that blob `sha256` no longer uses, after the grace
+    period. The key is unique: the same digest can move or be released again.
+    """
+    await job_queue.enqueue(job(
+        REMOVE_RAW_FILE,
+        f"{sha256}:{ObjectId()}",
+        {"sha256": sha256, "path": path},
+        delay_seconds=settings.raw_blob_grace_seconds
+    ))
+
+
+async def _uses_path(sha256: str, path: str) -> bool:
+    blob = await blob_collection.find_one({"_id": sha256}, {"path": 1, "pack": 1})
+    return blob is not None and blob["path"] == path and not blob.get("pack")
+
+
+@job_queue.handler(REMOVE_RAW_FILE)
+async def _remove_raw_file(payload: dict) -> None:
+    """
+    Deletes a file blob `sha256` no longer uses. The file is first moved out
+    of place in one step, then the blob record is checked again: if the same
+    content was referenced and stored there in the meantime, the file is put
+    back instead of deleted.
+    """
+    sha256, path = payload["sha256"], payload["path"]
+    if await _uses_path(sha256, path):
+        # Released and stored there again since it moved
+        return
+    moved = await storage.quarantine(path, "removing")
+    if moved is None:
+        return
+    if await _uses_path(sha256, path):
+        # Unless a fresh copy is already there
+        await storage.restore(moved, path)
+    await storage.remove(moved)
\ No newline at end of file
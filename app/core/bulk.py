@@ -0,0 +1,251 @@
+# app/core/bulk.py
+
+import asyncio
+import posixpath
+import zipfile
+from typing import Callable
+
+from bson import ObjectId
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.config import settings
+from app.core.blobs import store_blob, retain_blob, release_blob
+from app.core.document import point_latest, require_writable, reserve_versions
+from app.core.processing import enqueue_version_processing
+from app.core.storage import StoredFile
+from app.core.validator import validate_object_id
+from app.db.database import version_collection
+from app.models.document import BulkUploadItem, DocumentVersion
+
+# Opens a fresh readable UploadFile for one source file of the batch
+SourceOpener = Callable[[], UploadFile]
+
+
+class ArchiveTooLarge(Exception):
+    """Raised when a zip archive exceeds the member count or uncompressed size limits."""
+
+
+class _BoundedMember:
+    """
+    A zip member that fails once more bytes come out of it than the member
+    limit, or than are left of the archive's total, whatever its header says.
+    """
+
+    def __init__(self, member, name: str, budget: dict):
+        self._member = member
+        self._name = name
+        self._budget = budget
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._member.read(size)
+        self._read += len(data)
+        self._budget["left"] -= len(data)
+        if self._read > settings.bulk_archive_max_member_bytes:
+            raise ArchiveTooLarge(f"{self._name} is larger than {settings.bulk_archive_max_member_bytes} bytes")
+        if self._budget["left"] < 0:
+            raise ArchiveTooLarge(f"Archive expands to more than {settings.bulk_archive_max_total_bytes} bytes")
+        return data
+
+    def close(self) -> None:
+        self._member.close()
+
+
+def multipart_sources(files: list[UploadFile]) -> dict[str, SourceOpener]:
+    return {file.filename: (lambda file=file: file) for file in files}
+
+
+async def zip_sources(archive: UploadFile) -> dict[str, SourceOpener]:
+    """
+    Exposes each member of an uploaded zip as a source. Members are read
+    lazily, in chunks, straight out of the spooled archive.
+
+    Raises ArchiveTooLarge, before anything is read, if the archive is over
+    the member count or declared size limits.
+    """
+    bundle = await run_in_threadpool(zipfile.ZipFile, archive.file)
+    members = [info for info in bundle.infolist() if not info.is_dir()]
+    if len(members) > settings.bulk_archive_max_members:
+        raise ArchiveTooLarge(f"Archive holds more than {settings.bulk_archive_max_members} files")
+    for info in members:
+        if info.file_size > settings.bulk_archive_max_member_bytes:
+            raise ArchiveTooLarge(f"{info.filename} is larger than {settings.bulk_archive_max_member_bytes} bytes")
+    if sum(info.file_size for info in members) > settings.bulk_archive_max_total_bytes:
+        raise ArchiveTooLarge(f"Archive expands to more than {settings.bulk_archive_max_total_bytes} bytes")
+
+    budget = {"left": settings.bulk_archive_max_total_bytes}
+
+    def opener(name: str) -> SourceOpener:
+        return lambda: UploadFile(
+            file=_BoundedMember(bundle.open(name), name, budget),
+            filename=posixpath.basename(name)
+        )
+
+    return {info.filename: opener(info.filename) for info in members}
+
+
+def _error(result: dict, status_code: int, message: str) -> None:
+    result.update(status="error", status_code=status_code, error=message)
+
+
+async def _stage_sources(names: set, sources: dict[str, SourceOpener]) -> dict:
+    """
+    Streams every distinct source file into the blob store, at most
+    `bulk_upload_concurrency` at a time. Returns filename -> StoredFile, or the
+    exception that stopped it.
+    """
+    semaphore = asyncio.Semaphore(settings.bulk_upload_concurrency)
+
+    async def stage(name: str):
+        async with semaphore:
+            upload = sources[name]()
+            try:
+                return name, await store_blob(upload)
+            except Exception as exc:
+                return name, exc
+            finally:
+                await upload.close()
+
+    return dict(await asyncio.gather(*(stage(name) for name in names)))
+
+
+async def _allocate_versions(batch: list[tuple[dict, dict]], uploader_id: str) -> None:
+    """
+    Applies the same versioning rules as handle_document_upload to a whole
+    batch: masters are matched on (employee_id, document_type, filename) while
+    not checked out (or while their checkout lease has expired), created if
+    missing, and their latest_version is bumped by the number of items
+    targeting them. Each master is reserved with one find_one_and_update, at
+    most `bulk_upload_concurrency` at a time, and its items take the numbers
+    ending at the latest_version it returns, so uploads running at the same
+    time can never be given the same numbers.
+    """
+    by_key: dict[tuple, list] = {}
+    for item, result in batch:
+        by_key.setdefault(tuple(item["key"].values()), []).append((item, result))
+    semaphore = asyncio.Semaphore(settings.bulk_upload_concurrency)
+
+    async def allocate(group: list[tuple[dict, dict]]) -> None:
+        async with semaphore:
+            try:
+                master = await reserve_versions(group[0][0]["key"], len(group), uploader_id)
+            except HTTPException as exc:
+                for _, result in group:
+                    _error(result, exc.status_code, exc.detail)
+                return
+            except PyMongoError as exc:
+                for _, result in group:
+                    _error(result, 500, f"Failed to update master document: {exc}")
+                return
+
+        first_version = master["latest_version"] - len(group) + 1
+        for offset, (item, result) in enumerate(group):
+            item["document_id"] = master["_id"]
+            result["document_id"] = str(master["_id"])
+            result["version"] = first_version + offset
+
+    await asyncio.gather(*(allocate(group) for group in by_key.values()))
+
+
+async def _insert_versions(batch: list[tuple[dict, dict]], uploader_id: str) -> None:
+    version_dicts = []
+    for item, result in batch:
+        stored: StoredFile = item["stored"]
+        version = DocumentVersion(
+            document_id=item["document_id"],
+            version_number=result["version"],
+            file_path=stored.path,
+            size=stored.size,
+            sha256=stored.sha256,
+            uploader_id=ObjectId(uploader_id)
+        )
+        version_dict = version.model_dump(by_alias=True)
+        if version_dict.get("_id") is None:
+            del version_dict["_id"]
+        version_dicts.append(version_dict)
+
+    failed = set()
+    try:
+        await version_collection.insert_many(version_dicts, ordered=False)
+    except BulkWriteError as exc:
+        for error in exc.details["writeErrors"]:
+            failed.add(error["index"])
+            _, result = batch[error["index"]]
+            _error(result, 500, error.get("errmsg", "Failed to record version"))
+
+    inserted = [index for index in range(len(version_dicts)) if index not in failed]
+    await point_latest(*((version_dicts[i], batch[i][0]["key"]["original_filename"]) for i in inserted))
+    await enqueue_version_processing(*(version_dicts[i] for i in inserted))
+
+
+async def handle_bulk_upload(
+    items: list[BulkUploadItem],
+    sources: dict[str, SourceOpener],
+    uploader_id: str
+) -> list[dict]:
+    """
+    Ingests a batch of files described by a manifest and returns one result
+    per manifest entry, in order. A failing entry never fails the batch.
+
+    Each distinct source file is streamed into the blob store once, even if
+    the manifest assigns it to many employees. Metadata for the whole batch is
+    then written with one update per master and one insert_many.
+    """
+    require_writable()
+    results = [
+        {"index": index, "filename": item.filename, "status": "pending"}
+        for index, item in enumerate(items)
+    ]
+    work = []
+    for item, result in zip(items, results):
+        if item.filename not in sources:
+            _error(result, 400, "File not found in the uploaded batch")
+            continue
+        try:
+            employee_id = validate_object_id(item.employee_id)
+        except ValueError as exc:
+            _error(result, 400, str(exc))
+            continue
+        work.append(({
+            "source": item.filename,
+            "key": {
+                "employee_id": employee_id,
+                "document_type": item.document_type,
+                "original_filename": posixpath.basename(item.filename)
+            }
+        }, result))
+
+    staged = await _stage_sources({item["source"] for item, _ in work}, sources)
+
+    # store_blob took one reference per source; take one more for every
+    # additional entry that reuses the same file
+    uses: dict[str, int] = {}
+    batch = []
+    for item, result in work:
+        stored = staged[item["source"]]
+        if isinstance(stored, ArchiveTooLarge):
+            _error(result, 413, str(stored))
+            continue
+        if isinstance(stored, Exception):
+            _error(result, 500, f"Failed to store file: {stored}")
+            continue
+        item["stored"] = stored
+        uses[item["source"]] = uses.get(item["source"], 0) + 1
+        batch.append((item, result))
+    for name, count in uses.items():
+        await retain_blob(staged[name].sha256, count - 1)
+
+    if batch:
+        await _allocate_versions(batch, uploader_id)
+        batch = [(item, result) for item, result in batch if result["status"] == "pending"]
+    if batch:
+        await _insert_versions(batch, uploader_id)
+
+    for item, result in work:
+        if result["status"] == "pending":
+            result["status"] = "created" if result["version"] == 1 else "versioned"
+        elif "stored" in item:
+            await release_blob(item["stored"].sha256)
+    return results
@@ -0,0 +1,79 @@
+# app/core/checkout_queue.py
+
+import asyncio
+from collections import deque
+
+
+class Waiter:
+    __slots__ = ("user_id", "_event")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._event = asyncio.Event()
+
+
+class CheckoutWaitQueue:
+    """
+    FIFO queues of clients waiting to check out a locked document.
+
+    Only the waiter at the head of a document's queue is woken when the
+    document is checked in, and plain check-outs are refused while anyone is
+    queued, so the lock is handed to waiters in arrival order instead of to
+    whoever retries fastest. Queues are per process; waiters also re-check
+    periodically, which covers check-ins handled by other workers and
+    expired leases.
+    """
+
+    def __init__(self):
+        self._queues: dict[str, deque[Waiter]] = {}
+
+    def join(self, document_id: str, user_id: str) -> Waiter:
+        waiter = Waiter(user_id)
+        self._queues.setdefault(document_id, deque()).append(waiter)
+        return waiter
+
+    def leave(self, document_id: str, waiter: Waiter) -> None:
+        queue = self._queues.get(document_id)
+        if not queue:
+            return
+        was_head = queue[0] is waiter
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[document_id]
+        elif was_head:
+            # The next waiter may be able to take the lock right away
+            queue[0]._event.set()
+
+    def is_head(self, document_id: str, waiter: Waiter) -> bool:
+        queue = self._queues.get(document_id)
+        return bool(queue) and queue[0] is waiter
+
+    def has_waiters(self, document_id: str) -> bool:
+        return bool(self._queues.get(document_id))
+
+    def notify(self, document_id: str) -> None:
+        """Wakes the head waiter after the document was checked in."""
+        queue = self._queues.get(document_id)
+        if queue:
+            queue[0]._event.set()
+
+    async def wait(self, waiter: Waiter, timeout: float) -> None:
+        """Sleeps until notified or until `timeout` seconds have passed."""
+        try:
+            await asyncio.wait_for(waiter._event.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        waiter._event.clear()
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self._queues),
+            "waiters": sum(len(queue) for queue in self._queues.values()),
+        }
+
+
+# Shared by every request handled in this process
+checkout_wait_queue = CheckoutWaitQueue()
@@ -0,0 +1,211 @@
+# app/core/compaction.py
+"""
+Moves cold blobs out of loose files into packfiles (see app.core.packs).
+
+A blob is cold when it is older than PACK_COLD_AFTER_DAYS and every version
+using it is too, and none of those versions is its document's latest.
+Blobs without versions (delta bases) qualify on age alone. Blobs larger
+than PACK_MAX_BLOB_BYTES stay loose, since one large file costs one inode.
+
+Packing is safe next to live traffic: a blob record only switches to its
+pack with a conditional update that fails if the blob was re-encoded,
+moved or released in the meantime, and the loose file is deleted by a
+delayed remove_raw_file job so in-flight downloads complete. Bytes of blobs
+released after packing stay in their pack; packs are never rewritten, and
+app.core.reconcile reports the dead bytes and quarantines unused packs.
+
+Runs as a periodic background job every PACK_INTERVAL_SECONDS, one pack per
+job run, or by hand:
+
+    python -m app.core.compaction [--older-than-days 30]
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.core.blobs import REMOVE_RAW_FILE
+from app.core.jobs import job, job_queue
+from app.core.packs import write_pack
+from app.core.storage import _remove_quietly, storage
+from app.db.database import blob_collection, document_collection, version_collection
+
+PACK_COLD_BLOBS = "pack_cold_blobs"
+
+
+async def _cold(batch: list[dict], cutoff: datetime) -> list[dict]:
+    versions = await version_collection.find(
+        {"sha256": {"$in": [blob["_id"] for blob in batch]}},
+        {"document_id": 1, "version_number": 1, "created_at": 1, "sha256": 1}
+    ).to_list(None)
+    latest = {
+        doc["_id"]: doc["latest_version"]
+        async for doc in document_collection.find(
+            {"_id": {"$in": list({version["document_id"] for version in versions})}},
+            {"latest_version": 1}
+        )
+    }
+    hot = {
+        version["sha256"]
+        for version in versions
+        if version["created_at"] >= cutoff or version["version_number"] >= latest.get(version["document_id"], 0)
+    }
+    return [blob for blob in batch if blob["_id"] not in hot]
+
+
+async def _write_pack(blobs: list[dict]) -> int:
+    """Packs `blobs` into a new pack and switches their records to it. Returns the number switched."""
+    name = str(ObjectId())
+    pack_staging, index_staging = storage.staging_path(".pack"), storage.staging_path(".idx")
+    # Blobs too large for the local cache are copied to staging files,
+    # removed once the pack is written
+    async with AsyncExitStack() as local_files:
+        sources = []
+        for blob in blobs:
+            try:
+                path = await local_files.enter_async_context(storage.local_file(blob["path"]))
+            except FileNotFoundError:
+                # Released since it was selected
+                continue
+            sources.append((blob["_id"], path))
+        if not sources:
+            return 0
+        entries = await run_in_threadpool(write_pack, sources, pack_staging, index_staging)
+    if not entries:
+        # Every source vanished while the pack was written
+        await run_in_threadpool(_remove_quietly, pack_staging)
+        await run_in_threadpool(_remove_quietly, index_staging)
+        return 0
+    pack_path = await storage.put(pack_staging, f"{name}.pack")
+    await storage.put(index_staging, f"{name}.idx")
+
+    by_id = {blob["_id"]: blob for blob in blobs}
+    updates, removals = [], []
+    for sha256, offset, length in entries:
+        blob = by_id[sha256]
+        updates.append(UpdateOne(
+            {"_id": sha256, "path": blob["path"], "encoding": blob.get("encoding"), "pack": None},
+            {"$set": {"pack": {"path": pack_path, "offset": offset, "length": length}}}
+        ))
+        # Skipped by the handler if the switch above did not happen
+        removals.append(job(
+            REMOVE_RAW_FILE,
+            f"{sha256}:{ObjectId()}",
+            {"sha256": sha256, "path": blob["path"]},
+            delay_seconds=settings.raw_blob_grace_seconds
+        ))
+    if not updates:
+        return 0
+    result = await blob_collection.bulk_write(updates, ordered=False)
+    await job_queue.enqueue(*removals)
+    return result.modified_count
+
+
+async def pack_cold_blobs(
+    older_than_days: Optional[float] = None,
+    after: Optional[str] = None,
+    max_packs: Optional[int] = None
+) -> dict:
+    """
+    Packs cold blobs in digest order, starting after `after`, into packs of
+    up to PACK_MAX_BYTES. Stops after `max_packs` packs; `resume_after` in
+    the result is where to continue, or None once every blob was considered.
+    """
+    days = settings.pack_cold_after_days if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    report = {"packs": 0, "blobs": 0, "bytes": 0, "resume_after": None}
+
+    pending, pending_bytes = [], 0
+
+    async def flush():
+        nonlocal pending, pending_bytes
+        switched = await _write_pack(pending)
+        if switched:
+            report["blobs"] += switched
+            report["packs"] += 1
+            report["bytes"] += pending_bytes
+        pending, pending_bytes = [], 0
+
+    last_id = after
+    while True:
+        query = {"created_at": {"$lt": cutoff}, "pack": None}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await blob_collection.find(
+            query, {"path": 1, "encoding": 1, "size": 1, "stored_size": 1}
+        ).sort("_id", 1).limit(settings.pack_batch_size).to_list(None)
+        if not batch:
+            break
+
+        for blob in await _cold(batch, cutoff):
+            length = blob.get("stored_size") or blob["size"]
+            if length > settings.pack_max_blob_bytes or not await storage.exists(blob["path"]):
+                continue
+            pending.append(blob)
+            pending_bytes += length
+            if pending_bytes >= settings.pack_max_bytes:
+                await flush()
+                if max_packs is not None and report["packs"] >= max_packs:
+                    # The rest of this batch is looked at again next time
+                    report["resume_after"] = blob["_id"]
+                    return report
+        last_id = batch[-1]["_id"]
+
+    if pending:
+        await flush()
+    return report
+
+
+def _compaction_job(slot: int, after: Optional[str] = None, delay_seconds: float = 0) -> dict:
+    key = str(slot) if after is None else f"{slot}:{after}"
+    return job(PACK_COLD_BLOBS, key, {"slot": slot, "after": after}, delay_seconds=delay_seconds)
+
+
+async def schedule_compaction() -> None:
+    """
+    Queues the next periodic run. Runs are keyed by their interval slot, so
+    every API process scheduling it queues the same job once.
+    """
+    interval = settings.pack_interval_seconds
+    if interval <= 0:
+        return
+    next_slot = int(time.time() // interval) + 1
+    await job_queue.enqueue(_compaction_job(next_slot, delay_seconds=next_slot * interval - time.time()))
+
+
+@job_queue.handler(PACK_COLD_BLOBS)
+async def _pack_cold_blobs(payload: dict) -> None:
+    try:
+        # One pack per run keeps each run well inside the job lease
+        report = await pack_cold_blobs(after=payload.get("after"), max_packs=1)
+        if report["resume_after"] is not None:
+            await job_queue.enqueue(_compaction_job(payload["slot"], after=report["resume_after"]))
+            return
+    except Exception:
+        # A run that fails, even for good, still queues the next one, or
+        # compaction would stop until a restart. Runs are keyed by slot, so
+        # the retries of this run queue it only once
+        await schedule_compaction()
+        raise
+    await schedule_compaction()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack cold blobs into packfiles.")
+    parser.add_argument("--older-than-days", type=float, default=None,
+                        help=f"Defaults to PACK_COLD_AFTER_DAYS ({settings.pack_cold_after_days})")
+    args = parser.parse_args()
+    report = asyncio.run(pack_cold_blobs(args.older_than_days))
+    print(f"Packed {report['blobs']} blobs ({report['bytes']} bytes) into {report['packs']} packs")
+
+
+if __name__ == "__main__":
+    main()
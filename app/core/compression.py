@@ -0,0 +1,174 @@
+# app/core/compression.py
+"""
+Encodings for stored blobs, using only the standard library.
+
+- "raw":   the file as uploaded
+- "zlib":  the whole file deflated (a full snapshot)
+- "delta": a zlib-compressed list of copy/insert operations against a base
+           blob, usually the previous version of the same document
+
+These functions are pure and blocking; callers run them in the threadpool.
+"""
+
+import struct
+import zlib
+from typing import Iterable, Iterator
+
+from app.core.storage import CHUNK_SIZE
+
+DELTA_MAGIC = b"HRD1"
+_COPY = b"C"
+_INSERT = b"I"
+_COPY_OP = struct.Struct(">QQ")
+_INSERT_OP = struct.Struct(">Q")
+
+COMPRESSION_LEVEL = 6
+
+# Places in the base where each distinct line is looked up when matching;
+# bounds the work per target line on files with many repeated lines
+DELTA_MAX_CANDIDATES = 4
+
+
+def compress_file(source_path: str, destination_path: str) -> int:
+    """Deflates a file in chunks. Returns the compressed size."""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    written = 0
+    with open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+        while chunk := source.read(CHUNK_SIZE):
+            data = compressor.compress(chunk)
+            destination.write(data)
+            written += len(data)
+        data = compressor.flush()
+        destination.write(data)
+        written += len(data)
+    return written
+
+
+def decompress_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return zlib.decompress(f.read())
+
+
+def iter_decompressed_chunks(compressed: Iterable[bytes], start: int, end: int) -> Iterator[bytes]:
+    """
+    Yields bytes [start, end) of deflated data arriving in chunks,
+    decompressing as it goes. Memory stays flat; the cost of seeking is
+    proportional to `start`.
+    """
+    decompressor = zlib.decompressobj()
+    position = 0
+    chunks = iter(compressed)
+    while position < end:
+        chunk = next(chunks, None)
+        if chunk is None:
+            data = decompressor.flush()
+        else:
+            data = decompressor.decompress(chunk)
+        if data:
+            chunk_start, position = position, position + len(data)
+            if position > start:
+                yield data[max(start - chunk_start, 0):end - chunk_start]
+        if chunk is None:
+            break
+
+
+def _lines(data: bytes) -> list[bytes]:
+    return data.splitlines(keepends=True)
+
+
+def _match_length(base_lines: list[bytes], i: int, target_lines: list[bytes], j: int) -> int:
+    """How many lines from base_lines[i] on equal those from target_lines[j] on."""
+    limit = min(len(base_lines) - i, len(target_lines) - j)
+    # Compares ever longer slices, then narrows down on the first difference,
+    # so long runs are compared in C rather than line by line
+    length, step = 0, 1
+    while step:
+        step = min(step, limit - length)
+        if step and base_lines[i + length:i + length + step] == target_lines[j + length:j + length + step]:
+            length += step
+            step *= 2
+        else:
+            step //= 2
+    return length
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """
+    Encodes `target` as copy/insert operations against `base`, matched line
+    by line (UTF-16 text splits cleanly on its 0x0A bytes too), then deflated.
+
+    Matching is greedy and linear in the size of both inputs: base lines are
+    indexed by content, and each target line is extended into the longest
+    run of equal lines starting right after the previous copy or at one of
+    the first DELTA_MAX_CANDIDATES places the line occurs in the base.
+    """
+    base_lines, target_lines = _lines(base), _lines(target)
+    base_offsets = [0]
+    for line in base_lines:
+        base_offsets.append(base_offsets[-1] + len(line))
+    occurrences: dict[bytes, list[int]] = {}
+    for i, line in enumerate(base_lines):
+        places = occurrences.setdefault(line, [])
+        if len(places) < DELTA_MAX_CANDIDATES:
+            places.append(i)
+
+    parts = [DELTA_MAGIC]
+    inserted: list[bytes] = []
+
+    def flush_insert():
+        if inserted:
+            data = b"".join(inserted)
+            parts.append(_INSERT + _INSERT_OP.pack(len(data)) + data)
+            inserted.clear()
+
+    next_base = 0
+    j = 0
+    while j < len(target_lines):
+        line = target_lines[j]
+        candidates = occurrences.get(line, [])
+        if next_base < len(base_lines) and base_lines[next_base] == line and next_base not in candidates:
+            candidates = [next_base, *candidates]
+        best_start, best_length = 0, 0
+        for i in candidates:
+            length = _match_length(base_lines, i, target_lines, j)
+            if length > best_length:
+                best_start, best_length = i, length
+                if best_length == len(target_lines) - j:
+                    break
+
+        start, end = base_offsets[best_start], base_offsets[best_start + best_length]
+        # A copy of fewer bytes than its own op is cheaper as an insert
+        if end - start <= _COPY_OP.size:
+            inserted.append(line)
+            j += 1
+            continue
+        flush_insert()
+        parts.append(_COPY + _COPY_OP.pack(start, end - start))
+        next_base = best_start + best_length
+        j += best_length
+    flush_insert()
+    return zlib.compress(b"".join(parts), COMPRESSION_LEVEL)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    payload = memoryview(zlib.decompress(delta))
+    if bytes(payload[:4]) != DELTA_MAGIC:
+        raise ValueError("Not a delta blob")
+
+    out = []
+    position = 4
+    while position < len(payload):
+        op = bytes(payload[position:position + 1])
+        position += 1
+        if op == _COPY:
+            start, length = _COPY_OP.unpack_from(payload, position)
+            position += _COPY_OP.size
+            out.append(base[start:start + length])
+        elif op == _INSERT:
+            (length,) = _INSERT_OP.unpack_from(payload, position)
+            position += _INSERT_OP.size
+            out.append(bytes(payload[position:position + length]))
+            position += length
+        else:
+            raise ValueError("Corrupt delta blob")
+    return b"".join(out)
@@ -0,0 +1,287 @@
+# app/core/diff.py
+"""
+Line diffs between two versions of a text document.
+
+Both versions are streamed from storage and decoded incrementally as UTF-8
+or UTF-16 (see search.sniff_text_encoding). Their lines are compared in
+lockstep up to the first difference, keeping only the last few as context,
+so an unchanged head costs no memory however long it is. The rest is diffed
+with difflib on the job CPU pool, up to DIFF_MAX_CHARS characters per
+version, and the output is rendered and streamed in chunks.
+
+Versions never change, so finished diffs are kept in a byte-bounded LRU
+keyed by the two version ids and the output options; reviewing the same
+pair again is served from memory.
+"""
+
+import codecs
+import difflib
+import json
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+from app.config import settings
+from app.core.jobs import job_queue
+from app.core.ranges import RangeReader
+from app.core.search import sniff_text_encoding
+
+MEDIA_TYPES = {
+    # A unified diff, as produced by `diff -u`
+    "unified": "text/x-diff; charset=utf-8",
+    # One JSON object per changed line
+    "lines": "application/x-ndjson",
+}
+OUTPUT_CHUNK_CHARS = 64 * 1024
+
+
+class NotText(Exception):
+    """Raised when a version's content is not UTF-8 or UTF-16 text."""
+
+    def __init__(self, version_number: int):
+        super().__init__(f"Version {version_number} is not a text document")
+        self.version_number = version_number
+
+
+class DiffTooLarge(Exception):
+    """Raised when the changed part of a version exceeds DIFF_MAX_CHARS."""
+
+    def __init__(self, version_number: int):
+        super().__init__(
+            f"Version {version_number} differs in more than {settings.diff_max_chars} characters"
+        )
+        self.version_number = version_number
+
+
+class DiffCache:
+    """
+    A byte-bounded LRU of rendered diffs. Entries over a quarter of the
+    cache are not kept, so one huge diff cannot flush everything else.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def set(self, key: tuple, data: bytes) -> None:
+        if len(data) > self.max_entry_bytes or key in self._entries:
+            return
+        self._entries[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+diff_cache = DiffCache(settings.diff_cache_max_bytes)
+
+
+def diff_key(old_version: dict, new_version: dict, output: str, context: int) -> tuple:
+    return (str(old_version["_id"]), str(new_version["_id"]), output, context)
+
+
+async def _text_lines(opened: tuple[int, RangeReader], version_number: int) -> AsyncIterator[str]:
+    """The lines of a stored version, with their line endings."""
+    size, read_range = opened
+    decoder = None
+    pending = ""
+    async for chunk in read_range(0, size):
+        if decoder is None:
+            encoding, bom_length = sniff_text_encoding(chunk)
+            decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = chunk[bom_length:]
+        try:
+            text = pending + decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise NotText(version_number)
+        # NUL survives UTF-8 decoding of binary formats; real text has none
+        if "\x00" in text:
+            raise NotText(version_number)
+        # Only \n ends a line; str.splitlines would also split on \x0c,
+        # \x85, \u2028 and friends, which diff tools treat as content
+        *lines, pending = text.split("\n")
+        # The last piece may continue in the next chunk
+        lines = [line + "\n" for line in lines]
+        if len(pending) > settings.diff_max_chars:
+            raise DiffTooLarge(version_number)
+        for line in lines:
+            yield line
+    if decoder is not None:
+        try:
+            pending += decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise NotText(version_number)
+    if pending:
+        yield pending
+
+
+async def _rest(first: Optional[str], lines: AsyncIterator[str], version_number: int) -> list[str]:
+    if first is None:
+        return []
+    rest, chars = [first], len(first)
+    async for line in lines:
+        rest.append(line)
+        chars += len(line)
+        if chars > settings.diff_max_chars:
+            raise DiffTooLarge(version_number)
+    return rest
+
+
+def _grouped_opcodes(old: list[str], new: list[str], context: int) -> list:
+    return list(difflib.SequenceMatcher(None, old, new).get_grouped_opcodes(context))
+
+
+@dataclass
+class PreparedDiff:
+    old: list[str]
+    new: list[str]
+    # Lines of both versions before old[0] and new[0]
+    offset: int
+    groups: list
+
+
+async def prepare_diff(
+    old_opened: tuple[int, RangeReader],
+    old_number: int,
+    new_opened: tuple[int, RangeReader],
+    new_number: int,
+    context: int
+) -> PreparedDiff:
+    """
+    Reads and compares two opened versions. Raises NotText or DiffTooLarge
+    before anything is sent, so the caller can still answer with an error.
+    """
+    old_lines = _text_lines(old_opened, old_number)
+    new_lines = _text_lines(new_opened, new_number)
+    head = deque(maxlen=context)
+    offset = 0
+    old_line, new_line = await anext(old_lines, None), await anext(new_lines, None)
+    while old_line is not None and old_line == new_line:
+        head.append(old_line)
+        offset += 1
+        old_line, new_line = await anext(old_lines, None), await anext(new_lines, None)
+
+    old = [*head, *await _rest(old_line, old_lines, old_number)]
+    new = [*head, *await _rest(new_line, new_lines, new_number)]
+    offset -= len(head)
+    groups = await job_queue.run_cpu_bound(_grouped_opcodes, old, new, context)
+    return PreparedDiff(old, new, offset, groups)
+
+
+def _content(line: str) -> str:
+    """A line without its line ending."""
+    if not line.endswith("\n"):
+        return line
+    return line[:-1].removesuffix("\r")
+
+
+def _unified_line(prefix: str, line: str) -> str:
+    content = _content(line)
+    if content == line:
+        return f"{prefix}{line}\n\\ No newline at end of file\n"
+    return f"{prefix}{content}\n"
+
+
+def _unified_range(start: int, stop: int) -> str:
+    # As in `diff -u`: an empty range names the line before it
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def _render_unified(diff: PreparedDiff, old_label: str, new_label: str) -> Iterator[str]:
+    if not diff.groups:
+        return
+    yield f"--- {old_label}\n+++ {new_label}\n"
+    for group in diff.groups:
+        first, last = group[0], group[-1]
+        old_range = _unified_range(diff.offset + first[1], diff.offset + last[2])
+        new_range = _unified_range(diff.offset + first[3], diff.offset + last[4])
+        yield f"@@ -{old_range} +{new_range} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in diff.old[i1:i2]:
+                    yield _unified_line(" ", line)
+                continue
+            if tag in ("replace", "delete"):
+                for line in diff.old[i1:i2]:
+                    yield _unified_line("-", line)
+            if tag in ("replace", "insert"):
+                for line in diff.new[j1:j2]:
+                    yield _unified_line("+", line)
+
+
+def _render_lines(diff: PreparedDiff) -> Iterator[str]:
+    for group in diff.groups:
+        for tag, i1, i2, j1, j2 in group:
+            if tag in ("replace", "delete"):
+                for index in range(i1, i2):
+                    yield json.dumps({
+                        "op": "delete",
+                        "from_line": diff.offset + index + 1,
+                        "to_line": None,
+                        "text": _content(diff.old[index]),
+                    }) + "\n"
+            if tag in ("replace", "insert"):
+                for index in range(j1, j2):
+                    yield json.dumps({
+                        "op": "insert",
+                        "from_line": None,
+                        "to_line": diff.offset + index + 1,
+                        "text": _content(diff.new[index]),
+                    }) + "\n"
+
+
+async def stream_diff(
+    diff: PreparedDiff,
+    output: str,
+    old_label: str,
+    new_label: str,
+    key: tuple
+) -> AsyncIterator[bytes]:
+    """Renders a prepared diff in chunks, and caches it once fully sent."""
+    rendered = _render_unified(diff, old_label, new_label) if output == "unified" else _render_lines(diff)
+    kept, kept_bytes = [], 0
+    buffer, buffered = [], 0
+    for text in rendered:
+        buffer.append(text)
+        buffered += len(text)
+        if buffered < OUTPUT_CHUNK_CHARS:
+            continue
+        chunk = "".join(buffer).encode("utf-8")
+        buffer, buffered = [], 0
+        if kept is not None:
+            kept.append(chunk)
+            kept_bytes += len(chunk)
+            if kept_bytes > diff_cache.max_entry_bytes:
+                kept = None
+        yield chunk
+    chunk = "".join(buffer).encode("utf-8")
+    if kept is not None:
+        kept.append(chunk)
+        diff_cache.set(key, b"".join(kept))
+    if chunk:
+        yield chunk
@@ -1,143 +1,358 @@
 # app/core/documents.py
 
+import asyncio
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 from bson import ObjectId
 from fastapi import HTTPException, UploadFile
-from app.models.document import Document, DocumentVersion
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.models.document import Document, DocumentVersion, LatestVersion
 from app.db.database import document_collection, version_collection
+from app.db.indexes import missing_write_indexes
+from app.core.blobs import store_blob, release_blob
+from app.core.processing import enqueue_version_processing
+from app.core.checkout_queue import Waiter, checkout_wait_queue
+from app.core.validator import validate_object_id
+from app.config import settings
 
-UPLOAD_DIRECTORY = "uploads"
-os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+logger = logging.getLogger(__name__)
+
+# Fields written by $inc/$set in the upload upsert, which therefore must not
+# also appear in its $setOnInsert
+_UPSERT_MANAGED_FIELDS = {
+    "id", "latest_version", "updated_at",
+    "is_checked_out", "checked_out_by", "checked_out_at", "lease_expires_at"
+}
+
+
+async def _insert_version(version_dict: dict):
+    """
+    Inserts a version record, giving its blob reference back if the insert
+    fails so the blob does not outlive the version that claimed it.
+    """
+    try:
+        return await version_collection.insert_one(version_dict)
+    except Exception:
+        await release_blob(version_dict["sha256"])
+        raise
+
+
+def media_type_for(filename: str) -> str:
+    file_ext = os.path.splitext(filename)[1].lower()
+    media_type_map = {
+        ".doc": "application/msword",
+        ".txt": "text/plain"
+    }
+    return media_type_map.get(file_ext, "application/octet-stream")
+
+
+async def point_latest(*versions: tuple[dict, str]) -> None:
+    """
+    Copies the storage pointer of newly inserted versions, given as
+    (version_dict, filename) pairs, onto their masters' `latest` field.
+
+    Runs after the version insert so the pointer never names a version that
+    was not recorded. The update only matches while the master points at an
+    older version, so concurrent uploads finishing out of order cannot move
+    it backwards. A failure is logged rather than raised: the upload is
+    already recorded, and downloads of the latest version fall back to the
+    versions collection while the pointer lags behind latest_version.
+    """
+    newest: dict = {}
+    for version_dict, filename in versions:
+        current = newest.get(version_dict["document_id"])
+        if current is None or version_dict["version_number"] > current[0]["version_number"]:
+            newest[version_dict["document_id"]] = (version_dict, filename)
+
+    updates = [
+        (
+            {
+                "_id": document_id,
+                "$or": [{"latest": None}, {"latest.version_number": {"$lt": version_dict["version_number"]}}]
+            },
+            {"$set": {"latest": LatestVersion(**version_dict, media_type=media_type_for(filename)).model_dump()}}
+        )
+        for document_id, (version_dict, filename) in newest.items()
+    ]
+    try:
+        if len(updates) == 1:
+            await document_collection.update_one(*updates[0])
+        elif updates:
+            await document_collection.bulk_write([UpdateOne(*update) for update in updates], ordered=False)
+    except Exception:
+        logger.exception("Failed to update the latest-version pointer of %d document(s)", len(updates))
+
+
+async def repoint_latest(document_id: ObjectId, removed_version_number: int) -> None:
+    """
+    Moves a master's `latest` pointer off a version whose record was removed,
+    onto its newest remaining version, or drops it if none remains. Only
+    applies while the pointer still names the removed version, so a newer
+    upload is never overwritten. latest_version is left as it is, so the
+    removed number is never given to another version.
+    """
+    named = {"_id": document_id, "latest.version_number": removed_version_number}
+    master = await document_collection.find_one(named, {"original_filename": 1})
+    if master is None:
+        return
+    survivor = await version_collection.find_one({"document_id": document_id}, sort=[("version_number", -1)])
+    if survivor is None:
+        update = {"$unset": {"latest": ""}}
+    else:
+        latest = LatestVersion(**survivor, media_type=media_type_for(master["original_filename"]))
+        update = {"$set": {"latest": latest.model_dump()}}
+    await document_collection.update_one(named, update)
+
+
+def checked_out_error(existing_doc: dict, uploader_id: str) -> HTTPException:
+    # If the document exists and is locked, block the upload
+    checked_out_by_id = str(existing_doc.get("checked_out_by"))
+    if checked_out_by_id != uploader_id:
+        return HTTPException(
+            status_code=409,
+            detail=f"Document is currently checked out by another user."
+        )
+    # The user trying to upload is the one who checked it out.
+    # Guide them to use the correct endpoint.
+    return HTTPException(
+        status_code=400,
+        detail="Document is checked out by you. Please use the 'check-in' endpoint to upload a new version."
+    )
+
+
+def writes_blocked_reason() -> Optional[str]:
+    """
+    Why uploads and check-ins are refused, or None. They are refused while a
+    unique index their locking depends on could not be built on startup.
+    """
+    missing = missing_write_indexes()
+    if not missing:
+        return None
+    return (
+        f"Uploads are disabled until duplicate keys blocking {', '.join(missing)} "
+        "are resolved and the service is restarted"
+    )
+
+
+def require_writable() -> None:
+    reason = writes_blocked_reason()
+    if reason is not None:
+        raise HTTPException(status_code=503, detail=reason)
+
+
+def unlocked_filter(now: datetime) -> dict:
+    """
+    Matches masters nobody holds a lock on. A checkout whose lease has
+    expired no longer counts as a lock.
+    """
+    return {"$or": [{"is_checked_out": {"$ne": True}}, {"lease_expires_at": {"$lte": now}}]}
+
+
+def released_lock_fields() -> dict:
+    return {"is_checked_out": False, "checked_out_by": None, "checked_out_at": None, "lease_expires_at": None}
+
+
+def master_insert_fields(key: dict) -> dict:
+    """
+    Fields set only when an upload creates a new master document, for use in
+    $setOnInsert next to the $inc of latest_version.
+    """
+    return Document(**key, latest_version=0).model_dump(exclude=_UPSERT_MANAGED_FIELDS)
+
+
+async def reserve_versions(key: dict, count: int, uploader_id: str) -> dict:
+    """
+    Creates the master document or bumps its version by `count` in a single
+    round trip, and returns it with the new latest_version: the reserved
+    numbers are the `count` ending there.
+
+    The master is identified by (employee_id, document_type, filename) and is
+    only matched while it is not checked out (or its checkout lease has
+    expired, in which case the stale lock is cleared). A checked-out master
+    therefore makes the upsert collide with the unique index on those fields,
+    which is reported as a 409/400 like before.
+    """
+    now = datetime.utcnow()
+
+    # Two attempts: concurrent first uploads of the same file may both try
+    # to insert, and the loser simply retries as an update.
+    for attempt in range(2):
+        try:
+            return await document_collection.find_one_and_update(
+                {**key, **unlocked_filter(now)},
+                {
+                    "$inc": {"latest_version": count},
+                    "$set": {"updated_at": now, **released_lock_fields()},
+                    "$setOnInsert": master_insert_fields(key)
+                },
+                projection={"_id": 1, "latest_version": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            existing_doc = await document_collection.find_one(
+                key, {"is_checked_out": 1, "checked_out_by": 1}
+            )
+            if existing_doc and existing_doc.get("is_checked_out"):
+                raise checked_out_error(existing_doc, uploader_id)
+            if attempt:
+                raise
 
 
 async def handle_document_upload(file, employee_id: str, document_type: str, uploader_id: str):
-    # Step 1: Check if a document with the SAME FILENAME already exists for this employee and type
-    existing_doc = await document_collection.find_one({
+    require_writable()
+    key = {
         "employee_id": ObjectId(employee_id),
         "document_type": document_type,
-        "original_filename": file.filename  # <-- THE CRUCIAL FIX
-    })
-    
-    if existing_doc and existing_doc.get("is_checked_out"):
-        # If the document exists and is locked, block the upload
-        checked_out_by_id = str(existing_doc.get("checked_out_by"))
-        if checked_out_by_id != uploader_id:
-            raise HTTPException(
-                status_code=409,
-                detail=f"Document is currently checked out by another user."
-            )
-        else:
-            # The user trying to upload is the one who checked it out.
-            # Guide them to use the correct endpoint.
-            raise HTTPException(
-                status_code=400,
-                detail="Document is checked out by you. Please use the 'check-in' endpoint to upload a new version."
-            )
+        "original_filename": file.filename
+    }
 
+    # Refuse an upload to a checked-out master before the file is written;
+    # reserve_versions below still enforces the lock atomically
+    existing_doc = await document_collection.find_one(
+        {**key, "is_checked_out": True, "lease_expires_at": {"$not": {"$lte": datetime.utcnow()}}},
+        {"checked_out_by": 1}
+    )
+    if existing_doc is not None:
+        raise checked_out_error(existing_doc, uploader_id)
 
-    # Generate unique file name for storage
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{ObjectId()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIRECTORY, unique_filename)
+    # Stream the file into the content-addressed store; identical bytes
+    # already on disk are reused instead of written again
+    stored = await store_blob(file)
+    file_path = stored.path
 
-    # Save the new file to disk
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    # Create the master document or claim the next version number on it.
+    # The number is allocated server-side with $inc, so concurrent uploads
+    # can never be given the same one.
+    try:
+        master = await reserve_versions(key, 1, uploader_id)
+    except BaseException:
+        await release_blob(stored.sha256)
+        raise
 
-    if existing_doc is None:
-        # --- CASE 1: This is a brand-new master document ---
-        new_doc = Document(
-            employee_id=ObjectId(employee_id),
-            document_type=document_type,
-            original_filename=file.filename, # The original name is stored
-            latest_version=1
-        )
-        doc_dict = new_doc.model_dump(by_alias=True)
-        if doc_dict.get("_id") is None:
-            del doc_dict["_id"]
-
-        doc_insert = await document_collection.insert_one(doc_dict)
-        document_id = doc_insert.inserted_id
-
-        if document_id is None:
-            raise Exception("Failed to insert new master document.")
-
-        # Create the first version record for this new master document
-        version = DocumentVersion(
-            document_id=document_id,
-            version_number=1,
-            file_path=file_path,
-            uploader_id=ObjectId(uploader_id)
-        )
-        version_dict = version.model_dump(by_alias=True)
-        if version_dict.get("_id") is None:
-            del version_dict["_id"]
+    document_id = master["_id"]
+    new_version_number = master["latest_version"]
+
+    version = DocumentVersion(
+        document_id=document_id,
+        version_number=new_version_number,
+        file_path=file_path,
+        size=stored.size,
+        sha256=stored.sha256,
+        uploader_id=ObjectId(uploader_id)
+    )
+    version_dict = version.model_dump(by_alias=True)
+    if version_dict.get("_id") is None:
+        del version_dict["_id"]
+
+    await _insert_version(version_dict)
+    await point_latest((version_dict, file.filename))
+    # Indexing and re-encoding catch up in the background
+    await enqueue_version_processing(version_dict)
 
-        await version_collection.insert_one(version_dict)
+    if new_version_number == 1:
+        # --- CASE 1: This is a brand-new master document ---
         return {"message": "New document created", "version": 1, "document_id": str(document_id)}
 
-    else:
-        # --- CASE 2: This is a new version of an existing master document ---
-        document_id = existing_doc.get("_id")
-        if not document_id or not isinstance(document_id, ObjectId):
-            raise Exception("Existing document is missing a valid '_id'")
-        
-        current_version = existing_doc.get("latest_version", 1)
-        new_version_number = current_version + 1
-
-        # Create the next version record
-        version = DocumentVersion(
-            document_id=document_id,
-            version_number=new_version_number,
-            file_path=file_path,
-            uploader_id=ObjectId(uploader_id)
-        )
-        version_dict = version.model_dump(by_alias=True)
-        if version_dict.get("_id") is None:
-            del version_dict["_id"]
-        
-        await version_collection.insert_one(version_dict)
-
-        # Update the master document to point to the latest version
-        await document_collection.update_one(
-            {"_id": document_id},
-            {"$set": {"latest_version": new_version_number, "updated_at": datetime.utcnow()}}
-        )
-        return {"message": "New version added", "version": new_version_number, "document_id": str(document_id)}
+    # --- CASE 2: This is a new version of an existing master document ---
+    return {"message": "New version added", "version": new_version_number, "document_id": str(document_id)}
 
-async def check_out_document(document_id: str, user_id: str):
+async def check_out_document(document_id: str, user_id: str, waiter: Optional[Waiter] = None):
     """
     Checks out a document (locks it) for exclusive editing.
     Error if already checked out by someone else.
-    """
-    doc = await document_collection.find_one({"_id": ObjectId(document_id)})
-
-    if doc is None:
-        return {"error": "Document not found"}, 404
 
-    if doc.get("is_checked_out", False):
-        # Already locked
-        checked_by = str(doc.get("checked_out_by"))
-        checked_at = doc.get("checked_out_at")
-        return {
-            "error": "Document is already checked out.",
-            "checked_out_by": checked_by,
-            "checked_out_at": checked_at
-        }, 409
+    The lock is a lease of CHECKOUT_LEASE_SECONDS; checking out again while
+    holding it renews the lease, and an expired lease can be taken over.
+    While clients are queued in the wait queue only the head `waiter` may
+    take the lock.
 
-    # Perform check-out
-    await document_collection.update_one(
-        {"_id": ObjectId(document_id)},
+    The lock is taken with a single conditional update; the document is only
+    read again when that update matched nothing, to tell 404 from 409.
+    """
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=settings.checkout_lease_seconds)
+    renew = {"is_checked_out": True, "checked_out_by": ObjectId(user_id)}
+    queued = checkout_wait_queue.has_waiters(document_id) and not (
+        waiter is not None and checkout_wait_queue.is_head(document_id, waiter)
+    )
+    locked = await document_collection.find_one_and_update(
+        {
+            "_id": ObjectId(document_id),
+            # Queued waiters go first; only the holder may still renew
+            "$or": [renew] if queued else [renew, *unlocked_filter(now)["$or"]]
+        },
         {
             "$set": {
                 "is_checked_out": True,
                 "checked_out_by": ObjectId(user_id),
-                "checked_out_at": datetime.utcnow()
+                "checked_out_at": now,
+                "lease_expires_at": lease_expires_at
             }
-        }
+        },
+        projection={"_id": 1}
     )
-    return {"message": "Document checked out. You now have exclusive edit access."}, 200
+    if locked is not None:
+        return {
+            "message": "Document checked out. You now have exclusive edit access.",
+            "lease_expires_at": lease_expires_at
+        }, 200
+
+    doc = await document_collection.find_one(
+        {"_id": ObjectId(document_id)},
+        {"is_checked_out": 1, "checked_out_by": 1, "checked_out_at": 1, "lease_expires_at": 1}
+    )
+    if doc is None:
+        return {"error": "Document not found"}, 404
+
+    lease = doc.get("lease_expires_at")
+    if not doc.get("is_checked_out") or (lease is not None and lease <= now):
+        return {"error": "Document is reserved for clients waiting to check it out."}, 409
+
+    # Already locked
+    checked_by = str(doc.get("checked_out_by"))
+    checked_at = doc.get("checked_out_at")
+    return {
+        "error": "Document is already checked out.",
+        "checked_out_by": checked_by,
+        "checked_out_at": checked_at,
+        "lease_expires_at": lease
+    }, 409
+
+async def wait_and_check_out(document_id: str, user_id: str, timeout: float):
+    """
+    Checks out a document, waiting up to `timeout` seconds for it to be
+    checked in (or for its lease to expire) if it is locked. Waiters get the
+    lock in arrival order. Returns the same results as check_out_document.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    waiter = checkout_wait_queue.join(document_id, user_id)
+    try:
+        while True:
+            pause = settings.checkout_wait_poll_seconds
+            if checkout_wait_queue.is_head(document_id, waiter):
+                data, status = await check_out_document(document_id, user_id, waiter=waiter)
+                if status != 409:
+                    return data, status
+                lease = data.get("lease_expires_at")
+                if lease is not None:
+                    # Try again as soon as the current holder's lease runs out
+                    until_expiry = (lease - datetime.utcnow()).total_seconds()
+                    pause = min(pause, max(until_expiry, 0) + 0.05)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return {"error": "Timed out waiting for the document to be checked in."}, 409
+            # Check-ins handled by this process wake the head waiter at once;
+            # the periodic re-check covers everything else
+            await checkout_wait_queue.wait(waiter, min(pause, remaining))
+    finally:
+        checkout_wait_queue.leave(document_id, waiter)
+
 
 async def check_in_document(
     document_id: str,
@@ -145,53 +360,72 @@ async def check_in_document(
     file: UploadFile,
     original_filename: str  # You may not need this if the file object has the filename
 ):
-    document = await document_collection.find_one({"_id": ObjectId(document_id)})
+    try:
+        document_oid = validate_object_id(document_id)
+    except ValueError as exc:
+        return {"error": str(exc)}, 400
+    reason = writes_blocked_reason()
+    if reason is not None:
+        return {"error": reason}, 503
+    lock = {"_id": document_oid, "is_checked_out": True, "checked_out_by": ObjectId(uploader_id)}
 
-    if document is None:
-        return {"error": "Document not found"}, 404
-    
-    if not document.get("is_checked_out") or str(document.get("checked_out_by")) != uploader_id:
+    # Refuse before the file is written, not after; the update below
+    # still re-checks the lock atomically
+    if await document_collection.count_documents(lock, limit=1) == 0:
+        if await document_collection.count_documents({"_id": document_oid}, limit=1) == 0:
+            return {"error": "Document not found"}, 404
         return {"error": "Document is not checked out by this user"}, 403
 
     # Save uploaded file
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{ObjectId()}{file_extension}"
-    file_path = os.path.join("uploads", unique_filename)
+    stored = await store_blob(file)
+    file_path = stored.path
+
+    try:
+        # Allocate the next version number and release the lock in one
+        # update, matching only while this user still holds the lock
+        document = await document_collection.find_one_and_update(
+            lock,
+            {
+                "$inc": {"latest_version": 1},
+                "$set": {"updated_at": datetime.utcnow(), **released_lock_fields()}
+            },
+            projection={"_id": 1, "latest_version": 1, "original_filename": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    except BaseException:
+        await release_blob(stored.sha256)
+        raise
+
+    if document is None:
+        # The lock was lost (or the document deleted) while the file was stored
+        await release_blob(stored.sha256)
+        if await document_collection.count_documents({"_id": document_oid}, limit=1) == 0:
+            return {"error": "Document not found"}, 404
+        return {"error": "Document is not checked out by this user"}, 403
 
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    # Hand the lock to the longest-waiting client, if any
+    checkout_wait_queue.notify(document_id)
 
-    new_version_number = document.get("latest_version", 1) + 1
+    new_version_number = document["latest_version"]
 
     version = DocumentVersion(
         document_id=document["_id"],
         version_number=new_version_number,
         file_path=file_path,
+        size=stored.size,
+        sha256=stored.sha256,
         uploader_id=ObjectId(uploader_id),
         created_at=datetime.utcnow()
     )
 
-    # --- THIS IS THE FIX ---
     # Prepare the dictionary for insertion and remove the null _id
     version_dict = version.model_dump(by_alias=True)
     if version_dict.get("_id") is None:
         del version_dict["_id"]
-    
-    await version_collection.insert_one(version_dict)
-    # --- END OF FIX ---
 
-    # Update master document to unlock and update version info
-    await document_collection.update_one(
-        {"_id": document["_id"]},
-        {
-            "$set": {
-                "latest_version": new_version_number,
-                "updated_at": datetime.utcnow(),
-                "is_checked_out": False,
-                "checked_out_by": None,
-                "checked_out_at": None
-            }
-        }
-    )
+    # Gives the blob reference back if the insert fails
+    await _insert_version(version_dict)
+    await point_latest((version_dict, document["original_filename"]))
+    await enqueue_version_processing(version_dict)
 
     return {"message": "Document checked in successfully", "version": new_version_number}, 200
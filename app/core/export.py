@@ -0,0 +1,169 @@
+# app/core/export.py
+
+import io
+import json
+import posixpath
+import re
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator
+
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.blobs import open_blob
+from app.db.database import document_collection, version_collection
+
+# Master documents are resolved to versions this many at a time, so the
+# version lookup is one query per batch and memory stays bounded.
+EXPORT_BATCH_SIZE = 500
+
+# Archive entry names come from user input; each becomes a single path
+# component with no separators, control characters, drive colons or leading
+# dots, so nothing extracts as ".", "..", a hidden file or outside its folder.
+_UNSAFE_NAME_CHARS = re.compile(r"[/\\:\x00-\x1f\x7f]")
+_LEADING_DOTS = re.compile(r"^\.+")
+
+
+class _ZipSink(io.RawIOBase):
+    """
+    A write-only, unseekable stream that zipfile writes into. zipfile then
+    emits data descriptors instead of seeking back, and the bytes written so
+    far are handed to the response with `drain`.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_name(name: str) -> str:
+    name = _UNSAFE_NAME_CHARS.sub("_", name)
+    name = _LEADING_DOTS.sub(lambda match: "_" * len(match.group()), name)
+    return name or "_"
+
+
+def _archive_name(doc: dict, version: dict, include_history: bool, used: set) -> str:
+    """
+    The entry name of a version. Distinct names can sanitize to the same
+    one, so a name already in `used` gets a counter before its extension.
+    """
+    folder = _safe_name(doc["document_type"])
+    filename = _safe_name(doc["original_filename"])
+    if include_history:
+        folder = f"{folder}/v{version['version_number']}"
+    name = f"{folder}/{filename}"
+    stem, extension = posixpath.splitext(filename)
+    counter = 1
+    while name in used:
+        counter += 1
+        name = f"{folder}/{stem}~{counter}{extension}"
+    used.add(name)
+    return name
+
+
+def _versions_for_batch(docs: list[dict], include_history: bool):
+    """One query, read as a cursor, for the versions of a whole batch of master documents."""
+    if include_history:
+        query = {"document_id": {"$in": [doc["_id"] for doc in docs]}}
+    else:
+        query = {"$or": [
+            {"document_id": doc["_id"], "version_number": doc["latest_version"]}
+            for doc in docs
+        ]}
+    cursor = version_collection.find(
+        query,
+        {"document_id": 1, "version_number": 1, "file_path": 1, "size": 1, "sha256": 1, "created_at": 1}
+    ).sort([("document_id", 1), ("version_number", -1)])
+    return cursor.batch_size(EXPORT_BATCH_SIZE)
+
+
+async def _export_entries(employee_id: ObjectId, include_history: bool) -> AsyncIterator[tuple[dict, dict]]:
+    masters = document_collection.find(
+        {"employee_id": employee_id},
+        {"document_type": 1, "original_filename": 1, "latest_version": 1}
+    ).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    batch = []
+    async for doc in masters:
+        batch.append(doc)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            async for entry in _resolve(batch, include_history):
+                yield entry
+            batch = []
+    if batch:
+        async for entry in _resolve(batch, include_history):
+            yield entry
+
+
+async def _resolve(docs: list[dict], include_history: bool) -> AsyncIterator[tuple[dict, dict]]:
+    by_id = {doc["_id"]: doc for doc in docs}
+    async for version in _versions_for_batch(docs, include_history):
+        yield by_id[version["document_id"]], version
+
+
+async def stream_employee_archive(employee_id: str, include_history: bool = False) -> AsyncIterator[bytes]:
+    """
+    Yields a zip of an employee's latest document versions (or of every
+    version) as it is built. Files are copied into the archive in chunks and
+    compressed in the threadpool; nothing is buffered beyond the current
+    chunk, and no temporary file is used.
+
+    A manifest.json describing every entry, including versions whose file is
+    missing from storage, is written as the last member.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+    manifest = []
+    used_names = set()
+
+    async for doc, version in _export_entries(ObjectId(employee_id), include_history):
+        entry = {
+            "document_id": str(doc["_id"]),
+            "document_type": doc["document_type"],
+            "original_filename": doc["original_filename"],
+            "version": version["version_number"],
+        }
+        manifest.append(entry)
+
+        opened = await open_blob(version)
+        if opened is None:
+            entry["missing"] = True
+            continue
+        size, read_range = opened
+
+        name = _archive_name(doc, version, include_history, used_names)
+        entry["path"] = name
+        info = zipfile.ZipInfo(name, date_time=version["created_at"].timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+
+        member = await run_in_threadpool(archive.open, info, "w", force_zip64=True)
+        async for chunk in read_range(0, size):
+            await run_in_threadpool(member.write, chunk)
+            data = sink.drain()
+            if data:
+                yield data
+        await run_in_threadpool(member.close)
+        yield sink.drain()
+
+    info = zipfile.ZipInfo("manifest.json", date_time=datetime.utcnow().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, json.dumps({"employee_id": employee_id, "entries": manifest}, indent=2))
+    archive.close()
+    yield sink.drain()
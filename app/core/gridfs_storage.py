@@ -0,0 +1,366 @@
+# app/core/gridfs_storage.py
+"""
+Stored objects in MongoDB GridFS, so API nodes keep nothing on local disk
+that another node needs, and can be added or removed freely.
+
+Objects are GridFS files named like their local counterparts: a blob digest
+plus its encoding suffix, or a pack name. Their pointers are
+"gridfs:<name>". Pointers without the prefix are local paths written before
+the switch. They stay readable until app.core.storage_migration copies them
+into GridFS.
+
+Uploads are staged on local disk as before. `put` then streams the staged
+file into GridFS chunk by chunk. Downloads stream from a GridFS cursor one
+chunk at a time, so no file is ever held in memory.
+
+Each node keeps a read-through disk cache of objects it has written or read
+in full, bounded by STORAGE_CACHE_MAX_BYTES, and holding none larger than
+STORAGE_CACHE_MAX_OBJECT_BYTES. Hot versions are then served from local
+disk; larger objects, such as most packs, are always read from GridFS.
+Cache entries are keyed by the GridFS file id, so an object written again
+under the same name is never served stale.
+"""
+
+import os
+import threading
+from datetime import timezone
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from app.core.ranges import RangeReader, file_range_reader
+from app.core.storage import (
+    CHUNK_SIZE,
+    LISTING_BATCH_SIZE,
+    ListedObject,
+    LocalStorage,
+    StorageBackend,
+    _listed_files,
+    _remove_quietly,
+    iterate_in_batches
+)
+from app.db.database import LazyCollection, mongo
+
+POINTER_PREFIX = "gridfs:"
+# Quarantined objects are renamed under this prefix, which sorts after
+# every digest and pack name, so listings stop before reaching them
+QUARANTINE_PREFIX = "quarantine/"
+
+
+class DiskCache:
+    """
+    Local copies of stored objects, evicted least recently used first once
+    they exceed `max_bytes`. Hits refresh a file's mtime and eviction
+    rescans the directory, so the worker processes of a node share one
+    cache and one limit. These methods are blocking.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_object_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for parent, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(parent, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def open_entry(self, key: str):
+        """A file to write a new entry into; finish with `commit` or `abandon`."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{ObjectId()}.part"
+        return open(temporary, "wb"), temporary
+
+    def commit(self, sink, temporary: str, key: str) -> str:
+        sink.close()
+        path = self._path(key)
+        os.replace(temporary, path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def abandon(self, sink, temporary: str) -> None:
+        sink.close()
+        _remove_quietly(temporary)
+
+    def admit(self, source: str, key: str) -> Optional[str]:
+        """Moves a local file into the cache, or returns None if it is too large."""
+        size = os.path.getsize(source)
+        if size > self.max_object_bytes:
+            return None
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+        self._added(size)
+        return path
+
+    def _added(self, size: int) -> None:
+        with self._lock:
+            self._bytes += size
+            if self._bytes <= self.max_bytes:
+                return
+            # Other workers add entries too, so count what is really there
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                _remove_quietly(path)
+                total -= size
+            self._bytes = total
+
+    def stats(self) -> dict:
+        return {"bytes": self._bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def _cache_key(file: dict) -> str:
+    return f"{file['filename']}.{file['_id']}"
+
+
+class GridFSStorage(StorageBackend):
+    """
+    Objects in the GridFS bucket `bucket_name`. Local paths (pointers from
+    before the switch) are handled by a LocalStorage on `root`, which also
+    provides the staging area.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        bucket_name: str,
+        chunk_size_bytes: int,
+        cache_max_bytes: int,
+        cache_max_object_bytes: int
+    ):
+        self.bucket_name = bucket_name
+        self.chunk_size_bytes = chunk_size_bytes
+        self.local = LocalStorage(root)
+        self.cache = DiskCache(os.path.join(root, "cache"), cache_max_bytes, cache_max_object_bytes)
+        self._files = LazyCollection(f"{bucket_name}.files")
+        self._bucket = None
+        self._generation = None
+
+    def _gridfs(self) -> AsyncIOMotorGridFSBucket:
+        if self._generation != mongo.generation or self._bucket is None:
+            self._bucket = AsyncIOMotorGridFSBucket(
+                mongo.database, self.bucket_name, chunk_size_bytes=self.chunk_size_bytes
+            )
+            self._generation = mongo.generation
+        return self._bucket
+
+    @staticmethod
+    def _name(pointer: str) -> Optional[str]:
+        return pointer[len(POINTER_PREFIX):] if pointer.startswith(POINTER_PREFIX) else None
+
+    async def _newest(self, name: str, projection: Optional[dict] = None) -> Optional[dict]:
+        # Readers always use the newest revision of a name
+        return await self._files.find_one({"filename": name}, projection, sort=[("uploadDate", -1)])
+
+    async def _delete(self, file_id) -> None:
+        try:
+            await self._gridfs().delete(file_id)
+        except NoFile:
+            pass
+
+    def pointer(self, name: str) -> str:
+        return POINTER_PREFIX + name
+
+    def staging_path(self, suffix: str = ".part") -> str:
+        return self.local.staging_path(suffix)
+
+    async def _upload(self, local_path: str, name: str):
+        grid_in = self._gridfs().open_upload_stream(name)
+        source = await run_in_threadpool(open, local_path, "rb")
+        try:
+            while chunk := await run_in_threadpool(source.read, CHUNK_SIZE):
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        finally:
+            await run_in_threadpool(source.close)
+        await grid_in.close()
+
+        # Replaces any earlier object of that name
+        async for older in self._files.find({"filename": name, "_id": {"$ne": grid_in._id}}, {"_id": 1}):
+            await self._delete(older["_id"])
+        return grid_in._id
+
+    async def put(self, local_path: str, name: str) -> str:
+        file_id = await self._upload(local_path, name)
+        # What was just written is the likeliest to be read next
+        key = _cache_key({"filename": name, "_id": file_id})
+        if await run_in_threadpool(self.cache.admit, local_path, key) is None:
+            await run_in_threadpool(_remove_quietly, local_path)
+        return self.pointer(name)
+
+    async def adopt(self, local_path: str, name: str) -> str:
+        await self._upload(local_path, name)
+        return self.pointer(name)
+
+    async def exists(self, pointer: str) -> bool:
+        name = self._name(pointer)
+        if name is None:
+            return await self.local.exists(pointer)
+        return await self._files.find_one({"filename": name}, {"_id": 1}) is not None
+
+    async def size(self, pointer: str) -> int:
+        name = self._name(pointer)
+        if name is None:
+            return await self.local.size(pointer)
+        file = await self._newest(name, {"length": 1})
+        if file is None:
+            raise FileNotFoundError(pointer)
+        return file["length"]
+
+    async def _fill(self, file: dict, key: str) -> Optional[str]:
+        """Copies an object into the cache, or returns None if it is too large for it."""
+        if file["length"] > self.cache.max_object_bytes:
+            return None
+        sink, temporary = await run_in_threadpool(self.cache.open_entry, key)
+        try:
+            grid_out = await self._gridfs().open_download_stream(file["_id"])
+            while chunk := await grid_out.read(CHUNK_SIZE):
+                await run_in_threadpool(sink.write, chunk)
+        except BaseException:
+            await run_in_threadpool(self.cache.abandon, sink, temporary)
+            raise
+        return await run_in_threadpool(self.cache.commit, sink, temporary, key)
+
+    async def cached_path(self, pointer: str) -> Optional[str]:
+        name = self._name(pointer)
+        if name is None:
+            return pointer
+        file = await self._newest(name, {"filename": 1, "length": 1})
+        if file is None:
+            raise FileNotFoundError(pointer)
+        key = _cache_key(file)
+        return await run_in_threadpool(self.cache.get, key) or await self._fill(file, key)
+
+    async def _stream(self, file: dict, start: int, end: int, key: Optional[str]) -> AsyncIterator[bytes]:
+        """Bytes [start, end) from GridFS, copied into the cache under `key` if given."""
+        grid_out = await self._gridfs().open_download_stream(file["_id"])
+        grid_out.seek(start)
+        sink = temporary = None
+        if key is not None:
+            sink, temporary = await run_in_threadpool(self.cache.open_entry, key)
+        remaining = end - start
+        try:
+            while remaining > 0:
+                chunk = await grid_out.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if sink is not None:
+                    await run_in_threadpool(sink.write, chunk)
+                yield chunk
+        except BaseException:
+            if sink is not None:
+                await run_in_threadpool(self.cache.abandon, sink, temporary)
+            raise
+        if sink is not None:
+            if remaining == 0:
+                await run_in_threadpool(self.cache.commit, sink, temporary, key)
+            else:
+                await run_in_threadpool(self.cache.abandon, sink, temporary)
+
+    def range_reader(self, pointer: str) -> RangeReader:
+        name = self._name(pointer)
+        if name is None:
+            return self.local.range_reader(pointer)
+
+        async def read_range(start: int, end: int):
+            file = await self._newest(name, {"filename": 1, "length": 1})
+            if file is None:
+                raise FileNotFoundError(pointer)
+            key = _cache_key(file)
+            cached = await run_in_threadpool(self.cache.get, key)
+            if cached is not None:
+                try:
+                    async for chunk in file_range_reader(cached)(start, end):
+                        yield chunk
+                    return
+                except FileNotFoundError:
+                    # Evicted by another worker before it was opened
+                    pass
+            # Only complete reads of small enough objects fill the cache
+            fill = start == 0 and end == file["length"] and file["length"] <= self.cache.max_object_bytes
+            async for chunk in self._stream(file, start, end, key if fill else None):
+                yield chunk
+        return read_range
+
+    async def remove(self, pointer: str) -> None:
+        name = self._name(pointer)
+        if name is None:
+            await self.local.remove(pointer)
+            return
+        async for file in self._files.find({"filename": name}, {"_id": 1}):
+            await self._delete(file["_id"])
+
+    async def iter_objects(self, after: Optional[str] = None) -> AsyncIterator[ListedObject]:
+        cursor = self._files.find(
+            {"filename": {"$gt": after or "", "$lt": QUARANTINE_PREFIX}},
+            {"filename": 1, "length": 1, "uploadDate": 1}
+        ).sort("filename", 1).batch_size(LISTING_BATCH_SIZE)
+        async for file in cursor:
+            name = file["filename"]
+            if after is not None and name.split(".", 1)[0] <= after:
+                continue
+            modified_at = file["uploadDate"].replace(tzinfo=timezone.utc).timestamp()
+            yield ListedObject(name, self.pointer(name), file["length"], modified_at)
+
+    async def iter_unlisted(self) -> AsyncIterator[tuple[str, ListedObject]]:
+        staged = (("staging", listed) for listed in _listed_files(self.local.staging_directory))
+        async for item in iterate_in_batches(staged):
+            yield item
+
+    async def quarantine(self, pointer: str, label: str) -> Optional[str]:
+        name = self._name(pointer)
+        if name is None:
+            return await self.local.quarantine(pointer, label)
+        location = f"{QUARANTINE_PREFIX}{label}/{name}"
+        renamed = False
+        async for file in self._files.find({"filename": name}, {"_id": 1}):
+            await self._gridfs().rename(file["_id"], location)
+            renamed = True
+        return self.pointer(location) if renamed else None
+
+    async def restore(self, location: str, pointer: str) -> None:
+        name, quarantined = self._name(pointer), self._name(location)
+        if name is None or quarantined is None:
+            await self.local.restore(location, pointer)
+            return
+        if await self.exists(pointer):
+            return
+        async for file in self._files.find({"filename": quarantined}, {"_id": 1}):
+            await self._gridfs().rename(file["_id"], name)
@@ -0,0 +1,69 @@
+# app/core/http_cache.py
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from starlette.datastructures import Headers
+
+# Versions are immutable once written, so clients may keep them forever.
+# "private" because every download is tied to an authenticated user.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# "The latest version" changes with every upload, so it must be revalidated
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def version_etag(version: dict) -> str:
+    """
+    Builds a strong ETag for a stored version.
+    The content hash is preferred; older records without one fall back to
+    the version id, which is just as stable since versions never change.
+    """
+    return f'"{version.get("sha256") or version["_id"]}"'
+
+
+def http_date(value: datetime) -> str:
+    # Stored timestamps are naive UTC (datetime.utcnow)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: datetime, cache_control: str = IMMUTABLE_CACHE_CONTROL) -> dict:
+    return {
+        "etag": etag,
+        "last-modified": http_date(last_modified),
+        "cache-control": cache_control,
+    }
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison function (RFC 9110 13.1.2)
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def is_not_modified(request_headers: Headers, etag: str, last_modified: datetime) -> bool:
+    """
+    Evaluates If-None-Match / If-Modified-Since against a version's validators.
+    If-Modified-Since is ignored when If-None-Match is present.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return last_modified.replace(microsecond=0) <= since
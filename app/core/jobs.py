@@ -0,0 +1,280 @@
+# app/core/jobs.py
+"""
+Durable background jobs for work derived from an upload.
+
+Jobs are rows in the `jobs` collection, keyed by an idempotency key, so
+enqueueing the same work twice is a no-op and nothing is lost if the process
+dies: a job whose lease expires is picked up again by any worker. Each API
+process runs a few async workers that claim due jobs with one atomic update,
+run the registered handler and retry failures with exponential backoff.
+
+CPU-heavy steps inside handlers go through `run_cpu_bound`, which uses a
+dedicated thread or process pool (JOB_CPU_POOL) instead of the threadpool
+that serves requests.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.config import settings
+from app.db.database import job_collection
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Completion lags kept for the stats endpoint
+RECENT_LAG_SAMPLES = 256
+
+
+def job(
+    kind: str,
+    key: str,
+    payload: dict,
+    max_attempts: Optional[int] = None,
+    delay_seconds: float = 0
+) -> dict:
+    """Builds a job row; `key` must identify the work, not the request."""
+    now = datetime.utcnow()
+    return {
+        "_id": f"{kind}:{key}",
+        "kind": kind,
+        "payload": payload,
+        "status": PENDING,
+        "attempts": 0,
+        "max_attempts": max_attempts or settings.job_max_attempts,
+        "run_at": now + timedelta(seconds=delay_seconds),
+        "created_at": now,
+    }
+
+
+class JobQueue:
+    """
+    Registry of job handlers plus the in-process workers that run them.
+    Workers wake up as soon as a job is enqueued by this process and poll
+    every JOB_POLL_INTERVAL_SECONDS for jobs enqueued elsewhere or due
+    for a retry.
+    """
+
+    def __init__(self, workers: int, poll_interval: float, lease_seconds: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._handlers: dict[str, JobHandler] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._cpu_executor: Optional[Executor] = None
+
+        self.running = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self._recent_lags: deque[float] = deque(maxlen=RECENT_LAG_SAMPLES)
+
+    def handler(self, kind: str):
+        """Decorator registering the coroutine that runs jobs of `kind`."""
+        def register(fn: JobHandler) -> JobHandler:
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    async def enqueue(self, *jobs: dict) -> None:
+        """
+        Persists jobs, ignoring any whose key is already queued or done.
+        Returns once they are durable; they run asynchronously.
+        """
+        if not jobs:
+            return
+        if len(jobs) == 1:
+            try:
+                await job_collection.update_one(
+                    {"_id": jobs[0]["_id"]}, {"$setOnInsert": jobs[0]}, upsert=True
+                )
+            except DuplicateKeyError:
+                pass
+        else:
+            try:
+                await job_collection.bulk_write(
+                    [UpdateOne({"_id": j["_id"]}, {"$setOnInsert": j}, upsert=True) for j in jobs],
+                    ordered=False
+                )
+            except BulkWriteError as exc:
+                # Only concurrent upserts of the same key are expected here
+                if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+                    raise
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await job_collection.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "run_at": {"$lte": now}},
+                # Abandoned by a worker that died mid-job
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "started_at": now,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _finish(self, claimed: dict, error: Optional[BaseException]) -> None:
+        now = datetime.utcnow()
+        # Only the worker holding the lease may settle the job
+        match = {"_id": claimed["_id"], "status": RUNNING, "attempts": claimed["attempts"]}
+        if error is None:
+            self.completed += 1
+            # Measured from when the job became due, so delayed jobs and
+            # retry backoff do not count as queue lag
+            self._recent_lags.append((now - claimed["run_at"]).total_seconds())
+            update = {
+                "status": DONE,
+                "finished_at": now,
+                "expires_at": now + timedelta(seconds=settings.job_retention_seconds)
+            }
+        elif claimed["attempts"] < claimed["max_attempts"]:
+            self.retried += 1
+            delay = settings.job_retry_base_seconds * 2 ** (claimed["attempts"] - 1)
+            update = {"status": PENDING, "run_at": now + timedelta(seconds=delay), "last_error": repr(error)}
+        else:
+            self.failed += 1
+            logger.error("Job %s failed after %d attempts: %r", claimed["_id"], claimed["attempts"], error)
+            update = {"status": FAILED, "finished_at": now, "last_error": repr(error)}
+        await job_collection.update_one(match, {"$set": update, "$unset": {"lease_expires_at": ""}})
+
+    async def _run(self, claimed: dict) -> None:
+        handler = self._handlers.get(claimed["kind"])
+        error = None
+        self.running += 1
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind {claimed['kind']!r}")
+            await handler(claimed["payload"])
+        except Exception as exc:
+            logger.warning("Job %s attempt %d failed", claimed["_id"], claimed["attempts"], exc_info=True)
+            error = exc
+        finally:
+            self.running -= 1
+        await self._finish(claimed, error)
+
+    async def _worker(self) -> None:
+        while True:
+            # Cleared before claiming, so a job enqueued meanwhile is either
+            # claimed now or wakes the wait below
+            self._wakeup.clear()
+            try:
+                claimed = await self._claim()
+            except Exception:
+                logger.exception("Failed to claim a job")
+                claimed = None
+            if claimed is not None:
+                try:
+                    await self._run(claimed)
+                except Exception:
+                    # The lease expires and the job is claimed again
+                    logger.exception("Failed to settle job %s", claimed["_id"])
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Starts the workers and the CPU pool; call from the app lifespan."""
+        if self._tasks:
+            return
+        if settings.job_cpu_pool == "process":
+            self._cpu_executor = ProcessPoolExecutor(max_workers=settings.job_cpu_workers)
+        else:
+            self._cpu_executor = ThreadPoolExecutor(
+                max_workers=settings.job_cpu_workers, thread_name_prefix="jobs-cpu"
+            )
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        Stops the workers. A job interrupted mid-run keeps its lease and is
+        retried by whichever process claims it after the lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+        if self._cpu_executor is not None:
+            self._cpu_executor.shutdown(wait=False, cancel_futures=True)
+            self._cpu_executor = None
+
+    async def run_cpu_bound(self, fn, *args):
+        """
+        Runs a CPU-bound function on the job CPU pool, or on the default
+        threadpool when the workers are not started (e.g. in CLI tools).
+        With JOB_CPU_POOL=process, `fn` and its arguments must be picklable.
+        """
+        if self._cpu_executor is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_executor, fn, *args)
+
+    async def stats(self) -> dict:
+        """
+        Queue depth per status and lag: how long the oldest due job has been
+        waiting since it became due, and how long recent jobs took from
+        becoming due to completion.
+        """
+        now = datetime.utcnow()
+        counts = {
+            row["_id"]: row["count"]
+            async for row in job_collection.aggregate([
+                {"$match": {"status": {"$in": [PENDING, RUNNING, FAILED]}}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+            ])
+        }
+        oldest = await job_collection.find_one(
+            {"status": PENDING, "run_at": {"$lte": now}},
+            {"run_at": 1},
+            sort=[("run_at", ASCENDING)]
+        )
+        lags = sorted(self._recent_lags)
+        return {
+            "workers": len(self._tasks),
+            "cpu_pool": settings.job_cpu_pool,
+            "pending": counts.get(PENDING, 0),
+            "running": counts.get(RUNNING, 0),
+            "failed": counts.get(FAILED, 0),
+            "oldest_pending_age_seconds": (now - oldest["run_at"]).total_seconds() if oldest else 0.0,
+            "running_here": self.running,
+            "completed_here": self.completed,
+            "retried_here": self.retried,
+            "failed_here": self.failed,
+            "recent_lag_seconds_p50": lags[len(lags) // 2] if lags else None,
+            "recent_lag_seconds_max": lags[-1] if lags else None,
+        }
+
+
+job_queue = JobQueue(
+    workers=settings.job_workers,
+    poll_interval=settings.job_poll_interval_seconds,
+    lease_seconds=settings.job_lease_seconds
+)
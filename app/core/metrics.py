@@ -0,0 +1,254 @@
+# app/core/metrics.py
+"""
+Process-local metrics in the Prometheus text format, served on /metrics.
+
+Counters and histograms are plain dicts keyed by label values behind one
+lock each, so recording costs a dict lookup and a bisect; everything else
+happens when /metrics is scraped. Stats that components already keep
+(caches, pools, the job queue) are read at scrape time through collectors
+rather than duplicated here.
+
+Recorded:
+    - HTTP request latency per route template (MetricsMiddleware)
+    - MongoDB command latency per command and collection (MongoCommandMetrics)
+    - bytes and time spent storing uploads and streaming downloads
+    - time spent encoding fast-path JSON responses
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import AsyncIterator, Callable, Iterable
+
+from pymongo import monitoring
+
+from app.core.ranges import RangeReader
+
+# Seconds; spans a cached lookup up to a slow multi-megabyte transfer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = "hrdms_"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = METRIC_PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Collector:
+    """
+    Reads values from an existing stats() method at scrape time.
+    `fields` maps a stats key to (metric name, type, help).
+    """
+
+    def __init__(self, stats: Callable[[], dict], fields: dict[str, tuple[str, str, str]]):
+        self.stats = stats
+        self.fields = fields
+
+    def render(self) -> list[str]:
+        stats = self.stats()
+        lines = []
+        for key, (name, kind, help) in self.fields.items():
+            value = stats.get(key)
+            if value is None:
+                continue
+            name = METRIC_PREFIX + name
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route")
+))
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")
+))
+mongo_command_duration = registry.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips.", ("command", "collection")
+))
+mongo_command_failures = registry.register(Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error.", ("command", "collection")
+))
+upload_bytes = registry.register(Counter(
+    "upload_bytes_total", "Bytes of uploaded files written to storage."
+))
+upload_duration = registry.register(Histogram(
+    "upload_storage_duration_seconds", "Time to stream, hash and write one uploaded file."
+))
+download_bytes = registry.register(Counter(
+    "download_bytes_total", "Bytes of document content sent to clients."
+))
+download_duration = registry.register(Histogram(
+    "download_stream_duration_seconds", "Time to read and send the content of one download."
+))
+serialization_duration = registry.register(Histogram(
+    "response_serialization_duration_seconds", "Time to encode fast-path JSON responses.", ("model",)
+))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request until its last body
+    chunk is sent. Requests are labelled with the route template (e.g.
+    /documents/{doc_id}), never the raw path, to keep label sets bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], template)
+            http_requests.inc(1, scope["method"], template, str(status))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener timing every command by name and collection.
+    Callbacks run on Motor's worker threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._collections: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(event) -> tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event) -> None:
+        value = event.command.get(event.command_name)
+        collection = value if isinstance(value, str) else event.command.get("collection", "")
+        with self._lock:
+            self._collections[self._key(event)] = collection
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._collections.pop(self._key(event), "")
+
+    def succeeded(self, event) -> None:
+        collection = self._finish(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event) -> None:
+        collection = self._finish(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+        mongo_command_failures.inc(1, event.command_name, collection)
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+def metered_range_reader(read_range: RangeReader) -> RangeReader:
+    """Wraps a download's range reader to count the bytes and time it streams."""
+    async def read(start: int, end: int) -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        sent = 0
+        try:
+            async for chunk in read_range(start, end):
+                sent += len(chunk)
+                yield chunk
+        finally:
+            download_bytes.inc(sent)
+            download_duration.observe(time.perf_counter() - started)
+    return read
@@ -0,0 +1,130 @@
+# app/core/packs.py
+"""
+Packfiles: many cold blobs stored back to back in one file.
+
+A pack is written once and never modified. Its layout is
+
+    PACK_MAGIC, then the stored bytes of each blob, back to back
+
+and a sidecar index next to it lists where each blob is:
+
+    INDEX_MAGIC, entry count (u64), then per entry, sorted by digest:
+    SHA-256 digest (32 bytes), offset (u64), length (u64)
+
+Blob records carry their own pack, offset and length, so reads never consult
+the index; it makes a pack self-describing for backups, verification and
+rebuilding the records. Blobs keep their encoding inside a pack, so a delta
+or zlib blob is packed as the same bytes it had as a loose file.
+
+Reads slice a memory-mapped pack. Maps are shared between requests and kept
+open in a small LRU; slicing copies out of the page cache, so the blocking
+part runs in the threadpool like any other file read.
+
+These functions are blocking except where noted.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+from app.core.storage import CHUNK_SIZE
+
+PACK_MAGIC = b"HRPK1\n"
+INDEX_MAGIC = b"HRPI1\n"
+_COUNT = struct.Struct(">Q")
+_ENTRY = struct.Struct(">32sQQ")
+
+
+def write_pack(sources: Iterable[tuple[str, str]], pack_path: str, index_path: str) -> list[tuple[str, int, int]]:
+    """
+    Concatenates the files of `sources`, given as (sha256, path) pairs, into
+    a new pack and writes its index. Both files are flushed to disk before
+    returning. Returns (sha256, offset, length) per packed blob; sources
+    that no longer exist are skipped.
+    """
+    entries = []
+    with open(pack_path, "wb") as pack:
+        pack.write(PACK_MAGIC)
+        offset = len(PACK_MAGIC)
+        for sha256, path in sources:
+            try:
+                source = open(path, "rb")
+            except FileNotFoundError:
+                # Released since it was selected
+                continue
+            with source:
+                length = 0
+                while chunk := source.read(CHUNK_SIZE):
+                    pack.write(chunk)
+                    length += len(chunk)
+            entries.append((sha256, offset, length))
+            offset += length
+        pack.flush()
+        os.fsync(pack.fileno())
+
+    with open(index_path, "wb") as index:
+        index.write(INDEX_MAGIC + _COUNT.pack(len(entries)))
+        for sha256, offset, length in sorted(entries):
+            index.write(_ENTRY.pack(bytes.fromhex(sha256), offset, length))
+        index.flush()
+        os.fsync(index.fileno())
+    return entries
+
+
+def read_pack_index(index_path: str) -> list[tuple[str, int, int]]:
+    """Returns every (sha256, offset, length) entry of a pack index."""
+    with open(index_path, "rb") as f:
+        data = f.read()
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError(f"Not a pack index: {index_path}")
+    (count,) = _COUNT.unpack_from(data, len(INDEX_MAGIC))
+    start = len(INDEX_MAGIC) + _COUNT.size
+    return [
+        (digest.hex(), offset, length)
+        for digest, offset, length in _ENTRY.iter_unpack(data[start:start + count * _ENTRY.size])
+    ]
+
+
+class PackFiles:
+    """
+    Open memory maps of packfiles, shared by all readers. Evicted maps are
+    not closed explicitly: readers still streaming from one hold a
+    reference, and the map is unmapped once the last of them is done.
+    """
+
+    def __init__(self, max_open: int = 64):
+        self.max_open = max_open
+        self._maps: OrderedDict[str, mmap.mmap] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, path: str) -> mmap.mmap:
+        with self._lock:
+            mapped = self._maps.get(path)
+            if mapped is not None:
+                self._maps.move_to_end(path)
+                return mapped
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            self._maps[path] = mapped
+            while len(self._maps) > self.max_open:
+                self._maps.popitem(last=False)
+        return mapped
+
+    def read(self, path: str, offset: int, length: int) -> bytes:
+        return self.open(path)[offset:offset + length]
+
+    def iter_slices(self, path: str, offset: int, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yields bytes [start, end) of the blob at `offset` in the pack."""
+        mapped = self.open(path)
+        for position in range(offset + start, offset + end, chunk_size):
+            yield mapped[position:min(position + chunk_size, offset + end)]
+
+    def stats(self) -> dict:
+        return {"open": len(self._maps), "max_open": self.max_open}
+
+
+pack_files = PackFiles()
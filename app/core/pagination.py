@@ -0,0 +1,77 @@
+# app/core/pagination.py
+
+import base64
+import binascii
+from typing import Any, Optional
+
+from bson import json_util
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Shared query parameters for every paginated endpoint
+AfterQuery = Query(None, description="Opaque cursor returned as `next_cursor` by the previous page")
+LimitQuery = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+
+
+def encode_cursor(value: Any) -> str:
+    # Extended JSON keeps ObjectId/datetime types intact across the round trip
+    raw = json_util.dumps([value]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        (value,) = json_util.loads(base64.urlsafe_b64decode(padded))
+        return value
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor",
+        )
+
+
+def model_projection(model: type[BaseModel]) -> dict:
+    """
+    A Mongo projection that only returns the fields `model` declares,
+    so large or sensitive extra fields never leave the database.
+    """
+    return {(field.alias or name): 1 for name, field in model.model_fields.items()}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    *,
+    sort_field: str,
+    descending: bool = False,
+    projection: Optional[dict] = None,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> dict:
+    """
+    Fetches one page using keyset pagination on `sort_field`, which must be
+    unique within `query` and covered by an index together with it.
+
+    Pages are located by seeking past the last key seen rather than by
+    skipping, so page 500 costs the same as page 1.
+    """
+    if after is not None:
+        operator = "$lt" if descending else "$gt"
+        query = {**query, sort_field: {operator: decode_cursor(after)}}
+
+    cursor = (
+        collection.find(query, projection)
+        .sort(sort_field, -1 if descending else 1)
+        .limit(limit + 1)
+    )
+    rows = await cursor.to_list(limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][sort_field])
+    return {"items": rows, "next_cursor": next_cursor}
@@ -0,0 +1,78 @@
+# app/core/processing.py
+"""
+Work derived from a newly recorded version, run as background jobs so
+uploads return as soon as the file and its DocumentVersion are stored.
+
+Each version gets one job per step, keyed by the version id, so re-enqueueing
+a version never duplicates work. Handlers reload the version from the
+database and are safe to run more than once.
+"""
+
+import logging
+
+from bson import ObjectId
+
+from app.config import settings
+from app.core.blobs import encode_blob
+from app.core.jobs import job, job_queue
+from app.core.search import index_version
+from app.db.database import document_collection, version_collection
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = "index_version"
+ENCODE_BLOB = "encode_blob"
+
+
+def version_jobs(version_dict: dict) -> list[dict]:
+    key = str(version_dict["_id"])
+    payload = {"version_id": key}
+    jobs = [job(INDEX_VERSION, key, payload)]
+    if settings.blob_encoding != "raw":
+        jobs.append(job(ENCODE_BLOB, key, payload))
+    return jobs
+
+
+async def enqueue_version_processing(*version_dicts: dict) -> None:
+    """
+    Queues the post-upload steps of freshly inserted versions. A failure
+    here does not undo the upload, so it is logged rather than raised; the
+    search index can be rebuilt and encoding only saves disk space.
+    """
+    try:
+        await job_queue.enqueue(*(j for version in version_dicts for j in version_jobs(version)))
+    except Exception:
+        logger.exception("Failed to queue processing of %d version(s)", len(version_dicts))
+
+
+async def _load_version(payload: dict) -> dict:
+    version = await version_collection.find_one({"_id": ObjectId(payload["version_id"])})
+    if version is None:
+        raise LookupError(f"Version {payload['version_id']} does not exist")
+    return version
+
+
+@job_queue.handler(INDEX_VERSION)
+async def _index_version(payload: dict) -> None:
+    version = await _load_version(payload)
+    master = await document_collection.find_one({"_id": version["document_id"]}, {"employee_id": 1})
+    if master is None:
+        return
+    await index_version(version, master["employee_id"])
+
+
+@job_queue.handler(ENCODE_BLOB)
+async def _encode_blob(payload: dict) -> None:
+    """
+    Applies the configured storage encoding (see BLOB_ENCODING) to the blob
+    of a version, using the previous version as delta base.
+    """
+    version = await _load_version(payload)
+    base_sha256 = None
+    if version["version_number"] > 1:
+        previous = await version_collection.find_one(
+            {"document_id": version["document_id"], "version_number": version["version_number"] - 1},
+            {"sha256": 1}
+        )
+        base_sha256 = previous.get("sha256") if previous else None
+    await encode_blob(version["sha256"], base_sha256)
@@ -0,0 +1,181 @@
+# app/core/ranges.py
+
+from secrets import token_hex
+from typing import AsyncIterator, Callable
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, status
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+# Produces the bytes in [start, end) of a stored version
+RangeReader = Callable[[int, int], AsyncIterator[bytes]]
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(value: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parses a `Range: bytes=...` header into sorted, merged [start, end) pairs.
+
+    Returns None when the header should be ignored (unknown unit or bad
+    syntax, per RFC 9110 14.2) and raises RangeNotSatisfiable when none of
+    the requested ranges overlap the representation.
+    """
+    units, _, spec = value.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = (p.strip() for p in part.partition("-"))
+        if not dash:
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            if not last.isdigit():
+                return None
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size))
+            continue
+
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        end = int(last) + 1 if last else None
+        if end is not None and end <= start:
+            return None
+        if start < size:
+            ranges.append((start, size if end is None else min(end, size)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def attachment_header(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def file_range_reader(path: str, chunk_size: int = CHUNK_SIZE) -> RangeReader:
+    async def read_range(start: int, end: int) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = await file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return read_range
+
+
+def _if_range_allows(request: Request, headers: dict) -> bool:
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    return if_range in (headers.get("etag"), headers.get("last-modified"))
+
+
+def range_response(
+    request: Request,
+    *,
+    size: int,
+    read_range: RangeReader,
+    media_type: str,
+    filename: str,
+    headers: dict
+) -> Response:
+    """
+    Streams a stored version, honouring single and multi-part Range requests.
+    `headers` should already carry the ETag and Last-Modified validators,
+    which If-Range is checked against.
+    """
+    headers = {
+        **headers,
+        "accept-ranges": "bytes",
+        "content-disposition": attachment_header(filename),
+    }
+
+    range_header = request.headers.get("range")
+    ranges = None
+    if range_header is not None and _if_range_allows(request, headers):
+        try:
+            ranges = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "content-range": f"bytes */{size}"}
+            )
+
+    if not ranges:
+        headers["content-length"] = str(size)
+        return StreamingResponse(read_range(0, size), media_type=media_type, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["content-length"] = str(end - start)
+        return StreamingResponse(
+            read_range(start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=media_type,
+            headers=headers
+        )
+
+    boundary = token_hex(13)
+    part_headers = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+        ).encode("latin-1")
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    separator = b"\r\n"
+    content_length = (
+        sum(len(h) for h in part_headers)
+        + sum(end - start for start, end in ranges)
+        + len(separator) * (len(ranges) - 1)
+        + len(closing)
+    )
+
+    async def multipart_body() -> AsyncIterator[bytes]:
+        for index, (start, end) in enumerate(ranges):
+            if index:
+                yield separator
+            yield part_headers[index]
+            async for chunk in read_range(start, end):
+                yield chunk
+        yield closing
+
+    headers["content-length"] = str(content_length)
+    return StreamingResponse(
+        multipart_body(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers
+    )
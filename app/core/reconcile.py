@@ -0,0 +1,460 @@
+# app/core/reconcile.py
+"""
+Finds stored files that nothing refers to, and records whose content is
+missing.
+
+An upload writes its file before the version record, so a failed insert or
+a crash leaves a file (and a blob reference) behind. The other way round, a
+version can point at content that is gone, which a download would only
+discover at request time. This tool walks the store and the database as
+streams sorted by SHA-256 digest and merge-joins them, so memory use is one
+batch per stream however large the archive is. The streams are:
+
+- the stored objects, from the storage backend's sorted listing
+- `blobs`, by _id
+- `document_versions`, by sha256
+- delta blobs, by the base they were encoded against
+
+For each digest it reports:
+
+- orphan_file: a stored file that is neither its blob's current file nor
+  waiting for a remove_raw_file job. Examples are files left by a crash and
+  copies left by a storage migration that lost a race.
+- orphan_blob: a blob record that no version or delta uses.
+- dangling_version: a version whose content is missing.
+- dangling_base: a missing blob that deltas were encoded against.
+- ref_count_mismatch: a blob whose ref_count differs from its number of users.
+- unrecorded_blob: versions served from their own file without a blob
+  record. app.core.storage_migration adopts these.
+- orphan_pack: a pack that no blob uses any more.
+- dead_pack_bytes: bytes of released blobs inside a pack that is still in use.
+
+A fresh run first reports files left in the staging area (stale_staging),
+files outside the storage layout (unmigrated; run app.core.storage_migration)
+and pre-blob-store versions whose file is missing.
+
+Anything younger than --min-age is skipped, so uploads in flight are never
+touched. Every finding is checked against fresh data before anything is
+changed.
+
+With --quarantine nothing is deleted outright:
+
+- orphan files and packs move to the store's quarantine area.
+- orphan blobs are released through release_blob once their file has been
+  quarantined.
+- dangling versions move to the `quarantined_versions` collection, and a
+  master whose latest version was moved points at its newest remaining one.
+
+Progress is checkpointed in `reconcile_state` after every --batch-size
+digests, and the next run resumes from the checkpoint. --max-digests limits
+one run, so a large archive can be checked a slice at a time from cron.
+
+Usage:
+    python -m app.core.reconcile [--quarantine] [--batch-size 1000] [--max-digests N]
+                                 [--min-age 86400] [--pause 0] [--restart]
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Optional
+
+from pymongo import ASCENDING
+
+from app.core.blobs import REMOVE_RAW_FILE, release_blob
+from app.core.document import repoint_latest
+from app.core.jobs import PENDING, RUNNING
+from app.core.packs import PACK_MAGIC
+from app.core.storage import ListedObject, storage
+from app.db.database import (
+    blob_collection,
+    job_collection,
+    quarantined_version_collection,
+    reconcile_state_collection,
+    version_collection
+)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MIN_AGE_SECONDS = 24 * 3600
+STATE_ID = "reconcile"
+PACK_SUFFIXES = (".pack", ".idx")
+
+_BLOB_PROJECTION = {"path": 1, "pack": 1, "encoding": 1, "ref_count": 1, "created_at": 1}
+_VERSION_PROJECTION = {"sha256": 1, "file_path": 1, "document_id": 1, "version_number": 1, "created_at": 1}
+
+Finding = Callable[[str, dict], None]
+
+
+@dataclass
+class ReconcileReport:
+    digests: int = 0
+    files: int = 0
+    orphan_files: int = 0
+    orphan_blobs: int = 0
+    dangling_versions: int = 0
+    dangling_bases: int = 0
+    ref_count_mismatches: int = 0
+    unrecorded_blobs: int = 0
+    orphan_packs: int = 0
+    dead_pack_bytes: int = 0
+    stale_staging: int = 0
+    unmigrated: int = 0
+    # Files awaiting their remove_raw_file job, which are left alone
+    pending_removal: int = 0
+    quarantined: int = 0
+    # Where the next run continues, or None once the whole store was checked
+    resume_after: Optional[str] = None
+
+
+def _digest_of(name: str) -> str:
+    # Blob files and their encoded forms are named after the digest; copies
+    # in progress add ".<id>.part"
+    return name.split(".", 1)[0]
+
+
+class _SortedStream:
+    """Groups rows of an iterator sorted by `key` into one list per key."""
+
+    def __init__(self, rows: AsyncIterator, key: Callable[[Any], str]):
+        self._rows = rows.__aiter__()
+        self._key = key
+        self._head = None
+        self._exhausted = False
+
+    async def peek(self) -> Optional[str]:
+        if self._head is None and not self._exhausted:
+            try:
+                self._head = await self._rows.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+        return None if self._head is None else self._key(self._head)
+
+    async def take(self, key: str) -> list:
+        group = []
+        while await self.peek() == key:
+            group.append(self._head)
+            self._head = None
+        return group
+
+
+def _sorted_rows(collection, field: str, after: Optional[str], projection: dict, batch_size: int):
+    # Strings only: "" sorts below every digest and excludes null digests
+    query = {field: {"$gt": after or ""}}
+    return collection.find(query, projection).sort(field, ASCENDING).batch_size(batch_size)
+
+
+class _Reconciler:
+    def __init__(self, report: ReconcileReport, quarantine: bool, label: str, min_age_seconds: float,
+                 on_finding: Optional[Finding]):
+        self.report = report
+        self.quarantine = quarantine
+        self.label = label
+        self.min_age_seconds = min_age_seconds
+        self.on_finding = on_finding
+        self._pack_exists: dict[str, bool] = {}
+
+    def _found(self, kind: str, **details) -> None:
+        if self.on_finding:
+            self.on_finding(kind, details)
+
+    def _is_settled_file(self, listed: ListedObject) -> bool:
+        return time.time() - listed.modified_at >= self.min_age_seconds
+
+    def _is_settled_record(self, record: dict) -> bool:
+        created_at = record.get("created_at")
+        return created_at is None or created_at <= datetime.utcnow() - timedelta(seconds=self.min_age_seconds)
+
+    async def _quarantine_file(self, pointer: str) -> Optional[str]:
+        if not self.quarantine:
+            return None
+        location = await storage.quarantine(pointer, self.label)
+        if location is not None:
+            self.report.quarantined += 1
+        return location
+
+    async def _pack_present(self, path: str) -> bool:
+        # Packs hold hundreds of blobs each, so their existence is cached
+        if path not in self._pack_exists:
+            if len(self._pack_exists) >= 1024:
+                self._pack_exists.clear()
+            self._pack_exists[path] = await storage.exists(path)
+        return self._pack_exists[path]
+
+    async def _blob_present(self, blob: dict, listed: set[str]) -> bool:
+        if blob.get("pack"):
+            return await self._pack_present(blob["pack"]["path"])
+        if blob["path"] in listed:
+            return True
+        # The listing is a snapshot: the blob may have been re-encoded or
+        # moved since, so a miss is confirmed against fresh data
+        fresh = await blob_collection.find_one({"_id": blob["_id"]}, {"path": 1, "pack": 1})
+        if fresh is None:
+            return False
+        if fresh.get("pack"):
+            return await storage.exists(fresh["pack"]["path"])
+        return await storage.exists(fresh["path"])
+
+    async def check_digest(
+        self,
+        digest: str,
+        files: list[ListedObject],
+        blob: Optional[dict],
+        versions: list[dict],
+        deltas: list[dict]
+    ) -> None:
+        self.report.digests += 1
+        self.report.files += len(files)
+        pack_files = [listed for listed in files if listed.name.endswith(PACK_SUFFIXES)]
+        if pack_files:
+            await self._check_pack(pack_files)
+            files = [listed for listed in files if not listed.name.endswith(PACK_SUFFIXES)]
+
+        listed = {listed.pointer for listed in files}
+        if blob is None:
+            # open_blob serves a version's own file when there is no record
+            served = {version["file_path"] for version in versions if version["file_path"] in listed}
+            for listed_file in files:
+                if listed_file.pointer not in served:
+                    await self._check_orphan_file(digest, listed_file)
+            for version in versions:
+                if version["file_path"] in served or await storage.exists(version["file_path"]):
+                    self.report.unrecorded_blobs += 1
+                    self._found("unrecorded_blob", version_id=version["_id"], file_path=version["file_path"])
+                else:
+                    await self._dangling_version(version)
+            return
+
+        current = None if blob.get("pack") else blob["path"]
+        for listed_file in files:
+            if listed_file.pointer != current:
+                await self._check_orphan_file(digest, listed_file)
+
+        if not await self._blob_present(blob, listed):
+            # Versions whose own file is still there are served from it
+            for version in versions:
+                if version["file_path"] not in listed and not await storage.exists(version["file_path"]):
+                    await self._dangling_version(version, blob)
+            if deltas:
+                self.report.dangling_bases += 1
+                self._found("dangling_base", sha256=digest, deltas=len(deltas))
+            if not versions and not deltas:
+                await self._orphan_blob(blob)
+            return
+
+        users = len(versions) + len(deltas)
+        if users == 0:
+            await self._orphan_blob(blob)
+        elif blob.get("ref_count") != users and self._is_settled_record(blob):
+            self.report.ref_count_mismatches += 1
+            self._found("ref_count_mismatch", sha256=digest, ref_count=blob.get("ref_count"), users=users)
+
+    async def _check_orphan_file(self, digest: str, listed: ListedObject) -> None:
+        if not self._is_settled_file(listed):
+            return
+        fresh = await blob_collection.find_one({"_id": digest}, {"path": 1, "pack": 1})
+        if fresh is not None and fresh["path"] == listed.pointer and not fresh.get("pack"):
+            # Stored there since the listing was taken
+            return
+        pending = await job_collection.find_one(
+            {
+                "_id": {"$regex": f"^{re.escape(REMOVE_RAW_FILE)}:{digest}:"},
+                "payload.path": listed.pointer,
+                "status": {"$in": [PENDING, RUNNING]}
+            },
+            {"_id": 1}
+        )
+        if pending is not None:
+            self.report.pending_removal += 1
+            return
+        self.report.orphan_files += 1
+        location = await self._quarantine_file(listed.pointer)
+        self._found("orphan_file", path=listed.pointer, size=listed.size, quarantined_to=location)
+
+    async def _orphan_blob(self, blob: dict) -> None:
+        if not self._is_settled_record(blob):
+            return
+        self.report.orphan_blobs += 1
+        self._found("orphan_blob", sha256=blob["_id"], ref_count=blob.get("ref_count"), path=blob["path"])
+        if not self.quarantine:
+            return
+
+        # Users may have appeared since the streams were read
+        if (
+            await version_collection.find_one({"sha256": blob["_id"]}, {"_id": 1}) is not None
+            or await blob_collection.find_one({"base": blob["_id"]}, {"_id": 1}) is not None
+        ):
+            return
+        # Leave exactly the reference release_blob drops; an upload that
+        # takes a reference in the meantime keeps the blob alive
+        result = await blob_collection.update_one(
+            {"_id": blob["_id"], "ref_count": blob.get("ref_count")}, {"$set": {"ref_count": 1}}
+        )
+        if result.matched_count == 0:
+            return
+        location = None if blob.get("pack") else await storage.quarantine(blob["path"], self.label)
+        if await release_blob(blob["_id"]):
+            self.report.quarantined += 1
+        elif location is not None:
+            await storage.restore(location, blob["path"])
+
+    async def _dangling_version(self, version: dict, blob: Optional[dict] = None) -> None:
+        if not self._is_settled_record(version):
+            return
+        self.report.dangling_versions += 1
+        self._found(
+            "dangling_version",
+            version_id=version["_id"],
+            document_id=version.get("document_id"),
+            version_number=version.get("version_number"),
+            sha256=version.get("sha256"),
+            file_path=version["file_path"]
+        )
+        if not self.quarantine:
+            return
+
+        record = await version_collection.find_one({"_id": version["_id"]})
+        if record is None:
+            return
+        await quarantined_version_collection.replace_one(
+            {"_id": record["_id"]},
+            {**record, "quarantined_at": datetime.utcnow(), "reason": "content missing"},
+            upsert=True
+        )
+        result = await version_collection.delete_one({"_id": record["_id"]})
+        if result.deleted_count and record.get("document_id") is not None:
+            # Downloads of the latest version would otherwise still be
+            # served from the pointer to the version just removed
+            await repoint_latest(record["document_id"], record["version_number"])
+        if result.deleted_count and blob is not None:
+            await release_blob(blob["_id"])
+        self.report.quarantined += result.deleted_count
+
+    async def _check_pack(self, files: list[ListedObject]) -> None:
+        pack = next((listed for listed in files if listed.name.endswith(".pack")), None)
+        live = []
+        if pack is not None:
+            live = await blob_collection.aggregate([
+                {"$match": {"pack.path": pack.pointer}},
+                {"$group": {"_id": None, "bytes": {"$sum": "$pack.length"}, "blobs": {"$sum": 1}}}
+            ]).to_list(None)
+
+        if live and live[0]["blobs"]:
+            dead_bytes = pack.size - len(PACK_MAGIC) - live[0]["bytes"]
+            if dead_bytes > 0:
+                self.report.dead_pack_bytes += dead_bytes
+                self._found("dead_pack_bytes", path=pack.pointer, size=pack.size, dead_bytes=dead_bytes,
+                            live_blobs=live[0]["blobs"])
+            return
+
+        # No blob uses the pack (or an index lost its pack)
+        if not all(self._is_settled_file(listed) for listed in files):
+            return
+        self.report.orphan_packs += 1
+        locations = [await self._quarantine_file(listed.pointer) for listed in files]
+        self._found("orphan_pack", paths=[listed.pointer for listed in files],
+                    size=sum(listed.size for listed in files), quarantined_to=locations)
+
+    async def check_unlisted(self) -> None:
+        async for kind, listed in storage.iter_unlisted():
+            if kind == "staging":
+                if self._is_settled_file(listed):
+                    self.report.stale_staging += 1
+                    location = await self._quarantine_file(listed.pointer)
+                    self._found("stale_staging", path=listed.pointer, size=listed.size, quarantined_to=location)
+            else:
+                self.report.unmigrated += 1
+                self._found("unmigrated", path=listed.pointer, size=listed.size)
+
+    async def check_unhashed_versions(self, batch_size: int) -> None:
+        # Versions from before the blob store have no digest to join on
+        cursor = version_collection.find({"sha256": None}, _VERSION_PROJECTION).batch_size(batch_size)
+        async for version in cursor:
+            if not await storage.exists(version["file_path"]):
+                await self._dangling_version(version)
+
+
+async def _save_checkpoint(after: Optional[str], label: str, report: ReconcileReport) -> None:
+    update = {"after": after, "label": label, "updated_at": datetime.utcnow(), "last_report": asdict(report)}
+    if after is None:
+        update["completed_at"] = update["updated_at"]
+    await reconcile_state_collection.update_one({"_id": STATE_ID}, {"$set": update}, upsert=True)
+
+
+async def reconcile(
+    quarantine: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_digests: Optional[int] = None,
+    min_age_seconds: float = DEFAULT_MIN_AGE_SECONDS,
+    pause_seconds: float = 0.0,
+    restart: bool = False,
+    on_finding: Optional[Finding] = None
+) -> ReconcileReport:
+    state = None if restart else await reconcile_state_collection.find_one({"_id": STATE_ID})
+    after = state.get("after") if state else None
+    # Everything quarantined during one pass over the store is kept together
+    label = state["label"] if after else datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+
+    report = ReconcileReport()
+    reconciler = _Reconciler(report, quarantine, label, min_age_seconds, on_finding)
+    if after is None:
+        await reconciler.check_unlisted()
+        await reconciler.check_unhashed_versions(batch_size)
+
+    streams = [
+        _SortedStream(storage.iter_objects(after), lambda listed: _digest_of(listed.name)),
+        _SortedStream(_sorted_rows(blob_collection, "_id", after, _BLOB_PROJECTION, batch_size),
+                      lambda blob: blob["_id"]),
+        _SortedStream(_sorted_rows(version_collection, "sha256", after, _VERSION_PROJECTION, batch_size),
+                      lambda version: version["sha256"]),
+        _SortedStream(_sorted_rows(blob_collection, "base", after, {"base": 1}, batch_size),
+                      lambda delta: delta["base"]),
+    ]
+    while True:
+        heads = [key for key in [await stream.peek() for stream in streams] if key is not None]
+        if not heads:
+            break
+        digest = min(heads)
+        files, blobs, versions, deltas = [await stream.take(digest) for stream in streams]
+        await reconciler.check_digest(digest, files, blobs[0] if blobs else None, versions, deltas)
+
+        if report.digests % batch_size == 0 or report.digests == max_digests:
+            await _save_checkpoint(digest, label, report)
+            if report.digests == max_digests:
+                report.resume_after = digest
+                return report
+            if pause_seconds:
+                await asyncio.sleep(pause_seconds)
+
+    await _save_checkpoint(None, label, report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find orphaned files and records with missing content.")
+    parser.add_argument("--quarantine", action="store_true",
+                        help="Move orphans and dangling records aside instead of only reporting them")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-digests", type=int, default=None,
+                        help="Stop after this many digests; the next run continues from there")
+    parser.add_argument("--min-age", type=float, default=DEFAULT_MIN_AGE_SECONDS,
+                        help="Seconds a file or record must have existed before it is considered")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Seconds to sleep between batches, to limit load on a live system")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    def on_finding(kind: str, details: dict):
+        print(json.dumps({"finding": kind, **details}, default=str), flush=True)
+
+    report = asyncio.run(reconcile(
+        args.quarantine, args.batch_size, args.max_digests, args.min_age, args.pause, args.restart, on_finding
+    ))
+    print(("Checked: " if report.resume_after is None else "Checked (partial): ") + str(asdict(report)))
+
+
+if __name__ == "__main__":
+    main()
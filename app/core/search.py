@@ -0,0 +1,313 @@
+# app/core/search.py
+"""
+Full-text search over the latest version of every document.
+
+The index is an inverted index kept in MongoDB: one posting per
+(term, document) in `search_postings`, holding the term frequency and the
+indexed version, plus one row per document in `search_index_state` recording
+which version is indexed and its length in tokens. It is updated
+incrementally whenever a version is recorded, and can be rebuilt offline
+from the stored files with:
+
+    python -m app.core.search --rebuild
+"""
+
+import argparse
+import asyncio
+import codecs
+import math
+import re
+from collections import Counter
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.core.blobs import open_blob
+from app.core.jobs import job_queue
+from app.db.database import (
+    document_collection,
+    version_collection,
+    search_posting_collection,
+    search_state_collection,
+)
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have he her his i in is it its
+    of on or our she that the their them they this to was were will with you
+    your we not no
+""".split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+REBUILD_BATCH_SIZE = 500
+
+
+def sniff_text_encoding(head: bytes) -> tuple[str, int]:
+    """
+    The encoding of text starting with `head`, and the length of its byte
+    order mark.
+
+    A byte order mark decides between UTF-8 and UTF-16 LE/BE. Without one
+    the bytes are taken as UTF-8, or as BOM-less UTF-16 when every other
+    byte is NUL, as it is for mostly-ASCII text.
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8", len(codecs.BOM_UTF8)
+    if head.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le", len(codecs.BOM_UTF16_LE)
+    if head.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be", len(codecs.BOM_UTF16_BE)
+    return _guess_bomless_encoding(head), 0
+
+
+def decode_text(data: bytes) -> Optional[str]:
+    """
+    Decodes document bytes as text (see sniff_text_encoding), or returns
+    None for binary content.
+    """
+    encoding, bom_length = sniff_text_encoding(data)
+    try:
+        text = data[bom_length:].decode(encoding)
+    except UnicodeDecodeError:
+        return None
+    # NUL survives UTF-8 decoding of binary formats; real text has none
+    if "\x00" in text:
+        return None
+    return text
+
+
+def _guess_bomless_encoding(data: bytes) -> str:
+    sample = data[:4096]
+    if len(sample) >= 2:
+        even_nuls = sample[0::2].count(0)
+        odd_nuls = sample[1::2].count(0)
+        half = len(sample) // 2
+        if odd_nuls > half * 0.9:
+            return "utf-16-le"
+        if even_nuls > half * 0.9:
+            return "utf-16-be"
+    return "utf-8"
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH and token not in STOP_WORDS
+    ]
+
+
+async def _read_version_text(version: dict) -> Optional[str]:
+    opened = await open_blob(version)
+    if opened is None:
+        return None
+    size, read_range = opened
+    if size > settings.search_max_index_bytes:
+        return None
+    chunks = [chunk async for chunk in read_range(0, size)]
+    return await job_queue.run_cpu_bound(decode_text, b"".join(chunks))
+
+
+async def _claim_document(document_id: ObjectId, version_number: int, length: int) -> bool:
+    """
+    Records `version_number` as the indexed version of a document, unless
+    a newer one is already indexed. Returns False if this version is stale.
+    Claiming the same version again succeeds, so a job that failed after
+    its claim can be retried.
+    """
+    try:
+        await search_state_collection.find_one_and_update(
+            {"_id": document_id, "version_number": {"$lte": version_number}},
+            {"$set": {"version_number": version_number, "length": length}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The upsert collided with a row for a newer version
+        return False
+    return True
+
+
+async def index_version(version: dict, employee_id: ObjectId) -> bool:
+    """
+    Replaces a document's postings with those of one of its versions.
+
+    Versions older than the one already indexed are ignored, and an older
+    version's postings are removed again if a newer one was claimed while
+    they were written, so concurrent check-ins settle on the newest. Binary and oversized files are indexed
+    as empty, which drops the postings of the version they replace.
+    Returns True if the index was updated.
+    """
+    document_id = version["document_id"]
+    text = await _read_version_text(version)
+    counts = Counter(await job_queue.run_cpu_bound(tokenize, text)) if text else Counter()
+
+    if not await _claim_document(document_id, version["version_number"], sum(counts.values())):
+        return False
+
+    # Postings of this version are dropped too, in case an earlier attempt
+    # inserted some of them before failing
+    await search_posting_collection.delete_many(
+        {"document_id": document_id, "version_number": {"$lte": version["version_number"]}}
+    )
+    if counts:
+        await search_posting_collection.insert_many([
+            {
+                "term": term,
+                "document_id": document_id,
+                "employee_id": employee_id,
+                "version_number": version["version_number"],
+                "tf": tf,
+            }
+            for term, tf in counts.items()
+        ], ordered=False)
+
+        # A newer version claimed after our delete has already dropped the
+        # older postings, possibly before these were inserted; drop them
+        # here then, so they never count towards document frequencies
+        state = await search_state_collection.find_one({"_id": document_id}, {"version_number": 1})
+        if state is None or state["version_number"] != version["version_number"]:
+            await search_posting_collection.delete_many(
+                {"document_id": document_id, "version_number": version["version_number"]}
+            )
+            return False
+    return True
+
+
+async def search_documents(query: str, employee_id: Optional[ObjectId] = None, limit: int = 20) -> list[dict]:
+    """
+    Ranks documents against a free-text query with BM25 and returns up to
+    `limit` hits as {"document_id", "version_number", "score", "matched_terms"},
+    best first. `employee_id` restricts the search to one employee's files.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+
+    # Document frequencies are taken over the whole index so scores do not
+    # depend on who is searching
+    document_frequency = {
+        row["_id"]: row["df"]
+        async for row in search_posting_collection.aggregate([
+            {"$match": {"term": {"$in": terms}}},
+            {"$group": {"_id": "$term", "df": {"$sum": 1}}},
+        ])
+    }
+    if not document_frequency:
+        return []
+    total_documents = max(await search_state_collection.estimated_document_count(), 1)
+
+    # Each term reads its share of SEARCH_MAX_POSTINGS, highest tf first, so
+    # a common term is cut where it contributes least to the scores
+    per_term = max(settings.search_max_postings // len(terms), 1)
+
+    async def term_postings(term: str) -> list[dict]:
+        posting_query = {"term": term}
+        if employee_id is not None:
+            posting_query["employee_id"] = employee_id
+        return await search_posting_collection.find(
+            posting_query,
+            {"_id": 0, "term": 1, "document_id": 1, "version_number": 1, "tf": 1}
+        ).sort("tf", DESCENDING).limit(per_term).to_list(None)
+
+    postings: dict[ObjectId, dict] = {}
+    for term_rows in await asyncio.gather(*(term_postings(term) for term in terms)):
+        for posting in term_rows:
+            postings.setdefault(posting["document_id"], {})[posting["term"]] = posting
+
+    if not postings:
+        return []
+
+    # Postings of a version that lost a race with a newer one may linger
+    # briefly; only those matching the recorded version count
+    states = {
+        state["_id"]: state
+        async for state in search_state_collection.find({"_id": {"$in": list(postings)}})
+    }
+    lengths = [state["length"] for state in states.values()]
+    average_length = sum(lengths) / len(lengths) if lengths else 1.0
+
+    hits = []
+    for document_id, by_term in postings.items():
+        state = states.get(document_id)
+        if state is None:
+            continue
+        score = 0.0
+        matched = []
+        for term, posting in by_term.items():
+            if posting["version_number"] != state["version_number"]:
+                continue
+            df = document_frequency.get(term, 1)
+            idf = math.log(1 + (total_documents - df + 0.5) / (df + 0.5))
+            tf = posting["tf"]
+            norm = K1 * (1 - B + B * state["length"] / max(average_length, 1.0))
+            score += idf * tf * (K1 + 1) / (tf + norm)
+            matched.append(term)
+        if matched:
+            hits.append({
+                "document_id": document_id,
+                "version_number": state["version_number"],
+                "score": round(score, 6),
+                "matched_terms": sorted(matched),
+            })
+
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    return hits[:limit]
+
+
+async def rebuild_index() -> int:
+    """
+    Drops the search index and re-indexes the latest version of every
+    document from storage. Returns the number of documents indexed.
+    """
+    await search_posting_collection.delete_many({})
+    await search_state_collection.delete_many({})
+
+    indexed = 0
+    batch = []
+
+    async def flush():
+        nonlocal indexed
+        employees = {doc["_id"]: doc["employee_id"] for doc in batch}
+        async for version in version_collection.find({"$or": [
+            {"document_id": doc["_id"], "version_number": doc["latest_version"]}
+            for doc in batch
+        ]}):
+            await index_version(version, employees[version["document_id"]])
+            indexed += 1
+
+    async for doc in document_collection.find(
+        {"latest_version": {"$gt": 0}},
+        {"employee_id": 1, "latest_version": 1}
+    ).batch_size(REBUILD_BATCH_SIZE):
+        batch.append(doc)
+        if len(batch) == REBUILD_BATCH_SIZE:
+            await flush()
+            batch = []
+    if batch:
+        await flush()
+    return indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the full-text search index.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Re-index the latest version of every document from storage")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    indexed = asyncio.run(rebuild_index())
+    print(f"Indexed {indexed} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# app/core/storage.py
+
+import hashlib
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional
+
+from bson import ObjectId
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.core.metrics import upload_bytes, upload_duration
+from app.core.ranges import RangeReader, file_range_reader
+
+# Size of each read from the incoming upload. Peak memory per upload is
+# bounded by this value instead of by the size of the file.
+CHUNK_SIZE = 1024 * 1024
+
+# Directory entries or object records fetched per round trip when listing
+LISTING_BATCH_SIZE = 1000
+
+
+@dataclass
+class ListedObject:
+    """
+    A file found by walking a store.
+    """
+    name: str
+    pointer: str
+    size: int
+    modified_at: float
+
+
+@dataclass
+class StoredFile:
+    """
+    Result of streaming an upload to disk.
+    """
+    path: str
+    size: int
+    sha256: str
+
+
+def _write_chunk(buffer, digest, chunk: bytes) -> None:
+    # hashlib releases the GIL for large buffers, so hashing and writing
+    # together in the worker thread keeps both off the event loop.
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def stream_upload_to_disk(
+    file: UploadFile,
+    destination: str,
+    chunk_size: int = CHUNK_SIZE
+) -> StoredFile:
+    """
+    Copies an UploadFile to `destination` in fixed-size chunks.
+
+    Blocking file I/O runs in the threadpool, and the SHA-256 digest and byte
+    count are computed while copying, so the file is never held in memory.
+    A partially written file is removed if the copy fails.
+    """
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    size = 0
+
+    buffer = await run_in_threadpool(open, destination, "wb")
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(_remove_quietly, destination)
+        raise
+
+    await run_in_threadpool(buffer.close)
+    upload_bytes.inc(size)
+    upload_duration.observe(time.perf_counter() - started)
+    return StoredFile(path=destination, size=size, sha256=digest.hexdigest())
+
+
+def _listed(entry: os.DirEntry) -> ListedObject:
+    stat = entry.stat()
+    return ListedObject(entry.name, entry.path, stat.st_size, stat.st_mtime)
+
+
+def _listed_files(directory: str) -> Iterator[ListedObject]:
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield _listed(entry)
+
+
+def _take(iterator: Iterator, count: int) -> list:
+    return list(islice(iterator, count))
+
+
+async def iterate_in_batches(iterator: Iterator, batch_size: int = LISTING_BATCH_SIZE) -> AsyncIterator:
+    """Drains a blocking iterator in the threadpool, one batch per hop."""
+    while batch := await run_in_threadpool(_take, iterator, batch_size):
+        for item in batch:
+            yield item
+
+
+async def _copy_to_file(read_range: RangeReader, size: int, destination: str) -> None:
+    sink = await run_in_threadpool(open, destination, "wb")
+    try:
+        async for chunk in read_range(0, size):
+            await run_in_threadpool(sink.write, chunk)
+    finally:
+        await run_in_threadpool(sink.close)
+
+
+class StorageBackend:
+    """
+    Where stored objects live. Objects are named (a blob digest, plus a
+    suffix for encoded forms) and addressed by the pointer `put` returns,
+    which is what blob and version records keep. Uploads and encoders work
+    on local files in `staging_path()` and hand them over with `put`.
+    """
+
+    def pointer(self, name: str) -> str:
+        """The pointer an object called `name` is stored under."""
+        raise NotImplementedError
+
+    def staging_path(self, suffix: str = ".part") -> str:
+        """A fresh local path for a file that will be handed to `put`."""
+        raise NotImplementedError
+
+    async def put(self, local_path: str, name: str) -> str:
+        """Moves a staged local file into the store, replacing any object of that name."""
+        raise NotImplementedError
+
+    async def adopt(self, local_path: str, name: str) -> str:
+        """Like `put`, but leaves the source file in place."""
+        raise NotImplementedError
+
+    async def exists(self, pointer: str) -> bool:
+        raise NotImplementedError
+
+    async def size(self, pointer: str) -> int:
+        raise NotImplementedError
+
+    async def cached_path(self, pointer: str) -> Optional[str]:
+        """
+        A local file with the object's contents if one can be had within the
+        limits of the local cache, else None; the object is then read with
+        `range_reader` or copied with `local_file`.
+        """
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def local_file(self, pointer: str) -> AsyncIterator[str]:
+        """
+        A local file with the object's contents, for readers that need one.
+        An object too large for the cache is copied to a staging file that
+        is removed on exit.
+        """
+        path = await self.cached_path(pointer)
+        if path is not None:
+            yield path
+            return
+        staged_path = self.staging_path()
+        try:
+            await _copy_to_file(self.range_reader(pointer), await self.size(pointer), staged_path)
+            yield staged_path
+        finally:
+            await run_in_threadpool(_remove_quietly, staged_path)
+
+    def range_reader(self, pointer: str) -> RangeReader:
+        raise NotImplementedError
+
+    async def remove(self, pointer: str) -> None:
+        """Deletes an object; missing objects are ignored."""
+        raise NotImplementedError
+
+    def iter_objects(self, after: Optional[str] = None) -> AsyncIterator[ListedObject]:
+        """
+        Yields the stored objects in name order, starting after objects
+        named `after` or below. Memory use does not grow with the size of
+        the store.
+        """
+        raise NotImplementedError
+
+    def iter_unlisted(self) -> AsyncIterator[tuple[str, ListedObject]]:
+        """
+        Yields ("staging", file) for files left in the staging area and
+        ("foreign", file) for files the store holds outside its layout.
+        """
+        raise NotImplementedError
+
+    async def quarantine(self, pointer: str, label: str) -> Optional[str]:
+        """
+        Moves an object or unlisted file out of the store into a quarantine
+        area under `label`, from where it can be moved back by hand.
+        Returns its new location, or None if it was already gone.
+        """
+        raise NotImplementedError
+
+    async def restore(self, location: str, pointer: str) -> None:
+        """Moves a quarantined file back, unless the object exists again."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Objects on the local filesystem under `root`, fanned out by name prefix:
+    with two levels, blob "ab12cd..." lives at blobs/ab/12/ab12cd... .
+    Directories stay at a few thousand entries each however many versions
+    are stored, instead of one directory holding every file.
+
+    Pointers are plain paths, so files written before the fan-out layout
+    (flat under uploads/ or uploads/blobs/) are still readable until they
+    are moved by app.core.storage_migration.
+    """
+
+    def __init__(self, root: str, fanout_levels: int = 2):
+        self.root = root
+        self.fanout_levels = fanout_levels
+        self.blob_directory = os.path.join(root, "blobs")
+        # Same filesystem as the blobs, so handing a file over is a rename
+        self.staging_directory = os.path.join(root, "tmp")
+        self.quarantine_directory = os.path.join(root, "quarantine")
+        os.makedirs(self.blob_directory, exist_ok=True)
+        os.makedirs(self.staging_directory, exist_ok=True)
+
+    def pointer(self, name: str) -> str:
+        prefixes = [name[2 * level:2 * level + 2] for level in range(self.fanout_levels)]
+        return os.path.join(self.blob_directory, *prefixes, name)
+
+    def staging_path(self, suffix: str = ".part") -> str:
+        return os.path.join(self.staging_directory, f"{ObjectId()}{suffix}")
+
+    @staticmethod
+    def _move(source: str, destination: str) -> None:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+
+    @staticmethod
+    def _copy(source: str, destination: str) -> None:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temporary = f"{destination}.{ObjectId()}.part"
+        try:
+            # A hard link costs no space or I/O when both are on one filesystem
+            os.link(source, temporary)
+        except OSError:
+            shutil.copyfile(source, temporary)
+        os.replace(temporary, destination)
+
+    async def put(self, local_path: str, name: str) -> str:
+        destination = self.pointer(name)
+        await run_in_threadpool(self._move, local_path, destination)
+        return destination
+
+    async def adopt(self, local_path: str, name: str) -> str:
+        destination = self.pointer(name)
+        if os.path.abspath(local_path) != os.path.abspath(destination):
+            await run_in_threadpool(self._copy, local_path, destination)
+        return destination
+
+    async def exists(self, pointer: str) -> bool:
+        return await run_in_threadpool(os.path.exists, pointer)
+
+    async def size(self, pointer: str) -> int:
+        return await run_in_threadpool(os.path.getsize, pointer)
+
+    async def cached_path(self, pointer: str) -> Optional[str]:
+        return pointer
+
+    def range_reader(self, pointer: str) -> RangeReader:
+        return file_range_reader(pointer)
+
+    async def remove(self, pointer: str) -> None:
+        await run_in_threadpool(_remove_quietly, pointer)
+
+    @staticmethod
+    def _is_prefix_directory(entry: os.DirEntry) -> bool:
+        return len(entry.name) == 2 and entry.is_dir(follow_symlinks=False)
+
+    def _walk_layout(self, directory: str, level: int, after: Optional[str]) -> Iterator[ListedObject]:
+        # Prefix directories are visited in order, so names come out sorted
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        if level < self.fanout_levels:
+            floor = after[2 * level:2 * level + 2] if after else ""
+            for entry in entries:
+                if self._is_prefix_directory(entry) and entry.name >= floor:
+                    # Only the directory holding `after` needs filtering below
+                    inner_after = after if entry.name == floor else None
+                    yield from self._walk_layout(entry.path, level + 1, inner_after)
+            return
+
+        prefix = os.path.relpath(directory, self.blob_directory).replace(os.sep, "")
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False) or not entry.name.startswith(prefix):
+                continue
+            if after is not None and entry.name.split(".", 1)[0] <= after:
+                continue
+            yield _listed(entry)
+
+    async def iter_objects(self, after: Optional[str] = None) -> AsyncIterator[ListedObject]:
+        async for listed in iterate_in_batches(self._walk_layout(self.blob_directory, 0, after)):
+            yield listed
+
+    def _walk_foreign(self, directory: str, level: int) -> Iterator[ListedObject]:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if level < self.fanout_levels and self._is_prefix_directory(entry):
+                    yield from self._walk_foreign(entry.path, level + 1)
+                else:
+                    # Not part of the layout at all
+                    for parent, _, names in os.walk(entry.path):
+                        for name in names:
+                            path = os.path.join(parent, name)
+                            stat = os.stat(path)
+                            yield ListedObject(name, path, stat.st_size, stat.st_mtime)
+            elif entry.is_file(follow_symlinks=False):
+                prefix = os.path.relpath(directory, self.blob_directory).replace(os.sep, "")
+                if level < self.fanout_levels or not entry.name.startswith(prefix):
+                    yield _listed(entry)
+
+    def _walk_unlisted(self) -> Iterator[tuple[str, ListedObject]]:
+        for listed in _listed_files(self.staging_directory):
+            yield "staging", listed
+        # Files flat under the root predate the blob store
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    yield "foreign", _listed(entry)
+        for listed in self._walk_foreign(self.blob_directory, 0):
+            yield "foreign", listed
+
+    async def iter_unlisted(self) -> AsyncIterator[tuple[str, ListedObject]]:
+        async for item in iterate_in_batches(self._walk_unlisted()):
+            yield item
+
+    def _quarantine_path(self, pointer: str, label: str) -> str:
+        return os.path.join(self.quarantine_directory, label, os.path.relpath(pointer, self.root))
+
+    async def quarantine(self, pointer: str, label: str) -> Optional[str]:
+        location = self._quarantine_path(pointer, label)
+        try:
+            await run_in_threadpool(self._move, pointer, location)
+        except FileNotFoundError:
+            return None
+        return location
+
+    async def restore(self, location: str, pointer: str) -> None:
+        if not await self.exists(pointer):
+            await run_in_threadpool(self._move, location, pointer)
+
+
+def create_storage(backend: Optional[str] = None) -> StorageBackend:
+    backend = backend or settings.storage_backend
+    if backend == "local":
+        return LocalStorage(settings.storage_root, settings.storage_fanout_levels)
+    if backend == "gridfs":
+        # Imported here, since it builds on this module
+        from app.core.gridfs_storage import GridFSStorage
+        return GridFSStorage(
+            settings.storage_root,
+            settings.gridfs_bucket,
+            settings.gridfs_chunk_size_bytes,
+            settings.storage_cache_max_bytes,
+            settings.storage_cache_max_object_bytes
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+storage = create_storage()
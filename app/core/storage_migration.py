@@ -0,0 +1,204 @@
+# app/core/storage_migration.py
+"""
+Moves stored files into the layout of the configured storage backend while
+the API keeps serving.
+
+Runs in three passes, each in batches of --batch-size records:
+
+1. blobs: every blob whose file is not at its layout location is copied
+   there (a hard link where possible), then its record is repointed with a
+   conditional update on the old path, so a blob re-encoded or released in
+   the meantime is left alone.
+2. document_versions: file_path is rewritten to the layout location of the
+   version's blob. Versions from before the blob store (one flat file each,
+   with no blob record) are hashed and adopted into the blob store first.
+3. documents: the latest-version pointer on each master is rewritten the
+   same way.
+
+Old files are not deleted here: a remove_raw_file job per moved file deletes
+it once RAW_BLOB_GRACE_SECONDS have passed, so downloads that resolved the
+old path just before the switch still complete. The jobs run in the API
+processes. Every pass skips records that are already in place, so the
+command can be stopped and run again at any time.
+
+Usage:
+    python -m app.core.storage_migration [--batch-size 500] [--pause 0] [--dry-run]
+"""
+
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.core.blobs import REMOVE_RAW_FILE, adopt_file, blob_name, release_blob
+from app.core.jobs import job, job_queue
+from app.core.storage import storage
+from app.db.database import blob_collection, document_collection, version_collection
+
+DEFAULT_BATCH_SIZE = 500
+
+
+@dataclass
+class MigrationReport:
+    blobs_moved: int = 0
+    versions_repointed: int = 0
+    versions_adopted: int = 0
+    documents_repointed: int = 0
+    # Files that were already gone, and moves that lost a race with an
+    # encode or release (their copies are left to the reconciliation tool)
+    missing: int = 0
+    conflicts: int = 0
+
+
+def _removal_job(sha256: str, path: str) -> dict:
+    return job(
+        REMOVE_RAW_FILE,
+        f"{sha256}:{ObjectId()}",
+        {"sha256": sha256, "path": path},
+        delay_seconds=settings.raw_blob_grace_seconds
+    )
+
+
+async def _batches(collection, query: dict, projection: dict, batch_size: int):
+    """Yields `query` results in _id order, one batch per round trip."""
+    last_id = None
+    while True:
+        page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        batch = await collection.find(page_query, projection).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["_id"]
+
+
+async def _migrate_blob(blob: dict, report: MigrationReport, removals: list, dry_run: bool) -> None:
+    name = blob_name(blob["_id"], blob.get("encoding", "raw"))
+    if blob["path"] == storage.pointer(name):
+        return
+    if not await storage.exists(blob["path"]):
+        report.missing += 1
+        return
+    if dry_run:
+        report.blobs_moved += 1
+        return
+
+    async with storage.local_file(blob["path"]) as path:
+        moved = await storage.adopt(path, name)
+    result = await blob_collection.update_one({"_id": blob["_id"], "path": blob["path"]}, {"$set": {"path": moved}})
+    if result.modified_count == 0:
+        report.conflicts += 1
+        return
+    report.blobs_moved += 1
+    removals.append(_removal_job(blob["_id"], blob["path"]))
+
+
+async def _adopt_version(version: dict, report: MigrationReport, removals: list, dry_run: bool) -> None:
+    if not await storage.exists(version["file_path"]):
+        report.missing += 1
+        return
+    if dry_run:
+        report.versions_adopted += 1
+        return
+
+    async with storage.local_file(version["file_path"]) as path:
+        stored = await adopt_file(path)
+    result = await version_collection.update_one(
+        {"_id": version["_id"], "file_path": version["file_path"]},
+        {"$set": {"file_path": stored.path, "size": stored.size, "sha256": stored.sha256}}
+    )
+    if result.modified_count == 0:
+        # Adopted by a concurrent run
+        await release_blob(stored.sha256)
+        report.conflicts += 1
+        return
+    report.versions_adopted += 1
+    removals.append(_removal_job(stored.sha256, version["file_path"]))
+
+
+async def migrate_storage(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pause_seconds: float = 0.0,
+    dry_run: bool = False,
+    progress: Optional[Callable[[str, MigrationReport], None]] = None
+) -> MigrationReport:
+    report = MigrationReport()
+
+    async def finish_batch(removals: list, pass_name: str):
+        if removals:
+            await job_queue.enqueue(*removals)
+        if progress:
+            progress(pass_name, report)
+        if pause_seconds:
+            await asyncio.sleep(pause_seconds)
+
+    # Packed blobs are read from their pack, which is already in the layout
+    async for batch in _batches(blob_collection, {"pack": None}, {"path": 1, "encoding": 1}, batch_size):
+        removals = []
+        for blob in batch:
+            await _migrate_blob(blob, report, removals, dry_run)
+        await finish_batch(removals, "blobs")
+
+    async for batch in _batches(version_collection, {}, {"file_path": 1, "sha256": 1}, batch_size):
+        removals = []
+        updates = []
+        digests = [version["sha256"] for version in batch if version.get("sha256")]
+        known = {blob["_id"] async for blob in blob_collection.find({"_id": {"$in": digests}}, {"_id": 1})}
+        for version in batch:
+            if version.get("sha256") not in known:
+                await _adopt_version(version, report, removals, dry_run)
+                continue
+            target = storage.pointer(blob_name(version["sha256"]))
+            if version["file_path"] != target:
+                updates.append(UpdateOne(
+                    {"_id": version["_id"], "file_path": version["file_path"]},
+                    {"$set": {"file_path": target}}
+                ))
+        if updates and not dry_run:
+            result = await version_collection.bulk_write(updates, ordered=False)
+            report.versions_repointed += result.modified_count
+        elif dry_run:
+            report.versions_repointed += len(updates)
+        await finish_batch(removals, "versions")
+
+    async for batch in _batches(
+        document_collection, {"latest.sha256": {"$ne": None}}, {"latest.file_path": 1, "latest.sha256": 1}, batch_size
+    ):
+        updates = []
+        for doc in batch:
+            target = storage.pointer(blob_name(doc["latest"]["sha256"]))
+            if doc["latest"]["file_path"] != target:
+                updates.append(UpdateOne(
+                    {"_id": doc["_id"], "latest.sha256": doc["latest"]["sha256"]},
+                    {"$set": {"latest.file_path": target}}
+                ))
+        if updates and not dry_run:
+            result = await document_collection.bulk_write(updates, ordered=False)
+            report.documents_repointed += result.modified_count
+        elif dry_run:
+            report.documents_repointed += len(updates)
+        await finish_batch([], "documents")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move stored files into the configured storage layout.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Seconds to sleep between batches, to limit load on a live system")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be moved")
+    args = parser.parse_args()
+
+    def progress(pass_name: str, report: MigrationReport):
+        print(f"[{pass_name}] {asdict(report)}", flush=True)
+
+    report = asyncio.run(migrate_storage(args.batch_size, args.pause, args.dry_run, progress))
+    print(("Would migrate: " if args.dry_run else "Migrated: ") + str(asdict(report)))
+
+
+if __name__ == "__main__":
+    main()
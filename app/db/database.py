@@ -1,14 +1,184 @@
 # app/db/database.py
+"""
+The MongoDB client and the collections the app uses.
+
+The client is created and warmed by `mongo.connect()`, which the FastAPI
+lifespan awaits in every worker process before it serves requests, so each
+worker builds its own pool on its own event loop and the first requests do
+not pay for connection setup. Scripts that never call it get a client on
+first use. Pool size, wait-queue timeout and wire compression come from the
+MONGO_* settings.
+
+Collections are module-level handles that resolve to the current client, so
+modules can import them before the client exists. Reads that tolerate
+bounded staleness go through `collection.reads(purpose)`, which applies the
+read preference configured for that purpose (see READ_PURPOSES).
+"""
+
+import asyncio
+from typing import Optional
 
 import motor.motor_asyncio
+from pymongo.read_preferences import (
+    Nearest,
+    PrimaryPreferred,
+    ReadPreference,
+    Secondary,
+    SecondaryPreferred
+)
 
 # Import the central settings object
 from app.config import settings
+from app.core.metrics import mongo_command_metrics
+
+_SECONDARY_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+# Read purposes and the setting holding each one's read preference mode
+READ_PURPOSES = {
+    # Paginated document and version listings
+    "listing": "mongo_listing_read_preference",
+    # Master and version lookups that precede a download
+    "download": "mongo_download_read_preference",
+}
+
+
+def read_preference(mode: str):
+    """
+    The read preference for a mode name. Modes other than primary only use
+    secondaries lagging at most MONGO_MAX_STALENESS_SECONDS behind.
+    """
+    if mode == "primary":
+        return ReadPreference.PRIMARY
+    if mode not in _SECONDARY_MODES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    return _SECONDARY_MODES[mode](max_staleness=settings.mongo_max_staleness_seconds)
+
+
+class MongoConnection:
+    """
+    Owns the process's Motor client. `generation` changes whenever the
+    client is replaced, so collection handles know to resolve again.
+    """
+
+    def __init__(self):
+        self._client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+        self.generation = 0
+
+    def _create(self) -> motor.motor_asyncio.AsyncIOMotorClient:
+        options = {
+            "maxPoolSize": settings.mongo_max_pool_size,
+            "minPoolSize": settings.mongo_min_pool_size,
+            # Every command is timed for /metrics
+            "event_listeners": [mongo_command_metrics],
+        }
+        if settings.mongo_wait_queue_timeout_seconds > 0:
+            options["waitQueueTimeoutMS"] = int(settings.mongo_wait_queue_timeout_seconds * 1000)
+        if settings.mongo_compressors:
+            options["compressors"] = settings.mongo_compressors
+        return motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb_uri, **options)
+
+    @property
+    def client(self) -> motor.motor_asyncio.AsyncIOMotorClient:
+        if self._client is None:
+            self._client = self._create()
+            self.generation += 1
+        return self._client
+
+    @property
+    def database(self) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+        return self.client[settings.database_name]
+
+    async def connect(self) -> None:
+        """
+        Creates the client and opens MONGO_MIN_POOL_SIZE connections (at
+        least one) with concurrent pings, so a bad URI or an unreachable
+        replica set fails startup instead of the first request.
+        """
+        client = self.client
+        await asyncio.gather(*[
+            client.admin.command("ping") for _ in range(max(settings.mongo_min_pool_size, 1))
+        ])
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self.generation += 1
+
+
+mongo = MongoConnection()
+
+
+class LazyCollection:
+    """
+    A collection of the current client. Attribute access is forwarded to the
+    Motor collection, so it is used exactly like one.
+    """
+
+    def __init__(self, name: str, purpose: Optional[str] = None):
+        self.name = name
+        self.purpose = purpose
+        self._collection = None
+        self._generation = None
+        self._routed: dict[str, LazyCollection] = {}
+
+    def _resolve(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        if self._generation != mongo.generation or self._collection is None:
+            preference = None
+            if self.purpose is not None:
+                preference = read_preference(getattr(settings, READ_PURPOSES[self.purpose]))
+            self._collection = mongo.database.get_collection(self.name, read_preference=preference)
+            self._generation = mongo.generation
+        return self._collection
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._resolve(), attribute)
+
+    def reads(self, purpose: str) -> "LazyCollection":
+        """This collection, reading with the preference configured for `purpose`."""
+        if getattr(settings, READ_PURPOSES[purpose]) == "primary":
+            return self
+        if purpose not in self._routed:
+            self._routed[purpose] = LazyCollection(self.name, purpose)
+        return self._routed[purpose]
+
+
+class LazyDatabase:
+    """The app's database on the current client."""
+
+    def __getattr__(self, attribute: str):
+        return getattr(mongo.database, attribute)
+
+    def __getitem__(self, name: str):
+        return mongo.database[name]
+
+
+async def find_one_routed(collection: LazyCollection, purpose: str, *args, **kwargs) -> Optional[dict]:
+    """
+    find_one with the read preference of `purpose`. A miss on a secondary is
+    retried on the primary, since the record may be too new to have been
+    replicated yet.
+    """
+    routed = collection.reads(purpose)
+    found = await routed.find_one(*args, **kwargs)
+    if found is None and routed is not collection:
+        found = await collection.find_one(*args, **kwargs)
+    return found
+
 
-# Use the URI and database name from the settings object
-client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb_uri)
-database = client[settings.database_name]
+database = LazyDatabase()
 
-user_collection = database.get_collection("users")
-document_collection = database.get_collection("documents")
-version_collection = database.get_collection("document_versions")
\ No newline at end of file
+user_collection = LazyCollection("users")
+document_collection = LazyCollection("documents")
+version_collection = LazyCollection("document_versions")
+blob_collection = LazyCollection("blobs")
+search_posting_collection = LazyCollection("search_postings")
+search_state_collection = LazyCollection("search_index_state")
+job_collection = LazyCollection("jobs")
+reconcile_state_collection = LazyCollection("reconcile_state")
+quarantined_version_collection = LazyCollection("quarantined_versions")
@@ -0,0 +1,330 @@
+# app/db/indexes.py
+"""
+Index bootstrap and query-plan audit.
+
+`ensure_indexes` runs from the FastAPI lifespan on every startup and is
+idempotent. A unique index that cannot be built because the collection
+already holds duplicate keys is logged and skipped rather than failing
+startup. Uploads and check-ins rely on the unique indexes of master
+documents and versions for their locking and version numbering, so while
+either is missing they are refused (see `missing_write_indexes`). The
+duplicates can be listed with:
+
+    python -m app.db.indexes --duplicates
+
+The audit explains every query shape the API issues and fails if any of them
+would scan a whole collection:
+
+    python -m app.db.indexes --audit
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from app.db.database import (
+    database,
+    user_collection,
+    document_collection,
+    version_collection,
+    blob_collection,
+    search_posting_collection,
+    search_state_collection,
+    job_collection
+)
+
+logger = logging.getLogger(__name__)
+
+# Unique indexes that uploads and check-ins depend on: without the first an
+# upsert on a checked-out master inserts a second master instead of
+# colliding, and without the second version numbers may repeat
+WRITE_GUARD_INDEXES = [
+    ("documents", "employee_type_filename_unique"),
+    ("document_versions", "document_version_unique"),
+]
+
+# (collection, index name) of the indexes this process could not build
+skipped_indexes: set[tuple[str, str]] = set()
+
+# Indexes required by the API, per collection name
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "documents": [
+        # A master document is identified by employee, type and filename
+        IndexModel(
+            [("employee_id", ASCENDING), ("document_type", ASCENDING), ("original_filename", ASCENDING)],
+            name="employee_type_filename_unique",
+            unique=True
+        ),
+        # Keyset pagination of an employee's documents
+        IndexModel([("employee_id", ASCENDING), ("_id", ASCENDING)], name="employee_id_keyset"),
+    ],
+    "document_versions": [
+        IndexModel(
+            [("document_id", ASCENDING), ("version_number", DESCENDING)],
+            name="document_version_unique",
+            unique=True
+        ),
+        # Finding the versions that use a blob, when packing cold blobs
+        IndexModel([("sha256", ASCENDING)], name="sha256"),
+    ],
+    "blobs": [
+        # Deltas of a base, in base order for reconciliation
+        IndexModel([("base", ASCENDING)], name="base", sparse=True),
+        # Live bytes of a pack
+        IndexModel([("pack.path", ASCENDING)], name="pack_path", sparse=True),
+    ],
+    "search_postings": [
+        # Query terms, overall or restricted to one employee's documents,
+        # highest term frequency first
+        IndexModel([("term", ASCENDING), ("tf", DESCENDING)], name="term_tf"),
+        IndexModel([("term", ASCENDING), ("employee_id", ASCENDING), ("tf", DESCENDING)], name="term_employee_tf"),
+        # Replacing a document's postings when a new version is indexed
+        IndexModel([("document_id", ASCENDING), ("version_number", ASCENDING)], name="document_version"),
+    ],
+    "jobs": [
+        # Claiming the next due job, and the lag of the oldest one
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+        # Reclaiming jobs whose worker died
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+        # Completed jobs are kept for JOB_RETENTION_SECONDS
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+def query_shapes() -> list[tuple[str, object, dict, list]]:
+    """
+    Every (label, collection, filter, sort) the API issues, with placeholder
+    values. Keep this in sync when adding new queries.
+    """
+    some_id = ObjectId()
+    now = datetime.utcnow()
+    return [
+        ("users by username", user_collection, {"username": "x"}, []),
+        ("users by id", user_collection, {"_id": some_id}, []),
+        ("documents by id", document_collection, {"_id": some_id}, []),
+        ("users page", user_collection, {"_id": {"$gt": some_id}}, [("_id", ASCENDING)]),
+        (
+            "documents page of an employee",
+            document_collection,
+            {"employee_id": some_id, "_id": {"$gt": some_id}},
+            [("_id", ASCENDING)]
+        ),
+        (
+            "documents by employee/type/filename",
+            document_collection,
+            {"employee_id": some_id, "document_type": "x", "original_filename": "x"},
+            []
+        ),
+        (
+            "versions page of a document",
+            version_collection,
+            {"document_id": some_id, "version_number": {"$lt": 10}},
+            [("version_number", DESCENDING)]
+        ),
+        (
+            "version by number",
+            version_collection,
+            {"document_id": some_id, "version_number": 1},
+            []
+        ),
+        (
+            "versions of a batch of documents",
+            version_collection,
+            {"document_id": {"$in": [some_id, ObjectId()]}},
+            [("document_id", ASCENDING), ("version_number", DESCENDING)]
+        ),
+        ("blobs by digest", blob_collection, {"_id": "0" * 64}, []),
+        (
+            "versions using a batch of blobs",
+            version_collection,
+            {"sha256": {"$in": ["0" * 64, "1" * 64]}},
+            []
+        ),
+        (
+            "unpacked blobs page",
+            blob_collection,
+            {"created_at": {"$lt": now}, "pack": None, "_id": {"$gt": "0" * 64}},
+            [("_id", ASCENDING)]
+        ),
+        ("blobs page", blob_collection, {"_id": {"$gt": "0" * 64}}, [("_id", ASCENDING)]),
+        ("deltas of a blob", blob_collection, {"base": "0" * 64}, []),
+        ("deltas in base order", blob_collection, {"base": {"$gt": ""}}, [("base", ASCENDING)]),
+        ("blobs in a pack", blob_collection, {"pack.path": "x"}, []),
+        ("versions of a blob", version_collection, {"sha256": "0" * 64}, []),
+        ("versions in digest order", version_collection, {"sha256": {"$gt": ""}}, [("sha256", ASCENDING)]),
+        ("versions without digest", version_collection, {"sha256": None}, []),
+        (
+            "pending removals of a blob",
+            job_collection,
+            {
+                "_id": {"$regex": "^remove_raw_file:" + "0" * 64 + ":"},
+                "payload.path": "x",
+                "status": {"$in": ["pending", "running"]}
+            },
+            []
+        ),
+        ("postings by term", search_posting_collection, {"term": {"$in": ["x", "y"]}}, []),
+        ("postings of a term by tf", search_posting_collection, {"term": "x"}, [("tf", DESCENDING)]),
+        (
+            "postings of a term of an employee by tf",
+            search_posting_collection,
+            {"term": "x", "employee_id": some_id},
+            [("tf", DESCENDING)]
+        ),
+        (
+            "stale postings of a document",
+            search_posting_collection,
+            {"document_id": some_id, "version_number": {"$lte": 1}},
+            []
+        ),
+        (
+            "postings of a document version",
+            search_posting_collection,
+            {"document_id": some_id, "version_number": 1},
+            []
+        ),
+        ("search state of documents", search_state_collection, {"_id": {"$in": [some_id, ObjectId()]}}, []),
+        ("due jobs", job_collection, {"status": "pending", "run_at": {"$lte": now}}, [("run_at", ASCENDING)]),
+        ("expired job leases", job_collection, {"status": "running", "lease_expires_at": {"$lt": now}}, []),
+        ("jobs by status", job_collection, {"status": {"$in": ["pending", "running", "failed"]}}, []),
+    ]
+
+
+async def ensure_indexes() -> list[tuple[str, str]]:
+    """
+    Creates the required indexes. Existing indexes with the same definition
+    are left alone, so this is safe to run on every startup.
+
+    Indexes are built one at a time, so a unique index that fails on
+    duplicate keys does not hold back the others. Returns the
+    (collection, index name) of each index that was skipped.
+    """
+    skipped = []
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = database.get_collection(collection_name)
+        for index in indexes:
+            try:
+                await collection.create_indexes([index])
+            except DuplicateKeyError:
+                document = index.document
+                logger.error(
+                    "Cannot build unique index %s on %s %s: the collection holds duplicate keys. "
+                    "Starting without it; list the duplicates with "
+                    "`python -m app.db.indexes --duplicates`, resolve them and restart.",
+                    document["name"], collection_name, dict(document["key"])
+                )
+                skipped.append((collection_name, document["name"]))
+    skipped_indexes.clear()
+    skipped_indexes.update(skipped)
+    return skipped
+
+
+def missing_write_indexes() -> list[str]:
+    """The write-guarding indexes that were skipped on startup, as collection.name."""
+    return [
+        f"{collection_name}.{index_name}"
+        for collection_name, index_name in WRITE_GUARD_INDEXES
+        if (collection_name, index_name) in skipped_indexes
+    ]
+
+
+async def find_duplicates() -> list[tuple[str, str, dict, int]]:
+    """
+    (collection, index name, key, count) of every key that occurs more than
+    once in a collection with a required unique index.
+    """
+    duplicates = []
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = database.get_collection(collection_name)
+        for index in indexes:
+            document = index.document
+            if not document.get("unique"):
+                continue
+            fields = list(document["key"])
+            cursor = collection.aggregate([
+                {"$group": {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ], allowDiskUse=True)
+            async for group in cursor:
+                duplicates.append((collection_name, document["name"], group["_id"], group["count"]))
+    return duplicates
+
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def audit_query_plans() -> list[tuple[str, list]]:
+    """
+    Explains each query shape and returns (label, stages) for those whose
+    winning plan contains a COLLSCAN.
+    """
+    failures = []
+    for label, collection, query, sort in query_shapes():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = list(_plan_stages(explanation["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            failures.append((label, stages))
+    return failures
+
+
+async def _main(args) -> int:
+    if args.duplicates:
+        duplicates = await find_duplicates()
+        for collection_name, index_name, key, count in duplicates:
+            print(f"{collection_name}.{index_name}: {count} documents with {key}")
+        print(f"{len(duplicates)} duplicate key(s).")
+        return 1 if duplicates else 0
+
+    skipped = await ensure_indexes()
+    for collection_name, index_name in skipped:
+        print(f"SKIPPED: {collection_name}.{index_name} (duplicate keys)", file=sys.stderr)
+    if skipped:
+        print(
+            f"{len(skipped)} unique index(es) not built; run with --duplicates to list the offending keys.",
+            file=sys.stderr
+        )
+        return 1
+    print("Indexes ensured.")
+    if not args.audit:
+        return 0
+
+    failures = await audit_query_plans()
+    for label, stages in failures:
+        print(f"COLLSCAN: {label} -> {' > '.join(str(s) for s in stages)}", file=sys.stderr)
+    if failures:
+        print(f"{len(failures)} query shape(s) would scan a whole collection.", file=sys.stderr)
+        return 1
+    print(f"All {len(query_shapes())} query shapes use an index.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create required indexes and audit query plans.")
+    parser.add_argument("--audit", action="store_true",
+                        help="Explain every API query shape and fail on any COLLSCAN")
+    parser.add_argument("--duplicates", action="store_true",
+                        help="List keys that prevent a unique index from being built")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
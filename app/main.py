@@ -1,13 +1,45 @@
 # app/main.py
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.api import auth, documents
+from app.auth.password import password_pool
+from app.auth.user_cache import user_cache
+from app.core.admission import upload_admission
+from app.core.blobs import decoded_blob_cache
+from app.core.checkout_queue import checkout_wait_queue
+from app.core.compaction import schedule_compaction
+from app.core.diff import diff_cache
+from app.core.packs import pack_files
+from app.core.storage import storage
+from app.core.jobs import job_queue
+from app.core.metrics import Collector, MetricsMiddleware, registry
+from app.db.database import mongo
+from app.db.indexes import ensure_indexes
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="HR Document Management System")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker opens its own pool, on its own event loop
+    await mongo.connect()
+    # Idempotent, so every worker can run it on startup
+    await ensure_indexes()
+    job_queue.start()
+    await schedule_compaction()
+    yield
+    await job_queue.stop()
+    password_pool.shutdown()
+    mongo.close()
+
+
+app = FastAPI(title="HR Document Management System", lifespan=lifespan)
 
 app.include_router(auth.router, tags=["Authentication"])
 app.include_router(documents.router, tags=["Documents"])
+app.include_router(documents.upload_router, tags=["Documents"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,6 +49,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it is outermost and times the whole middleware stack
+app.add_middleware(MetricsMiddleware)
+
+registry.register(Collector(user_cache.stats, {
+    "size": ("user_cache_entries", "gauge", "Users in the authenticated-user cache."),
+    "hits": ("user_cache_hits_total", "counter", "Authenticated-user cache hits."),
+    "misses": ("user_cache_misses_total", "counter", "Authenticated-user cache misses."),
+}))
+registry.register(Collector(password_pool.stats, {
+    "pending": ("password_pool_pending", "gauge", "bcrypt jobs running or queued."),
+    "completed": ("password_pool_completed_total", "counter", "bcrypt jobs completed."),
+    "rejected": ("password_pool_rejected_total", "counter", "bcrypt jobs rejected with 503."),
+    "queue_wait_seconds_total": ("password_pool_queue_wait_seconds_total", "counter", "Time bcrypt jobs spent queued."),
+    "service_seconds_total": ("password_pool_service_seconds_total", "counter", "Time spent hashing and verifying passwords."),
+}))
+registry.register(Collector(upload_admission.stats, {
+    "in_flight": ("uploads_in_flight", "gauge", "Uploads admitted and still running."),
+    "in_flight_bytes": ("uploads_in_flight_bytes", "gauge", "Declared bytes of the uploads in flight."),
+    "admitted": ("uploads_admitted_total", "counter", "Uploads admitted."),
+    "rejected_busy": ("uploads_rejected_busy_total", "counter", "Uploads rejected with 503 at the in-flight limits."),
+    "rejected_quota": ("uploads_rejected_quota_total", "counter", "Uploads rejected with 429 by a per-user quota."),
+    "service_seconds_total": ("uploads_service_seconds_total", "counter", "Time spent on admitted uploads."),
+}))
+registry.register(Collector(decoded_blob_cache.stats, {
+    "bytes": ("decoded_blob_cache_bytes", "gauge", "Bytes held by the decoded blob cache."),
+    "hits": ("decoded_blob_cache_hits_total", "counter", "Decoded blob cache hits."),
+    "misses": ("decoded_blob_cache_misses_total", "counter", "Decoded blob cache misses."),
+}))
+registry.register(Collector(diff_cache.stats, {
+    "bytes": ("diff_cache_bytes", "gauge", "Bytes held by the version diff cache."),
+    "hits": ("diff_cache_hits_total", "counter", "Version diff cache hits."),
+    "misses": ("diff_cache_misses_total", "counter", "Version diff cache misses."),
+}))
+registry.register(Collector(lambda: vars(job_queue), {
+    "running": ("jobs_running", "gauge", "Background jobs running in this process."),
+    "completed": ("jobs_completed_total", "counter", "Background jobs completed by this process."),
+    "retried": ("jobs_retried_total", "counter", "Background job attempts that failed and were rescheduled."),
+    "failed": ("jobs_failed_total", "counter", "Background jobs that exhausted their attempts."),
+}))
+registry.register(Collector(pack_files.stats, {
+    "open": ("pack_files_open", "gauge", "Packfiles currently memory-mapped."),
+}))
+if hasattr(storage, "cache"):
+    registry.register(Collector(storage.cache.stats, {
+        "bytes": ("storage_cache_bytes", "gauge", "Bytes held by the local cache of stored objects."),
+        "hits": ("storage_cache_hits_total", "counter", "Local storage cache hits."),
+        "misses": ("storage_cache_misses_total", "counter", "Local storage cache misses."),
+    }))
+registry.register(Collector(checkout_wait_queue.stats, {
+    "documents": ("checkout_wait_documents", "gauge", "Checked-out documents with clients waiting for them."),
+    "waiters": ("checkout_waiters", "gauge", "Clients waiting to check out a document."),
+}))
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint for this process."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the HR Document Management System API"}
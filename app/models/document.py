@@ -16,6 +16,8 @@ class DocumentVersion(BaseModel):
     document_id: ObjectId  # Id of the master document
     version_number: int
     file_path: str
+    size: Optional[int] = None  # Size of the stored file in bytes
+    sha256: Optional[str] = None  # Hex digest of the stored file
     uploader_id: ObjectId
     created_at: datetime = Field(default_factory=datetime.utcnow)
     comments: Optional[str] = None  # Optional change note
@@ -26,6 +28,19 @@ class DocumentVersion(BaseModel):
     )
 
 
+class LatestVersion(BaseModel):
+    """
+    Copy of the newest version's storage pointer kept on the master, so the
+    current version can be served from the master record alone.
+    """
+    version_number: int
+    file_path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    media_type: str = "application/octet-stream"
+    created_at: datetime
+
+
 # === 2. MASTER DOCUMENT MODEL (active record) ===
 class Document(BaseModel):
     """
@@ -41,6 +56,8 @@ class Document(BaseModel):
     is_checked_out: bool = False
     checked_out_by: Optional[ObjectId] = None
     checked_out_at: Optional[datetime] = None
+    lease_expires_at: Optional[datetime] = None
+    latest: Optional[LatestVersion] = None  # Missing on masters written before it existed
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -50,3 +67,41 @@ class Document(BaseModel):
         arbitrary_types_allowed=True,
         json_encoders={ObjectId: str}
     )
+
+
+# === 3. BULK INGESTION MODELS ===
+class BulkUploadItem(BaseModel):
+    """
+    One manifest entry of a bulk upload: which file goes to which employee.
+    `filename` names a part of the multipart batch or a member of the zip.
+    """
+    filename: str
+    employee_id: str
+    document_type: str
+
+
+class BulkUploadResult(BaseModel):
+    index: int
+    filename: str
+    status: str  # "created", "versioned" or "error"
+    document_id: Optional[str] = None
+    version: Optional[int] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+# === 4. SEARCH MODELS ===
+class SearchHit(BaseModel):
+    """
+    One ranked search result: the matching document and the version whose
+    contents matched.
+    """
+    document: Document
+    version_number: int
+    score: float
+    matched_terms: list[str]
+
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
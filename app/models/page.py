@@ -0,0 +1,16 @@
+# app/models/page.py
+
+from typing import Generic, List, Optional, TypeVar
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    """
+    One page of a keyset-paginated listing.
+    Pass `next_cursor` back as `after` to fetch the following page;
+    it is None on the last page.
+    """
+    items: List[T]
+    next_cursor: Optional[str] = None
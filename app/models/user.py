@@ -27,3 +27,7 @@ class UserCreate(BaseModel):
     password: str
     full_name: str | None = None
     role: str
+
+class UserUpdate(BaseModel):
+    role: str | None = None
+    disabled: bool | None = None
@@ -0,0 +1,99 @@
+# benchmarks/checkout_contention.py
+"""
+Hammers a single document with parallel check-outs and check-ins.
+
+Each worker loops: check out, and if the lock was granted, check in a new
+version. Afterwards the version history is verified: every granted checkout
+must have produced exactly one version and version numbers must be unique and
+contiguous. Reports throughput and latency percentiles per operation.
+
+Run it against a disposable database, for example:
+    DATABASE_NAME=hr_dms_bench python -m benchmarks.checkout_contention --workers 32
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import time
+
+from bson import ObjectId
+from starlette.datastructures import UploadFile
+
+from app.core.document import handle_document_upload, check_out_document, check_in_document
+from app.db.database import document_collection, version_collection
+from app.db.indexes import ensure_indexes
+from benchmarks.stats import percentiles
+
+
+def upload_file(payload: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(payload), filename="contended.txt")
+
+
+async def worker(document_id: str, user_id: str, deadline: float, timings: dict, counts: dict):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        _, status = await check_out_document(document_id, user_id)
+        timings["checkout"].append(time.perf_counter() - started)
+        if status != 200:
+            counts["conflicts"] += 1
+            await asyncio.sleep(0)
+            continue
+
+        counts["granted"] += 1
+        payload = f"{user_id} {time.perf_counter()}".encode()
+        started = time.perf_counter()
+        _, status = await check_in_document(document_id, user_id, upload_file(payload), "contended.txt")
+        timings["checkin"].append(time.perf_counter() - started)
+        counts["checked_in" if status == 200 else "checkin_failures"] += 1
+
+
+async def run(workers: int, seconds: float) -> dict:
+    await ensure_indexes()
+    owner_id = str(ObjectId())
+    created = await handle_document_upload(upload_file(b"v1"), owner_id, "Benchmark", owner_id)
+    document_id = created["document_id"]
+
+    timings = {"checkout": [], "checkin": []}
+    counts = {"granted": 0, "conflicts": 0, "checked_in": 0, "checkin_failures": 0}
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(document_id, str(ObjectId()), deadline, timings, counts) for _ in range(workers)
+    ))
+    elapsed = time.perf_counter() - started
+
+    numbers = [
+        v["version_number"] async for v in
+        version_collection.find({"document_id": ObjectId(document_id)}, {"version_number": 1})
+    ]
+    master = await document_collection.find_one({"_id": ObjectId(document_id)})
+
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 2),
+        "operations_per_second": round((len(timings["checkout"]) + len(timings["checkin"])) / elapsed, 1),
+        "counts": counts,
+        "checkout": percentiles(timings["checkout"]),
+        "checkin": percentiles(timings["checkin"]),
+        "consistency": {
+            "versions": len(numbers),
+            "unique_version_numbers": len(set(numbers)) == len(numbers),
+            "contiguous": sorted(numbers) == list(range(1, len(numbers) + 1)),
+            "one_version_per_checkout": len(numbers) == counts["checked_in"] + 1,
+            "latest_matches_master": master["latest_version"] == max(numbers),
+            "left_unlocked": not master["is_checked_out"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.workers, args.seconds)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/listing_serialization.py
+"""
+CPU cost of serializing a large listing page, validated path versus fast path.
+
+The validated path is what the version listing did before: build a
+DocumentVersion per row, let FastAPI validate the page against
+`response_model`, dump it and encode it with the stdlib json module. The fast
+path is app.core.serialization.page_response. Rows are shaped like those
+Motor returns. Both outputs are checked to decode to the same JSON.
+
+Usage:
+    python -m benchmarks.listing_serialization --rows 10000 --runs 20
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.core.serialization import page_response
+from app.models.document import Document, DocumentVersion
+from app.models.page import Page
+
+
+def version_rows(count: int) -> list[dict]:
+    document_id = ObjectId()
+    uploader_id = ObjectId()
+    created = datetime(2025, 1, 1, 9, 30, 0, 123000)
+    return [
+        {
+            "_id": ObjectId(),
+            "document_id": document_id,
+            "version_number": count - i,
+            "file_path": f"uploads/blobs/{i:064x}",
+            "size": 35_000 + i,
+            "sha256": f"{i:064x}",
+            "uploader_id": uploader_id,
+            "created_at": created + timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+def document_rows(count: int) -> list[dict]:
+    employee_id = ObjectId()
+    created = datetime(2025, 1, 1, 9, 30, 0, 123000)
+    return [
+        {
+            "_id": ObjectId(),
+            "employee_id": employee_id,
+            "document_type": "Contract",
+            "original_filename": f"contract-{i}.txt",
+            "latest_version": i % 7 + 1,
+            "is_checked_out": i % 11 == 0,
+            "checked_out_by": employee_id if i % 11 == 0 else None,
+            "checked_out_at": created if i % 11 == 0 else None,
+            "latest": {
+                "version_number": i % 7 + 1,
+                "file_path": f"uploads/blobs/{i:064x}",
+                "size": 35_000 + i,
+                "sha256": f"{i:064x}",
+                "media_type": "text/plain",
+                "created_at": created + timedelta(hours=i),
+            },
+            "created_at": created,
+            "updated_at": created + timedelta(hours=i),
+        }
+        for i in range(count)
+    ]
+
+
+def validated_path(model, rows: list[dict], loop: asyncio.AbstractEventLoop) -> bytes:
+    # The handler's explicit model construction, then FastAPI's own
+    # response_model validation and serialization, then JSONResponse
+    field = create_model_field(name="Response", type_=Page[model], mode="serialization")
+    page = {"items": [model(**row) for row in rows], "next_cursor": None}
+    content = loop.run_until_complete(serialize_response(field=field, response_content=page))
+    return JSONResponse(content).body
+
+
+def fast_path(model, rows: list[dict]) -> bytes:
+    return page_response(model, {"items": rows, "next_cursor": None}).body
+
+
+def timed(fn, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    results = {"rows": args.rows}
+    for name, model, rows in (
+        ("versions", DocumentVersion, version_rows(args.rows)),
+        ("documents", Document, document_rows(args.rows)),
+    ):
+        assert json.loads(validated_path(model, rows, loop)) == json.loads(fast_path(model, rows)), name
+        validated = timed(lambda: validated_path(model, rows, loop), args.runs)
+        fast = timed(lambda: fast_path(model, rows), args.runs)
+        results[name] = {
+            "validated": validated,
+            "fast": fast,
+            "speedup": round(validated["median_ms"] / fast["median_ms"], 2),
+            "response_bytes": len(fast_path(model, rows)),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+# benchmarks/load_test.py
+"""
+End-to-end load test of the API with a reproducible mix of requests.
+
+Boots app.main:app under uvicorn in this process, seeds users, documents and
+versions, then runs --concurrency virtual users for --seconds. Each virtual
+user repeatedly picks an operation by weight (--mix): logging in, uploading
+a new version, checking a document out and back in, listing documents or
+versions, and downloading a given or the latest version. Requests go over
+real HTTP.
+
+Throughput and p50/p95/p99 latency per endpoint are written as JSON to
+--output together with the configuration and git commit. --compare prints
+the change against an earlier result file.
+
+MongoDB is either an in-process fake (--mongo fake, needs mongomock-motor)
+or a real server (--mongo uri, using MONGODB_URI and DATABASE_NAME; point it
+at a disposable database, it is dropped before seeding). Numbers are only
+comparable between runs on the same backend and machine. The suite also
+needs httpx.
+
+Usage:
+    python -m benchmarks.load_test --mongo fake --seconds 30 --concurrency 16 \\
+        --output load-$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.stats import percentiles
+
+PASSWORD = "load-test-password"
+DOCUMENT_TYPES = ["Contract", "Agreement", "Policy", "Payslip", "Review"]
+DEFAULT_MIX = "login=1,upload=2,checkout_checkin=1,list_documents=3,list_versions=2,my_documents=2,download=6,download_latest=4"
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown operations: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def use_fake_mongo() -> None:
+    """Swaps Motor's client for mongomock's before the app creates one."""
+    try:
+        import mongomock_motor
+    except ImportError:
+        sys.exit("--mongo fake needs mongomock-motor: pip install mongomock-motor")
+    import motor.motor_asyncio
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost")
+    os.environ.setdefault("DATABASE_NAME", "hr_dms_load_test")
+
+
+class Recorder:
+    def __init__(self):
+        self.recording = False
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        if method == "GET":
+            await response.aread()
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies[label].append(elapsed)
+            self.statuses[label][response.status_code] += 1
+        return response
+
+
+async def seed(args, rng: random.Random) -> dict:
+    """Creates the users, documents and versions the run works on."""
+    from starlette.datastructures import UploadFile
+
+    from app.auth.password import hash_password
+    from app.core.document import handle_document_upload
+    from app.db.database import user_collection
+
+    hashed = hash_password(PASSWORD)
+
+    def user(name: str, role: str) -> dict:
+        return {
+            "username": name,
+            "email": f"{name}@example.com",
+            "full_name": name,
+            "hashed_password": hashed,
+            "role": role,
+            "disabled": False,
+        }
+
+    hr_users = [user(f"hr{i}", "HR Manager") for i in range(args.hr_users)]
+    employees = [user(f"employee{i}", "Employee") for i in range(args.users)]
+    await user_collection.insert_many(hr_users + employees)
+
+    documents = []  # (document_id, employee_id, filename, versions)
+    uploader = str(hr_users[0]["_id"])
+    for employee in employees:
+        for number in range(args.documents):
+            filename = f"doc{number}.txt"
+            document_type = DOCUMENT_TYPES[number % len(DOCUMENT_TYPES)]
+            for version in range(args.versions):
+                payload = make_payload(rng, args.file_size)
+                result = await handle_document_upload(
+                    UploadFile(file=io.BytesIO(payload), filename=filename),
+                    str(employee["_id"]), document_type, uploader
+                )
+            documents.append({
+                "id": result["document_id"],
+                "employee_id": str(employee["_id"]),
+                "filename": filename,
+                "document_type": document_type,
+                "versions": args.versions,
+            })
+
+    return {"hr_users": hr_users, "employees": employees, "documents": documents}
+
+
+def make_payload(rng: random.Random, size: int) -> bytes:
+    words = ["salary", "contract", "review", "policy", "leave", "notice", "bonus", "terms"]
+    text = " ".join(rng.choice(words) for _ in range(max(size // 7, 1)))
+    return text.encode("utf-16")[:size] if size else b""
+
+
+async def op_login(ctx, client, rng):
+    employee = rng.choice(ctx["employees"])
+    await ctx["recorder"].request(
+        client, "POST /login", "POST", "/login",
+        data={"username": employee["username"], "password": PASSWORD}
+    )
+
+
+async def op_upload(ctx, client, rng):
+    doc = rng.choice(ctx["documents"])
+    response = await ctx["recorder"].request(
+        client, "POST /documents/upload", "POST", "/documents/upload",
+        params={"employee_id": doc["employee_id"], "document_type": doc["document_type"]},
+        files={"file": (doc["filename"], make_payload(rng, ctx["args"].file_size))},
+        headers=ctx["hr_headers"]
+    )
+    if response.status_code == 200:
+        doc["versions"] = max(doc["versions"], response.json()["version"])
+
+
+async def op_checkout_checkin(ctx, client, rng):
+    doc = rng.choice(ctx["documents"])
+    response = await ctx["recorder"].request(
+        client, "POST /documents/{doc_id}/checkout", "POST", f"/documents/{doc['id']}/checkout",
+        headers=ctx["hr_headers"]
+    )
+    if response.status_code != 200:
+        return
+    response = await ctx["recorder"].request(
+        client, "POST /documents/{doc_id}/checkin", "POST", f"/documents/{doc['id']}/checkin",
+        files={"file": (doc["filename"], make_payload(rng, ctx["args"].file_size))},
+        headers=ctx["hr_headers"]
+    )
+    if response.status_code == 200:
+        doc["versions"] = max(doc["versions"], response.json()["version"])
+
+
+async def op_list_documents(ctx, client, rng):
+    employee = rng.choice(ctx["employees"])
+    await ctx["recorder"].request(
+        client, "GET /documents/user/{employee_id}", "GET", f"/documents/user/{employee['_id']}",
+        headers=ctx["hr_headers"]
+    )
+
+
+async def op_list_versions(ctx, client, rng):
+    doc = rng.choice(ctx["documents"])
+    await ctx["recorder"].request(
+        client, "GET /documents/{doc_id}/versions", "GET", f"/documents/{doc['id']}/versions",
+        headers=ctx["hr_headers"]
+    )
+
+
+async def op_my_documents(ctx, client, rng):
+    await ctx["recorder"].request(
+        client, "GET /documents/my-documents", "GET", "/documents/my-documents",
+        headers=ctx["employee_headers"]
+    )
+
+
+async def op_download(ctx, client, rng):
+    doc = rng.choice(ctx["documents"])
+    version = rng.randint(1, doc["versions"])
+    await ctx["recorder"].request(
+        client, "GET /documents/download/{doc_id}/version/{version_num}", "GET",
+        f"/documents/download/{doc['id']}/version/{version}",
+        headers=ctx["hr_headers"]
+    )
+
+
+async def op_download_latest(ctx, client, rng):
+    doc = rng.choice(ctx["documents"])
+    await ctx["recorder"].request(
+        client, "GET /documents/{doc_id}/latest", "GET", f"/documents/{doc['id']}/latest",
+        headers=ctx["hr_headers"]
+    )
+
+
+OPERATIONS = {
+    "login": op_login,
+    "upload": op_upload,
+    "checkout_checkin": op_checkout_checkin,
+    "list_documents": op_list_documents,
+    "list_versions": op_list_versions,
+    "my_documents": op_my_documents,
+    "download": op_download,
+    "download_latest": op_download_latest,
+}
+
+
+async def token_headers(client, username: str) -> dict:
+    response = await client.post("/login", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def virtual_user(index: int, ctx: dict, base_url: str, deadline: float):
+    import httpx
+
+    rng = random.Random(ctx["args"].seed * 1000 + index)
+    names, weights = zip(*ctx["args"].mix.items())
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        ctx = {
+            **ctx,
+            "hr_headers": await token_headers(client, ctx["hr_users"][index % len(ctx["hr_users"])]["username"]),
+            "employee_headers": await token_headers(client, ctx["employees"][index % len(ctx["employees"])]["username"]),
+        }
+        while time.perf_counter() < deadline:
+            await OPERATIONS[rng.choices(names, weights)[0]](ctx, client, rng)
+
+
+async def run(args) -> dict:
+    import uvicorn
+
+    from app.db.database import database
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        rng = random.Random(args.seed)
+        if args.mongo == "uri":
+            for name in await database.list_collection_names():
+                await database.drop_collection(name)
+            from app.db.indexes import ensure_indexes
+            await ensure_indexes()
+        seeded_at = time.perf_counter()
+        data = await seed(args, rng)
+        seed_seconds = time.perf_counter() - seeded_at
+
+        recorder = Recorder()
+        ctx = {**data, "args": args, "recorder": recorder}
+        started = time.perf_counter()
+        measure_from = started + args.warmup
+        deadline = measure_from + args.seconds
+
+        async def start_recording():
+            await asyncio.sleep(args.warmup)
+            recorder.recording = True
+
+        await asyncio.gather(
+            start_recording(),
+            *(virtual_user(i, ctx, base_url, deadline) for i in range(args.concurrency))
+        )
+        elapsed = time.perf_counter() - measure_from
+    finally:
+        server.should_exit = True
+        await serving
+
+    all_latencies = [s for samples in recorder.latencies.values() for s in samples]
+    return {
+        "commit": git_commit(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare", "workdir")
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "total": percentiles(all_latencies, elapsed) if all_latencies else {},
+        "endpoints": {
+            label: {
+                **percentiles(samples, elapsed),
+                "statuses": {str(code): count for code, count in sorted(recorder.statuses[label].items())},
+            }
+            for label, samples in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"Compared with {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for label, stats in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(label)
+        if not before:
+            continue
+        change = lambda key: (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(
+            f"  {label}: p50 {change('p50_ms'):+.1f}%  p95 {change('p95_ms'):+.1f}%  "
+            f"p99 {change('p99_ms'):+.1f}%  throughput {change('throughput_rps'):+.1f}%",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongo", choices=["fake", "uri"], default="fake")
+    parser.add_argument("--users", type=int, default=50, help="Employees to seed")
+    parser.add_argument("--hr-users", type=int, default=5, help="HR Managers to seed")
+    parser.add_argument("--documents", type=int, default=3, help="Documents per employee")
+    parser.add_argument("--versions", type=int, default=3, help="Versions per document")
+    parser.add_argument("--file-size", type=int, default=16 * 1024, help="Bytes per uploaded file")
+    parser.add_argument("--concurrency", type=int, default=16, help="Virtual users")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Measured duration")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before recording")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"Operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for data and request mix")
+    parser.add_argument("--port", type=int, default=0, help="Port to serve on (default: any free port)")
+    parser.add_argument("--workdir", help="Directory for uploads/ (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--compare", help="Earlier result file to print the change against")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    # Paths given on the command line are relative to where we were started
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    if args.mongo == "fake":
+        use_fake_mongo()
+    os.environ.setdefault("JWT_SECRET_KEY", "load-test-secret-key")
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+
+    # The app stores files under ./uploads
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hr-dms-load-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["total"], indent=2))
+    print(f"Wrote {output}", file=sys.stderr)
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# benchmarks/mongo_read_routing.py
+"""
+Listing and download-metadata reads against a replica set, with the client
+tuned and routed in different ways.
+
+Seeds --employees employees with --documents documents of --versions
+versions each (metadata only, written with majority write concern), then
+for each configuration builds a new client through app.db.database and runs
+--concurrency tasks for --seconds. The tasks issue the same queries as the
+list endpoints (paginate on documents and versions) and the download
+endpoints (find_one_routed on the master and a version). Configurations:
+
+- cold_primary: no warm-up and every read on the primary, as the client
+  behaved before it was created in the lifespan.
+- warm_primary: the pool is opened with mongo.connect() first.
+- warm_secondary: warm, with listings and download metadata on
+  secondaryPreferred with bounded staleness.
+- warm_secondary_zlib: as warm_secondary, with zlib wire compression.
+
+Per configuration it reports the first-read latency, throughput, latency
+percentiles per operation, errors (e.g. wait-queue timeouts), and how many
+commands each replica set member served.
+
+A local replica-set stand-in with three members:
+
+    for port in 27017 27018 27019; do
+        mkdir -p /tmp/rs/$port
+        mongod --replSet rs0 --port $port --dbpath /tmp/rs/$port --fork --logpath /tmp/rs/$port.log
+    done
+    mongosh --port 27017 --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}, {_id: 2, host: "localhost:27019"}]})'
+
+Then run it against a disposable database, which is dropped afterwards:
+
+    MONGODB_URI="mongodb://localhost:27017/?replicaSet=rs0" DATABASE_NAME=hr_dms_bench \\
+        python -m benchmarks.mongo_read_routing --concurrency 64 --pool-size 32
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DESCENDING, monitoring
+from pymongo.write_concern import WriteConcern
+
+from app.config import settings
+from app.core.pagination import paginate
+from app.db.database import document_collection, find_one_routed, mongo, version_collection
+from benchmarks.stats import percentiles
+
+CONFIGURATIONS = {
+    "cold_primary": {"warm": False, "read_preference": "primary", "compressors": ""},
+    "warm_primary": {"warm": True, "read_preference": "primary", "compressors": ""},
+    "warm_secondary": {"warm": True, "read_preference": "secondaryPreferred", "compressors": ""},
+    "warm_secondary_zlib": {"warm": True, "read_preference": "secondaryPreferred", "compressors": "zlib"},
+}
+
+
+class ServerCounter(monitoring.CommandListener):
+    """Counts commands per replica set member."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.counts["%s:%s" % event.connection_id] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self) -> dict:
+        with self._lock:
+            counts, self.counts = dict(self.counts), Counter()
+        return counts
+
+
+async def seed(args) -> list[tuple[ObjectId, ObjectId, int]]:
+    """Returns (employee_id, document_id, latest_version) per document."""
+    documents = document_collection.with_options(write_concern=WriteConcern(w="majority"))
+    versions = version_collection.with_options(write_concern=WriteConcern(w="majority"))
+    now = datetime.utcnow()
+    seeded = []
+    for _ in range(args.employees):
+        employee_id = ObjectId()
+        masters, rows = [], []
+        for number in range(args.documents):
+            document_id = ObjectId()
+            filename = f"document-{number}.pdf"
+            masters.append({
+                "_id": document_id,
+                "employee_id": employee_id,
+                "document_type": "Contract",
+                "original_filename": filename,
+                "latest_version": args.versions,
+                "is_checked_out": False,
+                "checked_out_by": None,
+                "created_at": now,
+                "updated_at": now,
+            })
+            for version in range(1, args.versions + 1):
+                sha256 = f"{random.getrandbits(256):064x}"
+                rows.append({
+                    "document_id": document_id,
+                    "version_number": version,
+                    "file_path": f"uploads/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}",
+                    "size": 4096,
+                    "sha256": sha256,
+                    "uploaded_by": employee_id,
+                    "created_at": now,
+                })
+            seeded.append((employee_id, document_id, args.versions))
+        await documents.insert_many(masters)
+        await versions.insert_many(rows)
+    return seeded
+
+
+async def list_documents(employee_id, document_id, latest):
+    await paginate(document_collection.reads("listing"), {"employee_id": employee_id}, sort_field="_id")
+
+
+async def list_versions(employee_id, document_id, latest):
+    await paginate(
+        version_collection.reads("listing"),
+        {"document_id": document_id},
+        sort_field="version_number",
+        descending=True
+    )
+
+
+async def download_metadata(employee_id, document_id, latest):
+    await find_one_routed(document_collection, "download", {"_id": document_id})
+    await find_one_routed(
+        version_collection,
+        "download",
+        {"document_id": document_id, "version_number": random.randint(1, latest)}
+    )
+
+
+async def latest_metadata(employee_id, document_id, latest):
+    await find_one_routed(
+        version_collection, "download", {"document_id": document_id}, sort=[("version_number", DESCENDING)]
+    )
+
+
+OPERATIONS = {
+    "list_documents": (list_documents, 3),
+    "list_versions": (list_versions, 3),
+    "download_metadata": (download_metadata, 4),
+    "latest_metadata": (latest_metadata, 2),
+}
+
+
+async def run_configuration(name: str, config: dict, seeded: list, args, servers: ServerCounter) -> dict:
+    settings.mongo_listing_read_preference = config["read_preference"]
+    settings.mongo_download_read_preference = config["read_preference"]
+    settings.mongo_compressors = config["compressors"]
+    mongo.close()
+
+    started = time.perf_counter()
+    if config["warm"]:
+        await mongo.connect()
+    warmup_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    await list_documents(*seeded[0])
+    first_read_seconds = time.perf_counter() - started
+
+    timings = defaultdict(list)
+    errors = Counter()
+    names = list(OPERATIONS)
+    weights = [OPERATIONS[operation][1] for operation in names]
+    servers.reset()
+    deadline = time.perf_counter() + args.seconds
+
+    async def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            operation = rng.choices(names, weights)[0]
+            target = rng.choice(seeded)
+            began = time.perf_counter()
+            try:
+                await OPERATIONS[operation][0](*target)
+            except Exception as error:
+                errors[type(error).__name__] += 1
+                continue
+            timings[operation].append(time.perf_counter() - began)
+
+    await asyncio.gather(*[worker(index) for index in range(args.concurrency)])
+    completed = sum(len(samples) for samples in timings.values())
+    return {
+        "warmup_ms": round(warmup_seconds * 1000, 2),
+        "first_read_ms": round(first_read_seconds * 1000, 2),
+        "requests_per_second": round(completed / args.seconds, 1),
+        "operations": {operation: percentiles(samples) for operation, samples in timings.items()},
+        "errors": dict(errors),
+        "commands_by_server": servers.reset(),
+    }
+
+
+async def main_async(args) -> dict:
+    settings.mongo_max_pool_size = args.pool_size
+    settings.mongo_min_pool_size = args.min_pool_size
+    settings.mongo_wait_queue_timeout_seconds = args.wait_queue_timeout
+    servers = ServerCounter()
+    monitoring.register(servers)
+
+    from app.db.indexes import ensure_indexes
+    await ensure_indexes()
+    seeded = await seed(args)
+    results = {
+        "employees": args.employees,
+        "documents": len(seeded),
+        "versions": len(seeded) * args.versions,
+        "concurrency": args.concurrency,
+        "pool_size": args.pool_size,
+        "configurations": {},
+    }
+    try:
+        for name in args.configurations:
+            results["configurations"][name] = await run_configuration(
+                name, CONFIGURATIONS[name], seeded, args, servers
+            )
+    finally:
+        await mongo.client.drop_database(settings.database_name)
+        mongo.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--employees", type=int, default=50)
+    parser.add_argument("--documents", type=int, default=20, help="Documents per employee")
+    parser.add_argument("--versions", type=int, default=5, help="Versions per document")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=15.0, help="Duration of each configuration")
+    parser.add_argument("--pool-size", type=int, default=32)
+    parser.add_argument("--min-pool-size", type=int, default=8)
+    parser.add_argument("--wait-queue-timeout", type=float, default=5.0)
+    parser.add_argument("--configurations", nargs="+", default=list(CONFIGURATIONS), choices=list(CONFIGURATIONS))
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
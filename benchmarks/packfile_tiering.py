@@ -0,0 +1,125 @@
+# benchmarks/packfile_tiering.py
+"""
+Backup scan time and cold-read latency of loose blob files versus packfiles.
+
+Writes --files blobs of a few KB into the hash-prefix fan-out layout, then
+measures a backup-style scan (walk every directory, stat every file, read
+every byte) and the latency of reading --reads random blobs with the page
+cache dropped for that file. The same blobs are then packed with
+app.core.packs.write_pack into packs of --pack-mb, the loose files are
+removed, and both measurements are repeated against the packs, reading
+through the same memory-mapped slicing the download path uses.
+
+Page-cache eviction uses posix_fadvise(DONTNEED). It has no effect on tmpfs,
+so point --dir at a real disk for meaningful cold reads.
+
+Usage:
+    python -m benchmarks.packfile_tiering --files 20000 --reads 500 --dir /var/tmp
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from app.core.packs import PackFiles, write_pack
+from app.core.storage import LocalStorage
+from benchmarks.stats import percentiles
+
+
+def evict(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def scan(root: str) -> dict:
+    started = time.perf_counter()
+    files = total = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            os.stat(path)
+            with open(path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    total += len(chunk)
+            files += 1
+    return {"files": files, "bytes": total, "scan_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--pack-mb", type=int, default=256)
+    parser.add_argument("--dir", default=None, help="Where to create the test store (default: system temp dir)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    workdir = tempfile.mkdtemp(prefix="packfile-bench-", dir=args.dir)
+    try:
+        store = LocalStorage(os.path.join(workdir, "store"))
+        blobs = []
+        for i in range(args.files):
+            sha256 = f"{rng.getrandbits(256):064x}"
+            path = store.pointer(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(rng.randbytes(rng.randint(2_000, 8_000)))
+            blobs.append((sha256, path))
+        # Dirty pages cannot be evicted, so write everything back first
+        os.sync()
+        sample = rng.sample(blobs, min(args.reads, len(blobs)))
+
+        results = {"files": args.files, "reads": len(sample)}
+
+        cold = []
+        for sha256, path in sample:
+            evict(path)
+            started = time.perf_counter()
+            with open(path, "rb") as f:
+                f.read()
+            cold.append(time.perf_counter() - started)
+        results["loose"] = {**scan(store.blob_directory), "cold_read": percentiles(cold)}
+
+        # Pack everything, in digest order like the compaction job
+        locations = {}
+        pending, pending_bytes = [], 0
+        for sha256, path in sorted(blobs) + [(None, None)]:
+            if sha256 is not None:
+                pending.append((sha256, path))
+                pending_bytes += os.path.getsize(path)
+            if pending and (sha256 is None or pending_bytes >= args.pack_mb * 1024 * 1024):
+                name = f"{len(locations):024x}"
+                pack_path = store.pointer(f"{name}.pack")
+                os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+                for entry, offset, length in write_pack(pending, pack_path, store.pointer(f"{name}.idx")):
+                    locations[entry] = (pack_path, offset, length)
+                pending, pending_bytes = [], 0
+        for _, path in blobs:
+            os.remove(path)
+        os.sync()
+
+        packs = PackFiles()
+        cold = []
+        for sha256, _ in sample:
+            pack_path, offset, length = locations[sha256]
+            evict(pack_path)
+            started = time.perf_counter()
+            packs.read(pack_path, offset, length)
+            cold.append(time.perf_counter() - started)
+        results["packed"] = {**scan(store.blob_directory), "cold_read": percentiles(cold)}
+        results["scan_speedup"] = round(results["loose"]["scan_ms"] / results["packed"]["scan_ms"], 2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# benchmarks/stats.py
+"""
+Latency summaries shared by the benchmarks.
+"""
+
+import statistics
+from typing import Optional
+
+
+def percentiles(samples: list[float], elapsed: Optional[float] = None) -> dict:
+    """
+    Count, p50/p95/p99, mean and max in milliseconds of latencies given in
+    seconds, plus throughput when the wall-clock `elapsed` is given.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    summary = {"count": len(ordered)}
+    if elapsed is not None:
+        summary["throughput_rps"] = round(len(ordered) / elapsed, 2)
+    return {
+        **summary,
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
@@ -0,0 +1,119 @@
+# benchmarks/storage_encoding.py
+"""
+Disk savings versus download latency of the blob storage encodings.
+
+Builds a history of versions from a sample document in documents/, each one
+changing a few lines of the previous, and stores it raw, as zlib snapshots,
+and as deltas with a snapshot every --max-chain versions. Reports bytes on
+disk and the time to decode the newest version cold and from the cache.
+
+Usage:
+    python -m benchmarks.storage_encoding --versions 50 --repeat 200
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from app.core import compression
+
+
+def build_history(sample_path: str, versions: int, repeat: int) -> list[bytes]:
+    text = open(sample_path, "rb").read().decode("utf-16")
+    lines = text.splitlines() * repeat
+    rng = random.Random(42)
+    history = []
+    for number in range(versions):
+        for _ in range(3):
+            index = rng.randrange(len(lines))
+            lines[index] = f"{lines[index]} (amended in v{number + 1})"
+        history.append("\r\n".join(lines).encode("utf-16"))
+    return history
+
+
+def timed(fn, runs: int = 5) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def measure(history: list[bytes], directory: str, max_chain: int) -> dict:
+    results = {}
+
+    raw_size = sum(len(data) for data in history)
+    results["raw"] = {"disk_bytes": raw_size, "latest_decode_ms": 0.0}
+
+    # zlib snapshots of every version
+    snapshot_paths = []
+    for number, data in enumerate(history):
+        raw_path = os.path.join(directory, f"v{number}")
+        with open(raw_path, "wb") as f:
+            f.write(data)
+        snapshot_path = raw_path + ".z"
+        compression.compress_file(raw_path, snapshot_path)
+        snapshot_paths.append(snapshot_path)
+    results["zlib"] = {
+        "disk_bytes": sum(os.path.getsize(p) for p in snapshot_paths),
+        "latest_decode_ms": round(timed(lambda: compression.decompress_file(snapshot_paths[-1])), 3),
+    }
+
+    # deltas against the previous version, snapshot every max_chain versions
+    stored = []  # (kind, payload)
+    chain = 0
+    for number, data in enumerate(history):
+        if number and chain < max_chain:
+            delta = compression.make_delta(history[number - 1], data)
+            snapshot = open(snapshot_paths[number], "rb").read()
+            if len(delta) < len(snapshot):
+                stored.append(("delta", delta))
+                chain += 1
+                continue
+        stored.append(("zlib", open(snapshot_paths[number], "rb").read()))
+        chain = 0
+
+    def decode_latest() -> bytes:
+        start = len(stored) - 1
+        while stored[start][0] == "delta":
+            start -= 1
+        data = compression.zlib.decompress(stored[start][1])
+        for _, delta in stored[start + 1:]:
+            data = compression.apply_delta(data, delta)
+        return data
+
+    assert decode_latest() == history[-1]
+    cache = {"latest": decode_latest()}
+    results["delta"] = {
+        "disk_bytes": sum(len(payload) for _, payload in stored),
+        "latest_decode_ms": round(timed(decode_latest), 3),
+        "latest_cached_ms": round(timed(lambda: cache["latest"], runs=1000), 5),
+        "max_chain_length": max_chain,
+    }
+
+    for mode in results.values():
+        mode["ratio_vs_raw"] = round(mode["disk_bytes"] / raw_size, 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sample", default="documents/contract.txt")
+    parser.add_argument("--versions", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="Repeat the sample's lines this many times to make a larger document")
+    parser.add_argument("--max-chain", type=int, default=8)
+    args = parser.parse_args()
+
+    history = build_history(args.sample, args.versions, args.repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        results = measure(history, directory, args.max_chain)
+    results["document_bytes"] = len(history[-1])
+    results["versions"] = args.versions
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
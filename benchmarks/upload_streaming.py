@@ -0,0 +1,98 @@
+# benchmarks/upload_streaming.py
+"""
+Compares the old buffered upload path with the chunked streaming path.
+
+For each file size it reports the Python heap peak (tracemalloc), the wall
+time of the copy, and the longest event-loop stall observed by a ticker task
+running alongside the upload.
+
+Usage:
+    python -m benchmarks.upload_streaming --sizes 1 10 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+from app.core.storage import stream_upload_to_disk
+
+
+async def buffered_copy(file: UploadFile, destination: str) -> None:
+    # The original implementation from app/core/document.py
+    with open(destination, "wb") as buffer:
+        buffer.write(await file.read())
+
+
+async def loop_ticker(stop: asyncio.Event, stalls: list) -> None:
+    interval = 0.001
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+
+def make_source(directory: str, size_mb: int) -> str:
+    path = os.path.join(directory, f"source-{size_mb}mb.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return path
+
+
+async def measure(copy, source: str, destination: str) -> dict:
+    with open(source, "rb") as handle:
+        upload = UploadFile(file=handle, filename=os.path.basename(source))
+
+        stop = asyncio.Event()
+        stalls: list = []
+        ticker = asyncio.create_task(loop_ticker(stop, stalls))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        await copy(upload, destination)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stop.set()
+        await ticker
+
+    return {
+        "seconds": round(elapsed, 4),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+        "max_loop_stall_ms": round(max(stalls, default=0.0) * 1000, 2),
+    }
+
+
+async def run(sizes: list) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size_mb in sizes:
+            source = make_source(directory, size_mb)
+            destination = os.path.join(directory, "destination.bin")
+            results.append({
+                "size_mb": size_mb,
+                "buffered": await measure(buffered_copy, source, destination),
+                "streaming": await measure(stream_upload_to_disk, source, destination),
+            })
+            os.remove(source)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50],
+                        help="File sizes to test, in megabytes")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.sizes)), indent=2))
+
+
+if __name__ == "__main__":
+    main()